@@ -15,6 +15,8 @@ valid_environments = (
 app_wide_context = {}
 if dc_env := os.environ.get("DC_ENVIRONMENT"):
     app_wide_context["dc-environment"] = dc_env
+if storage_format := os.environ.get("LOGS_STORAGE_FORMAT"):
+    app_wide_context["logs-storage-format"] = storage_format
 
 app = App(context=app_wide_context)
 
@@ -9,6 +9,27 @@ from constructs import Construct
 from models.models import BaseQuery
 
 
+def render_query(query: BaseQuery) -> str:
+    query_directory = Path(__file__).resolve().parent.parent / "queries"
+    query_file_path = query_directory / query.creation_context.get(
+        "query_file_path"
+    )
+
+    with query_file_path.open("r") as file:
+        query_raw = file.read()
+
+    return Template(query_raw).substitute(**query.creation_context)
+
+
+def query_version(query: BaseQuery) -> str:
+    """
+    A hash of the query as deployed. This is stored in the named query's
+    description, and passed to the query Lambda as `QueryVersion` so it can
+    tell when its cached copy of the query is out of date.
+    """
+    return hashlib.md5(render_query(query).encode("utf-8")).hexdigest()
+
+
 class AthenaNamedQueryFromModel(Construct):
     def __init__(
         self,
@@ -19,26 +40,14 @@ class AthenaNamedQueryFromModel(Construct):
     ) -> None:
         super().__init__(scope, resource_id)
 
-        query_directory = Path(__file__).resolve().parent.parent / "queries"
-        query_file_path = query_directory / query.creation_context.get(
-            "query_file_path"
-        )
-
-        with query_file_path.open("r") as file:
-            query_raw = file.read()
-
-        query_str = Template(query_raw).substitute(**query.creation_context)
-
-        query_hash = hashlib.md5(query_str.encode("utf-8")).hexdigest()
-
-        description = f"Version: {query_hash}"
+        description = f"Version: {query_version(query)}"
 
         # Create the Athena named query
         self.named_query = athena.CfnNamedQuery(
             self,
             "AthenaNamedQuery",
             database=query.database.database_name,
-            query_string=query_str,
+            query_string=render_query(query),
             name=query.name,
             description=description,
             work_group=workgroup_name,
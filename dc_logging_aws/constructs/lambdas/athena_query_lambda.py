@@ -51,6 +51,7 @@ class AthenaQueryLambda(Construct):
                     "athena:StartQueryExecution",
                     "athena:GetQueryExecution",
                     "athena:GetNamedQuery",
+                    "athena:BatchGetNamedQuery",
                     "athena:ListNamedQueries",
                 ],
                 resources=["*"],
@@ -59,7 +60,19 @@ class AthenaQueryLambda(Construct):
         # glue permissions
         self.lambda_function.add_to_role_policy(
             iam.PolicyStatement(
-                actions=["glue:GetDatabase", "glue:GetTable"],
+                actions=[
+                    "glue:GetDatabase",
+                    "glue:GetTable",
+                    # For CREATE TABLE AS and DROP TABLE queries
+                    "glue:CreateTable",
+                    "glue:DeleteTable",
+                    # For INSERT INTO queries, which add partitions
+                    "glue:GetPartition",
+                    "glue:GetPartitions",
+                    "glue:BatchGetPartition",
+                    "glue:CreatePartition",
+                    "glue:BatchCreatePartition",
+                ],
                 resources=["*"],
             )
         )
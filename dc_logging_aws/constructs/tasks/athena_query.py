@@ -0,0 +1,114 @@
+from aws_cdk import aws_stepfunctions as sfn
+from aws_cdk import aws_stepfunctions_tasks as tasks
+from constructs import Construct
+
+
+class AthenaQueryTask(Construct):
+    """
+    A construct that starts an Athena query with the query Lambda, then
+    polls for it to finish from Step Functions. Nothing is left running
+    while the query does, and long queries aren't limited by the Lambda
+    timeout.
+
+    The query execution ID is assigned to `query_execution_id_variable`,
+    which must be unique within the state machine, and the S3 URI of the
+    results to the variable named by `output_location_variable`.
+    """
+
+    def __init__(
+        self,
+        scope: Construct,
+        construct_id: str,
+        task_name: str,
+        athena_lambda_function,
+        payload: dict,
+        query_execution_id_variable: str,
+        max_poll_interval_seconds: int = 30,
+    ) -> None:
+        super().__init__(scope, construct_id)
+
+        query_id = f"${query_execution_id_variable}"
+        # Checked after 1 second, then the wait doubles on each poll
+        wait_variable = f"{query_execution_id_variable}_wait"
+        status_variable = f"{query_execution_id_variable}_status"
+        self.output_location_variable = (
+            f"{query_execution_id_variable}_output_location"
+        )
+
+        start_task = tasks.LambdaInvoke(
+            self,
+            f"{task_name} Execution",
+            lambda_function=athena_lambda_function,
+            payload=sfn.TaskInput.from_object(payload),
+            query_language=sfn.QueryLanguage.JSONATA,
+            assign={
+                query_execution_id_variable: "{% $states.result.Payload.queryExecutionId %}",
+                wait_variable: 1,
+            },
+        )
+
+        wait_task = sfn.Wait(
+            self,
+            f"{task_name} Wait",
+            time=sfn.WaitTime.timestamp(
+                f"{{% $fromMillis($toMillis($now()) + ${wait_variable} * 1000) %}}"
+            ),
+            query_language=sfn.QueryLanguage.JSONATA,
+        )
+
+        check_task = tasks.CallAwsService(
+            self,
+            f"{task_name} Check Status",
+            service="athena",
+            action="getQueryExecution",
+            parameters={"QueryExecutionId": f"{{% {query_id} %}}"},
+            iam_resources=["*"],
+            iam_action="athena:GetQueryExecution",
+            query_language=sfn.QueryLanguage.JSONATA,
+            assign={
+                status_variable: "{% $states.result.QueryExecution.Status %}",
+                self.output_location_variable: "{% $states.result.QueryExecution.ResultConfiguration.OutputLocation %}",
+                wait_variable: f"{{% $min([${wait_variable} * 2, {max_poll_interval_seconds}]) %}}",
+            },
+        )
+
+        succeeded = sfn.Pass(
+            self,
+            f"{task_name} Succeeded",
+            query_language=sfn.QueryLanguage.JSONATA,
+        )
+        failed = sfn.Fail(
+            self,
+            f"{task_name} Failed",
+            query_language=sfn.QueryLanguage.JSONATA,
+            error="AthenaQueryFailed",
+            cause=(
+                f"{{% $exists(${status_variable}.StateChangeReason)"
+                f" ? ${status_variable}.StateChangeReason"
+                f" : ${status_variable}.State %}}"
+            ),
+        )
+
+        finished = (
+            sfn.Choice(
+                self,
+                f"{task_name} Finished?",
+                query_language=sfn.QueryLanguage.JSONATA,
+            )
+            .when(
+                sfn.Condition.jsonata(
+                    f"{{% ${status_variable}.State = 'SUCCEEDED' %}}"
+                ),
+                succeeded,
+            )
+            .when(
+                sfn.Condition.jsonata(
+                    f"{{% ${status_variable}.State in ['FAILED', 'CANCELLED'] %}}"
+                ),
+                failed,
+            )
+            .otherwise(wait_task)
+        )
+
+        start_task.next(wait_task).next(check_task).next(finished)
+        self.task = sfn.Chain.custom(start_task, [succeeded], succeeded)
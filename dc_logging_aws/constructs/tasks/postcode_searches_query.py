@@ -5,6 +5,8 @@ from aws_cdk import aws_s3 as s3
 from aws_cdk import aws_stepfunctions as sfn
 from aws_cdk import aws_stepfunctions_tasks as tasks
 from constructs import Construct
+from constructs.athena_named_query_from_model import query_version
+from constructs.tasks.athena_query import AthenaQueryTask
 from models.buckets import postcode_searches_results_bucket
 from models.models import BaseQuery
 
@@ -27,10 +29,10 @@ class PostcodeSearchesQueryTask(Construct):
     ) -> None:
         super().__init__(scope, construct_id)
 
+        # Reports run against the logs for the election period, already
+        # filtered into `$slice_table`
         base_config = {
-            "start_of_election_period_day": "{% $start_of_election_period_day_athena %}",
-            "polling_day": "{% $polling_day_athena %}",
-            "updown_api_key": "{% $updown_api_key %}",
+            "slice_table": "{% $slice_table %}",
             "end_datetime_utc": "{% $close_of_polls_utc %}",
             "end_datetime_london": "{% $close_of_polls_london %}",
         }
@@ -58,27 +60,22 @@ class PostcodeSearchesQueryTask(Construct):
             )
 
         query_context = period_configs[period_type]
-        query_context["updown_api_key"] = "{% $updown_api_key %}"
 
         if result_variable_name is None:
             result_variable_name = query.name
 
-        # Create the query execution task
-        query_task = tasks.LambdaInvoke(
+        # Start the query, and wait for it to finish
+        query_task = AthenaQueryTask(
             self,
-            f"{task_name} Execution",
-            lambda_function=athena_lambda_function,
-            payload=sfn.TaskInput.from_object(
-                {
-                    "QueryContext": query_context,
-                    "QueryName": query.name,
-                    "blocking": True,
-                }
-            ),
-            query_language=sfn.QueryLanguage.JSONATA,
-            assign={
-                result_variable_name: "{% $states.result.Payload.queryExecutionId %}"
+            "Query",
+            task_name=task_name,
+            athena_lambda_function=athena_lambda_function,
+            payload={
+                "QueryContext": query_context,
+                "QueryName": query.name,
+                "QueryVersion": query_version(query),
             },
+            query_execution_id_variable=result_variable_name,
         )
 
         results_bucket = s3.Bucket.from_bucket_name(
@@ -88,11 +85,9 @@ class PostcodeSearchesQueryTask(Construct):
         )
         bucket_name = results_bucket.bucket_name
         copy_source = (
-            "{% '"
-            + bucket_name
-            + "/postcode-searches-athena-results/' & $"
-            + result_variable_name
-            + " & '.csv' %}"
+            "{% $substringAfter($"
+            + query_task.output_location_variable
+            + ", 's3://') %}"
         )
         dest_key = (
             "{% $polling_day_athena & '/" + result_variable_name + ".csv' %}"
@@ -118,4 +113,4 @@ class PostcodeSearchesQueryTask(Construct):
             query_language=sfn.QueryLanguage.JSONATA,
         )
 
-        self.task = query_task.next(copy_task)
+        self.task = query_task.task.next(copy_task)
@@ -1,6 +1,10 @@
 from datetime import date, datetime, time, timedelta
 from zoneinfo import ZoneInfo
 
+# The hourly rollup for each hour of logs runs at 10 minutes past the next
+# hour. Allow it time to finish before reports rely on it.
+ROLLUP_DELAY = timedelta(minutes=20)
+
 
 def handler(event, context):
     """
@@ -45,6 +49,10 @@ def handler(event, context):
         polling_day, time(0, 0, tzinfo=ZoneInfo("Europe/London"))
     )
 
+    # Reports read the hourly rollup for hours of logs before this, and the
+    # logs themselves from it onwards
+    rollup_cutoff = get_rollup_cutoff(datetime.now(tz=ZoneInfo("UTC")))
+
     return {
         "polling_day_athena": polling_day.strftime("%Y/%m/%d"),
         "start_of_election_period_day_athena": start_of_election_period.strftime(
@@ -68,6 +76,8 @@ def handler(event, context):
         "start_of_polling_day_london": london_athena_time(
             start_of_polling_day_dt
         ),
+        "rollup_cutoff_day_athena": rollup_cutoff.strftime("%Y/%m/%d"),
+        "rollup_cutoff_hour": rollup_cutoff.hour,
     }
 
 
@@ -109,6 +119,14 @@ def get_election_period_start(polling_day: date) -> date:
     return date(prev_year, prev_month, 1)
 
 
+def get_rollup_cutoff(now: datetime) -> datetime:
+    """
+    The start of the first hour of logs (in UTC, like the `day` and `hour`
+    partitions) that might not have been rolled up yet
+    """
+    return (now - ROLLUP_DELAY).replace(minute=0, second=0, microsecond=0)
+
+
 def utc_athena_time(dt: datetime) -> str:
     return datetime_to_athena_datetime_string(dt, ZoneInfo("UTC"))
 
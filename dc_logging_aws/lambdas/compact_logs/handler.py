@@ -0,0 +1,474 @@
+"""
+Merges the small gzip files Firehose writes for each product and hour of logs
+into one file (or a few, for busy hours), so Athena opens far fewer files when
+scanning long periods.
+
+The Lambda compacts the hour that closed `CLOSED_AFTER` ago. To compact other
+hours, e.g. the backlog from before this existed, run this locally:
+
+    python dc_logging_aws/lambdas/compact_logs/handler.py \
+        --bucket dc-monitoring-dev-logging \
+        --start 2024-04-01T00 --end 2024-05-01T00
+
+Each compaction is recorded in a manifest, under `{prefix}-compaction/`
+alongside the logs. The merged files are staged there too, and only copied
+into the partition once complete. The files they replace are then deleted
+with a single request. S3 can't swap files atomically, so queries running at
+that moment could count those logs twice. If a run is interrupted after the
+manifest is written, the next run, whichever hour it compacts, finishes the
+swap. Manifests are copied under `{prefix}-compaction/pending/` until their
+swap is done, so each run can find them without listing every hour.
+
+Files directly under the hour, from the stream that isn't partitioned by
+product, are first split into each product's partition. The hourly rollup
+does this too, with `partition_handler`, before it counts the hour, and
+`partition_history.py` does it for every hour at once.
+"""
+
+import argparse
+import datetime
+import gzip
+import json
+import logging
+import os
+import tempfile
+from collections import defaultdict
+from typing import Dict, List
+
+import boto3
+
+# Firehose buffers records for up to 15 minutes, and retries failed
+# deliveries after that, so hours are left this long before compacting them
+CLOSED_AFTER = datetime.timedelta(hours=2)
+
+# Busy hours are split into files of about this size, compressed. Athena reads
+# each gzip file with a single reader.
+TARGET_FILE_SIZE = 128 * 1024 * 1024
+# Merged files larger than this are written to disk until uploaded
+SPOOLED_FILE_MAX_SIZE = 32 * 1024 * 1024
+READ_CHUNK_SIZE = 1024 * 1024
+
+COMPACTED_FILE_PREFIX = "compacted-"
+
+# The field each log entry's partition is named from
+PRODUCT_PARTITION_KEY = "dc_product"
+
+s3_client = boto3.client("s3")
+
+logger = logging.getLogger(__name__)
+
+
+def closed_hour(now: datetime.datetime) -> datetime.datetime:
+    """
+    The latest hour that's safe to compact
+    """
+    return (now - CLOSED_AFTER).replace(minute=0, second=0, microsecond=0)
+
+
+def utc_hour(hour: datetime.datetime) -> datetime.datetime:
+    """
+    The start of the hour, in UTC without a time zone, as the paths are
+    """
+    if hour.tzinfo:
+        hour = hour.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return hour.replace(minute=0, second=0, microsecond=0)
+
+
+def hour_path(hour: datetime.datetime) -> str:
+    # Matches Firehose's `!{timestamp:yyyy/MM/dd/HH}` prefix
+    return hour.strftime("%Y/%m/%d/%H")
+
+
+def manifest_prefix(prefix: str, hour: datetime.datetime) -> str:
+    return f"{prefix}-compaction/manifests/{hour_path(hour)}/"
+
+
+def pending_prefix(prefix: str) -> str:
+    return f"{prefix}-compaction/pending/"
+
+
+def pending_key(manifest: dict) -> str:
+    return manifest["manifest_key"].replace(
+        "-compaction/manifests/", "-compaction/pending/", 1
+    )
+
+
+def list_hour_files(bucket: str, prefix: str, hour: datetime.datetime):
+    """
+    The path of each file for the hour, relative to the hour, split on "/"
+    """
+    hour_prefix = f"{prefix}/{hour_path(hour)}/"
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=hour_prefix):
+        for item in page.get("Contents", []):
+            path = item["Key"][len(hour_prefix) :].split("/")
+            # Athena ignores files starting with _ or .
+            if path[-1].startswith(("_", ".")):
+                continue
+            yield path
+
+
+def list_partition_files(
+    bucket: str, prefix: str, hour: datetime.datetime
+) -> Dict[str, List[str]]:
+    """
+    The keys of the files in each product's partition for the hour
+    """
+    files = defaultdict(list)
+    for path in list_hour_files(bucket, prefix, hour):
+        if len(path) == 2:
+            files[path[0]].append(
+                f"{prefix}/{hour_path(hour)}/{'/'.join(path)}"
+            )
+    return {product: sorted(keys) for product, keys in files.items()}
+
+
+def split_file(bucket: str, key: str) -> bool:
+    """
+    Split a file directly under its hour into a file of the same name in the
+    partition of each product it has logs for, then delete it. Returns False
+    if it can't be split, leaving it where it is.
+
+    The parts are written before the file is deleted, and always to the same
+    keys, so an interrupted split is finished by running it again.
+    """
+    hour_prefix, name = key.rsplit("/", 1)
+    parts = {}
+    body = s3_client.get_object(Bucket=bucket, Key=key)["Body"]
+    try:
+        with gzip.GzipFile(fileobj=body, mode="rb") as source:
+            for line in source:
+                if not line.strip():
+                    continue
+                product = json.loads(line)[PRODUCT_PARTITION_KEY]
+                if product not in parts:
+                    data = tempfile.SpooledTemporaryFile(
+                        max_size=SPOOLED_FILE_MAX_SIZE
+                    )
+                    parts[product] = (
+                        data,
+                        gzip.GzipFile(fileobj=data, mode="wb"),
+                    )
+                parts[product][1].write(line.rstrip(b"\n") + b"\n")
+    except (ValueError, KeyError, TypeError) as error:
+        # Left where it is for someone to look at, rather than failing
+        # every compaction of the hour. Its logs are missing from the table
+        # until then.
+        logger.error("Can't split %s: %r", key, error)
+        for data, _ in parts.values():
+            data.close()
+        return False
+
+    for product, (data, compressed) in parts.items():
+        compressed.close()
+        with data:
+            data.seek(0)
+            s3_client.upload_fileobj(
+                data, bucket, f"{hour_prefix}/{product}/{name}"
+            )
+    s3_client.delete_object(Bucket=bucket, Key=key)
+    return True
+
+
+def unpartitioned_hour_files(
+    bucket: str, prefix: str, hour: datetime.datetime
+) -> List[str]:
+    """
+    Keys of the files directly under the hour, which the table doesn't read
+    """
+    hour_prefix = f"{prefix}/{hour_path(hour)}/"
+    return [
+        f"{hour_prefix}{path[0]}"
+        for path in list_hour_files(bucket, prefix, hour)
+        if len(path) == 1
+    ]
+
+
+def partition_unpartitioned_files(
+    bucket: str, prefix: str, hour: datetime.datetime
+) -> List[str]:
+    """
+    Split each file directly under the hour into each product's partition,
+    with `split_file`. Returns the keys of the files that were split.
+    """
+    return [
+        key
+        for key in unpartitioned_hour_files(bucket, prefix, hour)
+        if split_file(bucket, key)
+    ]
+
+
+def merge_files(bucket: str, keys: List[str]):
+    """
+    Decompress `keys` and write them to new gzip files of about
+    `TARGET_FILE_SIZE`, yielding each one when complete
+    """
+    data = compressed = None
+    for key in keys:
+        if compressed is None:
+            data = tempfile.SpooledTemporaryFile(max_size=SPOOLED_FILE_MAX_SIZE)
+            compressed = gzip.GzipFile(fileobj=data, mode="wb")
+
+        body = s3_client.get_object(Bucket=bucket, Key=key)["Body"]
+        last_byte = b"\n"
+        with gzip.GzipFile(fileobj=body, mode="rb") as source:
+            while chunk := source.read(READ_CHUNK_SIZE):
+                compressed.write(chunk)
+                last_byte = chunk[-1:]
+        # Keep one log entry per line, if a file doesn't end with a newline
+        if last_byte != b"\n":
+            compressed.write(b"\n")
+
+        if data.tell() >= TARGET_FILE_SIZE:
+            compressed.close()
+            data.seek(0)
+            yield data
+            compressed = None
+
+    if compressed is not None:
+        compressed.close()
+        data.seek(0)
+        yield data
+
+
+def write_manifest(bucket: str, manifest: dict, key: str = None):
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=key or manifest["manifest_key"],
+        Body=json.dumps(manifest, indent=2).encode("utf-8"),
+        ContentType="application/json",
+    )
+
+
+def finish_pending_compactions(bucket: str, prefix: str):
+    """
+    Finish the swap for every manifest that was staged but not completed,
+    for any hour
+    """
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(
+        Bucket=bucket, Prefix=pending_prefix(prefix)
+    ):
+        for item in page.get("Contents", []):
+            manifest = json.load(
+                s3_client.get_object(Bucket=bucket, Key=item["Key"])["Body"]
+            )
+            finish_compaction(bucket, manifest)
+
+
+def finish_compaction(bucket: str, manifest: dict) -> dict:
+    """
+    Swap the staged files in `manifest` into the partition. Safe to repeat,
+    if a previous attempt was interrupted.
+    """
+    for output in manifest["outputs"]:
+        try:
+            s3_client.copy_object(
+                Bucket=bucket,
+                Key=output["key"],
+                CopySource={"Bucket": bucket, "Key": output["staged_key"]},
+            )
+        except s3_client.exceptions.ClientError as error:
+            # Already copied, and the staged file deleted
+            if error.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+                raise
+
+    outputs = {output["key"] for output in manifest["outputs"]}
+    to_delete = [key for key in manifest["sources"] if key not in outputs] + [
+        output["staged_key"] for output in manifest["outputs"]
+    ]
+    # At most 1,000 keys per request
+    for i in range(0, len(to_delete), 1000):
+        s3_client.delete_objects(
+            Bucket=bucket,
+            Delete={
+                "Objects": [{"Key": key} for key in to_delete[i : i + 1000]],
+                "Quiet": True,
+            },
+        )
+
+    manifest = {
+        **manifest,
+        "status": "complete",
+        "completed_at": datetime.datetime.now(
+            datetime.timezone.utc
+        ).isoformat(),
+    }
+    write_manifest(bucket, manifest)
+    s3_client.delete_object(Bucket=bucket, Key=pending_key(manifest))
+    return manifest
+
+
+def compact_partition(
+    bucket: str,
+    prefix: str,
+    hour: datetime.datetime,
+    product: str,
+    keys: List[str],
+    dry_run: bool = False,
+) -> dict:
+    """
+    Merge the files in a product's partition for an hour
+    """
+    partition_path = f"{prefix}/{hour_path(hour)}/{product}/"
+    staging_path = f"{prefix}-compaction/staging/{hour_path(hour)}/{product}/"
+    manifest = {
+        "manifest_key": f"{manifest_prefix(prefix, hour)}{product}.json",
+        "hour": hour.isoformat(),
+        "dc_product": product,
+        "sources": keys,
+        "outputs": [],
+        "status": "staged",
+        "started_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }
+    if dry_run:
+        return {**manifest, "status": "dry run"}
+
+    for part, data in enumerate(merge_files(bucket, keys)):
+        name = f"{COMPACTED_FILE_PREFIX}{hour:%Y%m%d%H}-{part}.gz"
+        with data:
+            size = data.seek(0, os.SEEK_END)
+            data.seek(0)
+            s3_client.upload_fileobj(data, bucket, f"{staging_path}{name}")
+        manifest["outputs"].append(
+            {
+                "key": f"{partition_path}{name}",
+                "staged_key": f"{staging_path}{name}",
+                "bytes": size,
+            }
+        )
+
+    # Recorded as pending first, so that the swap is finished if the run is
+    # interrupted from here on
+    write_manifest(bucket, manifest, pending_key(manifest))
+    write_manifest(bucket, manifest)
+    return finish_compaction(bucket, manifest)
+
+
+def compact_hour(
+    bucket: str, prefix: str, hour: datetime.datetime, dry_run: bool = False
+) -> List[dict]:
+    """
+    Compact each product's partition for the hour that has more than one
+    file, returning their manifests
+    """
+    if not dry_run:
+        # Finish any compactions that were interrupted, before their
+        # sources are compacted again
+        finish_pending_compactions(bucket, prefix)
+        partition_unpartitioned_files(bucket, prefix, hour)
+
+    manifests = []
+    for product, keys in list_partition_files(bucket, prefix, hour).items():
+        if len(keys) < 2:
+            continue
+        manifests.append(
+            compact_partition(bucket, prefix, hour, product, keys, dry_run)
+        )
+    return manifests
+
+
+def summary(manifest: dict) -> dict:
+    return {
+        "hour": manifest["hour"],
+        "dc_product": manifest["dc_product"],
+        "status": manifest["status"],
+        "files": len(manifest["sources"]),
+        "compacted_files": len(manifest["outputs"]),
+    }
+
+
+def handler(event, context):
+    """
+    Compact the logs for `event["hour"]`, an ISO 8601 date and hour, or the
+    latest closed hour if not given. `failed_files` lists the files that
+    couldn't be split into each product's partition, so are still missing
+    from the table.
+    """
+    if event.get("hour"):
+        hour = utc_hour(datetime.datetime.fromisoformat(event["hour"]))
+    else:
+        hour = utc_hour(
+            closed_hour(datetime.datetime.now(datetime.timezone.utc))
+        )
+
+    bucket, prefix = os.environ["BUCKET_NAME"], os.environ["PREFIX"]
+    manifests = compact_hour(bucket, prefix, hour)
+    return {
+        "hour": hour.isoformat(),
+        "compactions": [summary(manifest) for manifest in manifests],
+        "failed_files": unpartitioned_hour_files(bucket, prefix, hour),
+    }
+
+
+def partition_handler(event, context):
+    """
+    Split the files directly under the hour `event["hour"]`, an ISO 8601
+    date and hour, into each product's partition. The hourly rollup runs
+    this first, so the logs from the stream that isn't partitioned by
+    product are counted. `failed_files` lists the files that couldn't be
+    split, so are left out of the count.
+    """
+    hour = utc_hour(datetime.datetime.fromisoformat(event["hour"]))
+    bucket, prefix = os.environ["BUCKET_NAME"], os.environ["PREFIX"]
+    split = partition_unpartitioned_files(bucket, prefix, hour)
+    return {
+        "hour": hour.isoformat(),
+        "split_files": len(split),
+        "failed_files": unpartitioned_hour_files(bucket, prefix, hour),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compact the logs Firehose wrote for a range of hours"
+    )
+    parser.add_argument(
+        "--bucket",
+        required=True,
+        help="Logs bucket, e.g. dc-monitoring-dev-logging",
+    )
+    parser.add_argument(
+        "--prefix",
+        default="dc-postcode-searches",
+        help="Logs prefix, without a trailing slash",
+    )
+    parser.add_argument(
+        "--start",
+        type=datetime.datetime.fromisoformat,
+        required=True,
+        help="First hour to compact, in UTC (YYYY-mm-DDTHH)",
+    )
+    parser.add_argument(
+        "--end",
+        type=datetime.datetime.fromisoformat,
+        required=True,
+        help="Hour to stop before, in UTC (YYYY-mm-DDTHH)",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="List the partitions that would be compacted",
+    )
+    options = parser.parse_args()
+
+    latest_end = closed_hour(
+        datetime.datetime.now(datetime.timezone.utc)
+    ).replace(tzinfo=None) + datetime.timedelta(hours=1)
+    if options.end > latest_end:
+        parser.error(
+            f"--end can't be after {latest_end:%Y-%m-%dT%H}, as later hours "
+            "may still be written to"
+        )
+
+    hour = options.start.replace(minute=0, second=0, microsecond=0)
+    while hour < options.end:
+        for manifest in compact_hour(
+            options.bucket, options.prefix, hour, options.dry_run
+        ):
+            print(json.dumps(summary(manifest)))
+        hour += datetime.timedelta(hours=1)
+
+
+if __name__ == "__main__":
+    main()
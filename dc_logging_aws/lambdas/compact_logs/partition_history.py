@@ -0,0 +1,96 @@
+"""
+Moves every log file written directly under its hour, from before the logs
+were partitioned by product, into each product's partition. Run this once,
+straight after deploying the product partitioned table:
+
+    python dc_logging_aws/lambdas/compact_logs/partition_history.py \
+        --bucket dc-monitoring-dev-logging
+
+The files are found with a single listing of the prefix, rather than one per
+hour, and split a few at a time. Each file is deleted once its parts are
+written, so if this is interrupted, running it again picks up where it left
+off.
+"""
+
+import argparse
+import concurrent.futures
+import re
+import sys
+from typing import Iterator
+
+from handler import s3_client, split_file
+
+# `YYYY/MM/DD/HH/name`, relative to the prefix
+UNPARTITIONED_FILE = re.compile(r"\d{4}/\d{2}/\d{2}/\d{2}/[^/]+")
+
+
+def unpartitioned_files(bucket: str, prefix: str) -> Iterator[str]:
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=f"{prefix}/"):
+        for item in page.get("Contents", []):
+            path = item["Key"][len(prefix) + 1 :]
+            name = path.rsplit("/", 1)[-1]
+            # Athena ignores files starting with _ or .
+            if UNPARTITIONED_FILE.fullmatch(path) and not name.startswith(
+                ("_", ".")
+            ):
+                yield item["Key"]
+
+
+def main(args=None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Move the logs from before they were partitioned by "
+        "product into each product's partition"
+    )
+    parser.add_argument(
+        "--bucket",
+        required=True,
+        help="Logs bucket, e.g. dc-monitoring-dev-logging",
+    )
+    parser.add_argument(
+        "--prefix",
+        default="dc-postcode-searches",
+        help="Logs prefix, without a trailing slash",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=16,
+        help="Number of files to split at once",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="List the files that would be split",
+    )
+    options = parser.parse_args(args)
+
+    keys = list(unpartitioned_files(options.bucket, options.prefix))
+    if options.dry_run:
+        for key in keys:
+            print(key)
+        print(f"{len(keys)} files to split")
+        return 0
+
+    failed = []
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=options.workers
+    ) as pool:
+        futures = {
+            pool.submit(split_file, options.bucket, key): key for key in keys
+        }
+        for future in concurrent.futures.as_completed(futures):
+            if not future.result():
+                failed.append(futures[future])
+
+    print(f"Split {len(keys) - len(failed)} of {len(keys)} files")
+    if failed:
+        print("These couldn't be split, and are still under their hour:")
+        for key in sorted(failed):
+            print(f"  {key}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
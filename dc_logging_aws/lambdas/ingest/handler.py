@@ -1,17 +1,124 @@
 import os
+import random
+import time
 
-import boto3
+import botocore.session
 import log_entries
+from botocore.exceptions import BotoCoreError, ClientError
 
-firehose_client = boto3.client("firehose", region_name="eu-west-2")
+# Everything here runs once per execution environment, so cold starts should
+# do as little as possible. botocore on its own is much quicker to import
+# than boto3, and the client only loads the Firehose service model.
+firehose_client = botocore.session.get_session().create_client(
+    "firehose", region_name="eu-west-2"
+)
 stream_name = os.environ["STREAM_NAME"]
-entry_class_name = os.environ["ENTRY_CLASS"]
+entry_class = getattr(log_entries, os.environ["ENTRY_CLASS"])
+
+# Firehose's limits for a single PutRecordBatch request
+MAX_BATCH_RECORDS = 500
+MAX_BATCH_BYTES = 4 * 1024 * 1024
+
+# Records Firehose rejects, normally because it's throttling us, are retried
+# with exponential backoff
+MAX_ATTEMPTS = 5
+BACKOFF_BASE_SECONDS = 0.1
 
 
 def handler(event, context):
-    entry_class = getattr(log_entries, entry_class_name)
-    log_entry: log_entries.BaseLogEntry = entry_class(**event)
-    return firehose_client.put_record(
-        DeliveryStreamName=stream_name,
-        Record={"Data": log_entry.as_log_line()},
-    )
+    """
+    Relays log entries to Firehose.
+
+    `event` is either a single entry or, from buffered clients, a list of
+    them. Returns a summary with the status of each entry, in order.
+    """
+    entries = event if isinstance(event, list) else [event]
+
+    statuses = [None] * len(entries)
+    lines = {}
+    for i, entry in enumerate(entries):
+        try:
+            log_entry: log_entries.BaseLogEntry = entry_class(**entry)
+        except (TypeError, ValueError) as e:
+            statuses[i] = {"status": "invalid", "error": str(e)}
+            continue
+        lines[i] = log_entry.as_log_line().encode("utf-8")
+
+    for chunk in batch_chunks(lines):
+        put_record_batch_with_retries(chunk, lines, statuses)
+
+    summary = {
+        status: sum(1 for s in statuses if s["status"] == status)
+        for status in ("sent", "failed", "invalid")
+    }
+    if summary["failed"] or summary["invalid"]:
+        print(f"Not all entries were sent: {summary}")
+    return {**summary, "statuses": statuses}
+
+
+def batch_chunks(lines: dict):
+    """
+    Split the indexes of `lines` into chunks within Firehose's limits
+    """
+    chunk = []
+    chunk_bytes = 0
+    for i, line in lines.items():
+        if chunk and (
+            len(chunk) >= MAX_BATCH_RECORDS
+            or chunk_bytes + len(line) > MAX_BATCH_BYTES
+        ):
+            yield chunk
+            chunk, chunk_bytes = [], 0
+        chunk.append(i)
+        chunk_bytes += len(line)
+    if chunk:
+        yield chunk
+
+
+def put_record_batch_with_retries(chunk: list, lines: dict, statuses: list):
+    """
+    Put the lines for the indexes in `chunk`, retrying only the records
+    Firehose reports as failed. Sets the status for each index.
+
+    Requests that fail outright are retried too, rather than raised. Lambda
+    would otherwise retry the whole event, sending again any chunks that
+    were already delivered.
+    """
+    pending = chunk
+    for attempt in range(MAX_ATTEMPTS):
+        if attempt:
+            # "Full jitter" backoff, so concurrent invocations being
+            # throttled don't all retry at once
+            time.sleep(random.uniform(0, BACKOFF_BASE_SECONDS * 2**attempt))
+
+        try:
+            response = firehose_client.put_record_batch(
+                DeliveryStreamName=stream_name,
+                Records=[{"Data": lines[i]} for i in pending],
+            )
+        except (BotoCoreError, ClientError) as e:
+            # e.g. throttling, or the connection failing
+            for i in pending:
+                statuses[i] = {
+                    "status": "failed",
+                    "error": str(e),
+                    "attempts": attempt + 1,
+                }
+            continue
+        failed = []
+        for i, result in zip(pending, response["RequestResponses"]):
+            if result.get("ErrorCode"):
+                failed.append(i)
+                statuses[i] = {
+                    "status": "failed",
+                    "error": f"{result['ErrorCode']}: {result.get('ErrorMessage')}",
+                    "attempts": attempt + 1,
+                }
+            else:
+                statuses[i] = {
+                    "status": "sent",
+                    "record_id": result["RecordId"],
+                }
+        if not failed:
+            return
+        pending = failed
@@ -14,33 +14,86 @@ DATABASE_NAME = os.environ["DATABASE_NAME"]
 athena_client = boto3.client("athena")
 
 
-def get_named_query_by_name(query_name: str, workgroup: str) -> dict:
+# Named queries change only when the stack is deployed, so are cached
+# between invocations. A cached query is refreshed when it doesn't match the
+# `QueryVersion` it was asked for, or, if no version is given, after a while.
+NAMED_QUERY_CACHE_TTL = 300
+_named_query_cache = {}
+
+
+def list_named_queries(workgroup: str) -> dict:
+    """
+    All the named queries in a workgroup, by name
+    """
+    named_query_ids = []
+    kwargs = {"WorkGroup": workgroup}
+    while True:
+        response = athena_client.list_named_queries(**kwargs)
+        named_query_ids.extend(response.get("NamedQueryIds", []))
+        if not response.get("NextToken"):
+            break
+        kwargs["NextToken"] = response["NextToken"]
+
+    named_queries = {}
+    # batch_get_named_query takes at most 50 IDs
+    for i in range(0, len(named_query_ids), 50):
+        response = athena_client.batch_get_named_query(
+            NamedQueryIds=named_query_ids[i : i + 50]
+        )
+        for named_query in response.get("NamedQueries", []):
+            named_queries[named_query["Name"]] = named_query
+    return named_queries
+
+
+def get_named_query_by_name(
+    query_name: str, workgroup: str, version: str = None
+) -> dict:
     """
     Athena stores UUIDs and names for queries.
 
     There is no way in the API to get a query by a name. `get_named_query`
     takes a UUID, not a query name, annoyingly.
 
-    So, we need to get all the saved queries and return the first one
-    where the name matches.
+    So, we need to get all the saved queries and return the one where the
+    name matches. They're cached, see `NAMED_QUERY_CACHE_TTL`.
 
+    `version` is the hash that `AthenaNamedQueryFromModel` puts in the
+    query's description.
     """
-
-    # Get a list of all named query IDs in the workgroup
-    response = athena_client.list_named_queries(WorkGroup=workgroup)
-    named_query_ids = response.get("NamedQueryIds", [])
-
-    # Iterate over each ID and retrieve the details
-    for query_id in named_query_ids:
-        query_details = athena_client.get_named_query(
-            NamedQueryId=query_id,
+    fetched_at, named_queries = _named_query_cache.get(workgroup, (0, {}))
+    named_query = named_queries.get(query_name)
+    if version:
+        stale = (
+            not named_query
+            or named_query.get("Description") != f"Version: {version}"
         )
-        named_query = query_details.get("NamedQuery", {})
-        if named_query.get("Name") == query_name:
-            return named_query
+    else:
+        stale = (
+            not named_query
+            or time.monotonic() - fetched_at > NAMED_QUERY_CACHE_TTL
+        )
+
+    if stale:
+        named_queries = list_named_queries(workgroup)
+        _named_query_cache[workgroup] = (time.monotonic(), named_queries)
+        named_query = named_queries.get(query_name)
 
     # Raise if no query found
-    raise ValueError(f"Query {query_name} not found")
+    if not named_query:
+        raise ValueError(f"Query {query_name} not found")
+    return named_query
+
+
+def start_query(formatted_query: str) -> str:
+    """
+    Start a query, returning its execution ID
+    """
+    start_response = athena_client.start_query_execution(
+        QueryString=formatted_query,
+        QueryExecutionContext={"Database": DATABASE_NAME},
+        WorkGroup=WORKGROUP_NAME,
+    )
+    return start_response["QueryExecutionId"]
 
 
 def handler(event, context):
@@ -52,6 +105,9 @@ def handler(event, context):
     `QueryName` is the named query to run. The query gets the event dict
                 as a template context
 
+    `QueryVersion` optionally, the version of the named query expected. A
+                   cached copy of the query at another version isn't used.
+
     `QueryString` if this is passed in, `QueryName` is ignored. Designed
                   to allow running ad-hox queries rather than saved queries.
 
@@ -77,27 +133,25 @@ def handler(event, context):
     query_string = event.get("QueryString", None)
     if not query_string:
         saved_query_name = event["QueryName"]
-        response = get_named_query_by_name(saved_query_name, WORKGROUP_NAME)
+        response = get_named_query_by_name(
+            saved_query_name, WORKGROUP_NAME, event.get("QueryVersion")
+        )
         query_string = response["QueryString"]
 
     # The query can contain {foo} placeholder strings that are replaced with
     # items in event["QueryContext"]
     formatted_query = query_string.format(**event.get("QueryContext", {}))
 
-    start_response = athena_client.start_query_execution(
-        QueryString=formatted_query,
-        QueryExecutionContext={"Database": DATABASE_NAME},
-        WorkGroup=WORKGROUP_NAME,
-    )
+    query_execution_id = start_query(formatted_query)
 
     if not event.get("blocking"):
-        return {"queryExecutionId": start_response["QueryExecutionId"]}
+        return {"queryExecutionId": query_execution_id}
 
     while True:
         # Wait a little on each iteration
         time.sleep(1)
         response = athena_client.get_query_execution(
-            QueryExecutionId=start_response["QueryExecutionId"]
+            QueryExecutionId=query_execution_id
         )
         status = response["QueryExecution"]["Status"]
         state = status["State"]
@@ -110,4 +164,4 @@ def handler(event, context):
                 raise ValueError(f"Query did not succeed: {error_reason}")
             break
 
-    return {"queryExecutionId": start_response["QueryExecutionId"]}
+    return {"queryExecutionId": query_execution_id}
@@ -0,0 +1,145 @@
+"""
+Generate Glue schemas from the dataclasses that define log entries, so the
+tables always match what the logging client writes
+"""
+
+import base64
+import dataclasses
+import datetime
+import enum
+import json
+import types
+import typing
+from typing import Any, Dict, Iterable, List
+
+from aws_cdk import aws_glue_alpha as glue
+
+PRIMITIVE_TYPES = {
+    str: glue.Schema.STRING,
+    bool: glue.Schema.BOOLEAN,
+    int: glue.Schema.INTEGER,
+    float: glue.Schema.DOUBLE,
+    datetime.datetime: glue.Schema.TIMESTAMP,
+    datetime.date: glue.Schema.DATE,
+}
+
+SEQUENCE_TYPES = (list, tuple, set, frozenset)
+
+# Glue column types that Athena names differently in view definitions
+PRESTO_TYPES = {
+    "string": "varchar",
+    "int": "integer",
+    "timestamp": "timestamp(3)",
+}
+
+
+def glue_type(field_type: Any) -> glue.Type:
+    """
+    The Glue type for a Python type annotation. Anything without an obvious
+    mapping is stored as a string.
+    """
+    origin = typing.get_origin(field_type)
+    args = typing.get_args(field_type)
+
+    # `Optional[X]` and `X | None` have different origins
+    if origin in (typing.Union, types.UnionType):
+        # Optional[X] is X, as every column is nullable. A Union of several
+        # types can only be stored as a string.
+        args = [arg for arg in args if arg is not type(None)]
+        if len(args) == 1:
+            return glue_type(args[0])
+        return glue.Schema.STRING
+
+    if origin in SEQUENCE_TYPES:
+        item_type = args[0] if args else str
+        item_glue_type = glue_type(item_type)
+        return glue.Schema.array(
+            input_string=item_glue_type.input_string,
+            is_primitive=item_glue_type.is_primitive,
+        )
+
+    if dataclasses.is_dataclass(field_type):
+        return glue.Schema.struct(glue_columns(field_type))
+
+    if isinstance(field_type, type) and issubclass(field_type, enum.Enum):
+        # Enums are logged by their value
+        return glue.Schema.STRING
+
+    return PRIMITIVE_TYPES.get(field_type, glue.Schema.STRING)
+
+
+def glue_schema(
+    entry_class: type, exclude: Iterable[str] = ()
+) -> Dict[str, glue.Type]:
+    """
+    Column names and types for the fields of a dataclass, in field order
+    """
+    type_hints = typing.get_type_hints(entry_class)
+    return {
+        field.name: glue_type(type_hints[field.name])
+        for field in dataclasses.fields(entry_class)
+        if field.name not in exclude
+    }
+
+
+def glue_columns(entry_class: type, exclude: Iterable[str] = ()):
+    return [
+        glue.Column(name=name, type=column_type)
+        for name, column_type in glue_schema(entry_class, exclude).items()
+    ]
+
+
+def split_type_list(types: str) -> List[str]:
+    """
+    Split a comma separated list of Glue types, ignoring the commas in
+    nested types
+    """
+    parts, depth, start = [], 0, 0
+    for i, char in enumerate(types):
+        if char == "<":
+            depth += 1
+        elif char == ">":
+            depth -= 1
+        elif char == "," and not depth:
+            parts.append(types[start:i])
+            start = i + 1
+    parts.append(types[start:])
+    return parts
+
+
+def presto_type(glue_type_string: str) -> str:
+    """
+    The type Athena uses in a view definition for a Glue column type
+    """
+    if glue_type_string.startswith("array<"):
+        return f"array({presto_type(glue_type_string[6:-1])})"
+    if glue_type_string.startswith("struct<"):
+        fields = [
+            field.split(":", 1)
+            for field in split_type_list(glue_type_string[7:-1])
+        ]
+        return (
+            "row("
+            + ", ".join(f"{name} {presto_type(t)}" for name, t in fields)
+            + ")"
+        )
+    return PRESTO_TYPES.get(glue_type_string, glue_type_string)
+
+
+def presto_view_text(sql: str, database: str, columns: Dict[str, str]) -> str:
+    """
+    The `ViewOriginalText` of a Glue table that Athena reads as a view of
+    `sql`. `columns` are the Glue types of the columns `sql` selects, in
+    order.
+    """
+    definition = {
+        "originalSql": sql,
+        "catalog": "awsdatacatalog",
+        "schema": database,
+        "columns": [
+            {"name": name, "type": presto_type(column_type)}
+            for name, column_type in columns.items()
+        ],
+    }
+    encoded = base64.b64encode(json.dumps(definition).encode("utf-8"))
+    return f"/* Presto View: {encoded.decode('utf-8')} */"
@@ -1,13 +1,19 @@
+from models.buckets import postcode_searches_results_bucket
 from models.databases import dc_wide_logs_db
 from models.models import BaseQuery
 
-total_searches_query = BaseQuery(
-    name="total_searches_query",
+# Each reporting run filters the logs for the election period into a
+# temporary table once, then runs every report against that
+election_period_slice_query = BaseQuery(
+    name="election_period_slice_query",
     creation_context={
-        "query_file_path": "election_reporting/total_searches_query.sql"
+        "query_file_path": "election_reporting/election_period_slice.sql",
+        "slice_location": f"s3://{postcode_searches_results_bucket.bucket_name}/election-period-slices/",
     },
     database=dc_wide_logs_db,
     query_context={
+        "slice_table": "",
+        "hours_table": "",
         "start_of_election_period_day": "",
         "polling_day": "",
         "updown_api_key": "",
@@ -15,6 +21,91 @@ total_searches_query = BaseQuery(
         "end_datetime_utc": "",
         "start_datetime_london": "",
         "end_datetime_london": "",
+        "hours_cutoff_day": "",
+        "hours_cutoff_hour": "",
+    },
+)
+
+# The hourly counts for the election period are kept in a table, which is
+# built from the start of the election period for each run, or, for
+# incremental runs, kept for the polling day and has the hours rolled up
+# since it was last updated appended to it
+election_period_hours_query = BaseQuery(
+    name="election_period_hours_query",
+    creation_context={
+        "query_file_path": "election_reporting/election_period_hours.sql",
+        "statement": (
+            'CREATE TABLE "dc-wide-logs"."{hours_table}" '
+            "WITH (format = 'PARQUET', external_location = "
+            f"'s3://{postcode_searches_results_bucket.bucket_name}/{{hours_location}}') AS"
+        ),
+        "uncounted": "",
+    },
+    database=dc_wide_logs_db,
+    query_context={
+        "hours_table": "",
+        "from_day": "",
+        "from_hour": "",
+        "polling_day": "",
+        "rollup_cutoff_day": "",
+        "rollup_cutoff_hour": "",
+        "hours_location": "",
+    },
+)
+
+election_period_hours_append_query = BaseQuery(
+    name="election_period_hours_append_query",
+    creation_context={
+        "query_file_path": "election_reporting/election_period_hours.sql",
+        "statement": 'INSERT INTO "dc-wide-logs"."{hours_table}"',
+        # Hours already in the table, for example from a rollup that was
+        # late for an earlier run, aren't counted twice
+        "uncounted": (
+            'AND NOT EXISTS (SELECT 1 FROM "dc-wide-logs"."{hours_table}" counted'
+            ' WHERE counted."day" = hourly."day" AND counted."hour" = hourly."hour")'
+        ),
+    },
+    database=dc_wide_logs_db,
+    query_context={
+        "hours_table": "",
+        "from_day": "",
+        "from_hour": "",
+        "polling_day": "",
+        "rollup_cutoff_day": "",
+        "rollup_cutoff_hour": "",
+    },
+)
+
+# The first hour from `from_day`/`from_hour` that isn't in the hours table,
+# which incremental runs append from next time
+election_period_hours_cutoff_query = BaseQuery(
+    name="election_period_hours_cutoff_query",
+    creation_context={
+        "query_file_path": "election_reporting/election_period_hours_cutoff.sql"
+    },
+    database=dc_wide_logs_db,
+    query_context={
+        "hours_table": "",
+        "from_day": "",
+        "from_hour": "",
+        "polling_day": "",
+        "rollup_cutoff_day": "",
+        "rollup_cutoff_hour": "",
+    },
+)
+
+total_searches_query = BaseQuery(
+    name="total_searches_query",
+    creation_context={
+        "query_file_path": "election_reporting/total_searches_query.sql"
+    },
+    database=dc_wide_logs_db,
+    query_context={
+        "slice_table": "",
+        "start_datetime_utc": "",
+        "end_datetime_utc": "",
+        "start_datetime_london": "",
+        "end_datetime_london": "",
     },
 )
 
@@ -25,9 +116,7 @@ by_local_authority_query = BaseQuery(
     },
     database=dc_wide_logs_db,
     query_context={
-        "start_of_election_period_day": "",
-        "polling_day": "",
-        "updown_api_key": "",
+        "slice_table": "",
         "start_datetime_utc": "",
         "end_datetime_utc": "",
         "start_datetime_london": "",
@@ -42,12 +131,28 @@ by_product_query = BaseQuery(
     },
     database=dc_wide_logs_db,
     query_context={
-        "start_of_election_period_day": "",
-        "polling_day": "",
-        "updown_api_key": "",
+        "slice_table": "",
         "start_datetime_utc": "",
         "end_datetime_utc": "",
         "start_datetime_london": "",
         "end_datetime_london": "",
     },
 )
+
+hourly_rollup_query = BaseQuery(
+    name="hourly_rollup_query",
+    creation_context={"query_file_path": "rollups/hourly_searches_rollup.sql"},
+    database=dc_wide_logs_db,
+    query_context={
+        "day": "",
+        "hour": "",
+        "rollup_day": "",
+    },
+)
+
+postcode_lookup_query = BaseQuery(
+    name="postcode_lookup_query",
+    creation_context={"query_file_path": "lookups/postcode_lookup.sql"},
+    database=dc_wide_logs_db,
+    query_context={},
+)
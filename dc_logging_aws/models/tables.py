@@ -1,10 +1,19 @@
+import sys
+from pathlib import Path
+
 import aws_cdk.aws_glue_alpha as glue
 from models.buckets import (
     dc_monitoring_production_logging,
     pollingstations_public_data,
 )
 from models.databases import dc_wide_logs_db, polling_stations_public_data_db
+from models.glue_schema import glue_schema
 from models.models import GlueTable
+from models.queries import postcode_lookup_query
+
+sys.path.append(str(Path(__file__).resolve().parent.parent.parent))
+
+from dc_logging_client.log_entries import PostcodeLogEntry  # noqa
 
 dc_postcode_searches_table = GlueTable(
     table_name="dc_postcode_searches_table",
@@ -13,16 +22,46 @@ dc_postcode_searches_table = GlueTable(
     s3_prefix="dc-postcode-searches",
     database=dc_wide_logs_db,
     data_format=glue.DataFormat.CSV,
+    # Generated from the entry class, so it always matches what the logging
+    # client writes, and the table `DCLogsStack` creates.
+    columns=glue_schema(PostcodeLogEntry, exclude=["dc_product"]),
+    partition_keys=[
+        glue.Column(
+            name="day",
+            type=glue.Schema.STRING,
+        ),
+        glue.Column(
+            name="hour",
+            type=glue.Schema.INTEGER,
+        ),
+        glue.Column(
+            name="dc_product",
+            type=glue.Schema.STRING,
+        ),
+    ],
+)
+
+# Hourly counts of searches, written by `hourly_rollup_query` once each hour
+# of logs is complete, so that reports don't need to read every log in the
+# election period. Partitioned by the `day` (as yyyy-MM-dd) and `hour` of the
+# logs partition each row was counted from.
+dc_postcode_searches_hourly_table = GlueTable(
+    table_name="dc_postcode_searches_hourly",
+    description="Hourly counts of postcode searches from all services.",
+    bucket=dc_monitoring_production_logging,
+    s3_prefix="dc-postcode-searches-hourly/",
+    database=dc_wide_logs_db,
+    data_format=glue.DataFormat.PARQUET,
     columns={
+        "hour_start": glue.Schema.TIMESTAMP,
         "dc_product": glue.Schema.STRING,
-        "utm_source": glue.Schema.STRING,
-        "utm_campaign": glue.Schema.STRING,
-        "utm_medium": glue.Schema.STRING,
-        "postcode": glue.Schema.STRING,
-        "timestamp": glue.Schema.TIMESTAMP,
         "api_key": glue.Schema.STRING,
-        "calls_devs_dc_api": glue.Schema.STRING,
-        "had_election": glue.Schema.STRING,
+        "utm_source": glue.Schema.STRING,
+        "calls_devs_dc_api": glue.Schema.BOOLEAN,
+        "had_election": glue.Schema.BOOLEAN,
+        "postcode_district": glue.Schema.STRING,
+        "lad25cd": glue.Schema.STRING,
+        "searches": glue.Schema.BIG_INT,
     },
     partition_keys=[
         glue.Column(
@@ -131,3 +170,22 @@ ec_api_keys_table = GlueTable(
         "usage_reason": glue.Schema.STRING,
     },
 )
+
+# Local authority for each postcode in ONSPD, keyed on the postcode as
+# `normalise_postcode` stores it in the logs, so reports can join on it
+# directly. Populated with `postcode_lookup_query` from `onspd_table`.
+postcode_lookup_table = GlueTable(
+    table_name="postcode_lookup",
+    description="Local authority by normalised postcode, from ONSPD",
+    bucket=dc_monitoring_production_logging,
+    s3_prefix="postcode-lookup/latest/",
+    database=dc_wide_logs_db,
+    data_format=glue.DataFormat.PARQUET,
+    columns={
+        "normalised_postcode": glue.Schema.STRING,
+        "outward_code": glue.Schema.STRING,
+        "lad25cd": glue.Schema.STRING,
+    },
+    depends_on=[onspd_table],
+    populated_with=postcode_lookup_query,
+)
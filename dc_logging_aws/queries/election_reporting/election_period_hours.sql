@@ -0,0 +1,22 @@
+${statement}
+-- The rolled up hours for the election period from {from_day} {from_hour}:00 up
+-- to the rollup cutoff. The rows are filtered for the reports by
+-- `election_period_slice_query`, so every hour that had a rollup partition
+-- has rows here, along with the partition they came from.
+SELECT
+    "hour_start", "dc_product", "api_key", "utm_source", "calls_devs_dc_api",
+    "had_election", "lad25cd", "searches", "day", "hour"
+FROM "dc-wide-logs"."dc_postcode_searches_hourly" hourly
+WHERE "day" >= replace('{from_day}', '/', '-')
+    AND "day" <= replace('{polling_day}', '/', '-')
+    AND (
+            "day" > replace('{from_day}', '/', '-')
+        OR
+            "hour" >= {from_hour}
+    )
+    AND (
+            "day" < replace('{rollup_cutoff_day}', '/', '-')
+        OR
+            ("day" = replace('{rollup_cutoff_day}', '/', '-') AND "hour" < {rollup_cutoff_hour})
+    )
+    ${uncounted};
@@ -0,0 +1,27 @@
+-- The first hour from {from_day} {from_hour}:00 that has nothing counted in
+-- {hours_table}, or the rollup cutoff if every hour before it has been.
+-- Hours without a rollup partition, because the rollup failed or hadn't run
+-- yet, are looked for again by the next incremental run.
+WITH EXPECTED AS (
+    SELECT "hour_start"
+    FROM UNNEST(sequence(
+        date_parse('{from_day} {from_hour}', '%Y/%m/%d %H'),
+        -- Nothing after polling day is counted
+        least(
+            date_parse('{rollup_cutoff_day} {rollup_cutoff_hour}', '%Y/%m/%d %H'),
+            date_parse('{polling_day}', '%Y/%m/%d') + INTERVAL '1' DAY
+        ),
+        INTERVAL '1' HOUR
+    )) AS hours("hour_start")
+), COUNTED AS (
+    SELECT DISTINCT "day", "hour"
+    FROM "dc-wide-logs"."{hours_table}"
+)
+SELECT
+    date_format(min(EXPECTED."hour_start"), '%Y/%m/%d') AS "rollup_cutoff_day",
+    hour(min(EXPECTED."hour_start")) AS "rollup_cutoff_hour"
+FROM EXPECTED
+    LEFT JOIN COUNTED
+        ON COUNTED."day" = date_format(EXPECTED."hour_start", '%Y-%m-%d')
+        AND COUNTED."hour" = hour(EXPECTED."hour_start")
+WHERE COUNTED."day" IS NULL;
@@ -0,0 +1,84 @@
+CREATE TABLE "dc-wide-logs"."{slice_table}"
+WITH (
+    format = 'PARQUET',
+    external_location = '${slice_location}{slice_table}/'
+) AS
+WITH COUNTED AS (
+    SELECT DISTINCT "day", "hour"
+    FROM "dc-wide-logs"."{hours_table}"
+), LOGS AS (
+    -- Raw logs, for the hours that aren't in the hourly counts. That's the
+    -- hours since the rollup cutoff, and any earlier hours without a rollup,
+    -- which can only come after {hours_cutoff_day} {hours_cutoff_hour}:00
+    SELECT all_logs.*
+    FROM "dc-wide-logs"."dc_postcode_searches_all" all_logs
+        LEFT JOIN COUNTED
+            ON COUNTED."day" = replace(all_logs."day", '/', '-')
+            AND COUNTED."hour" = all_logs."hour"
+    WHERE COUNTED."day" IS NULL
+        AND all_logs."day" >= '{start_of_election_period_day}'
+        AND all_logs."day" <= '{polling_day}'
+        AND (
+                all_logs."day" > '{hours_cutoff_day}'
+            OR
+                (all_logs."day" = '{hours_cutoff_day}' AND all_logs."hour" >= {hours_cutoff_hour})
+        )
+        AND all_logs."api_key" != '{updown_api_key}' --updown
+        AND (
+                (all_logs."dc_product" != 'WDIV')
+            OR
+                (all_logs."dc_product" = 'WDIV' AND replace(all_logs."postcode",' ','') != 'BS44NN') --updown
+        )
+        AND (NOT all_logs."calls_devs_dc_api" OR all_logs."dc_product" = 'EC_API')
+        AND ((
+            all_logs."timestamp" >= cast('{start_datetime_utc}' AS timestamp)
+            AND all_logs."timestamp" <= cast('{end_datetime_utc}' AS timestamp)
+            AND all_logs."dc_product" != 'WDIV'
+        ) OR (
+            all_logs."timestamp" >= cast('{start_datetime_london}' AS timestamp)
+            AND all_logs."timestamp" <= cast('{end_datetime_london}' AS timestamp)
+            AND all_logs."dc_product" = 'WDIV'
+        ))
+), HOURLY AS (
+    -- Hourly counts for the hours that have been rolled up, kept up to date
+    -- for the election by `election_period_hours_query`
+    SELECT *
+    FROM "dc-wide-logs"."{hours_table}"
+    WHERE "api_key" != '{updown_api_key}' --updown
+        AND (NOT "calls_devs_dc_api" OR "dc_product" = 'EC_API')
+        AND ((
+            "hour_start" >= cast('{start_datetime_utc}' AS timestamp)
+            AND "hour_start" < cast('{end_datetime_utc}' AS timestamp)
+            AND "dc_product" != 'WDIV'
+        ) OR (
+            "hour_start" >= cast('{start_datetime_london}' AS timestamp)
+            AND "hour_start" < cast('{end_datetime_london}' AS timestamp)
+            AND "dc_product" = 'WDIV'
+        ))
+), LOGS_BY_HOUR AS (
+    SELECT
+        date_trunc('hour', "timestamp") AS hour_start,
+        "dc_product",
+        "api_key",
+        "utm_source",
+        "calls_devs_dc_api",
+        "had_election",
+        lookup."lad25cd",
+        count(*) AS searches
+    FROM LOGS
+        LEFT JOIN "dc-wide-logs"."postcode_lookup" lookup
+            ON coalesce(
+                LOGS."normalised_postcode",
+                upper(replace(replace(LOGS."postcode",' ', '' ),'+',''))
+            ) = lookup."normalised_postcode"
+    GROUP BY 1, 2, 3, 4, 5, 6, 7
+)
+SELECT
+    "hour_start", "dc_product", "api_key", "utm_source", "calls_devs_dc_api",
+    "had_election", "lad25cd", "searches"
+FROM HOURLY
+UNION ALL
+SELECT
+    "hour_start", "dc_product", "api_key", "utm_source", "calls_devs_dc_api",
+    "had_election", "lad25cd", "searches"
+FROM LOGS_BY_HOUR;
@@ -1,31 +1,20 @@
-WITH ELECTION_PERIOD AS (
+WITH SEARCHES AS (
     SELECT *
-    FROM "dc-wide-logs"."dc_postcode_searches_table" all_logs
-    WHERE "day" >= '{start_of_election_period_day}'
-        AND "day" <= '{polling_day}'
-        AND all_logs."api_key" != '{updown_api_key}' --updown
-        AND (
-                (all_logs."dc_product" != 'WDIV')
-            OR
-                (all_logs."dc_product" = 'WDIV' AND replace(all_logs."postcode",' ','') != 'BS44NN') --updown
-        )
-        AND LOWER("calls_devs_dc_api") = 'false'
-), LOGS AS (
-    SELECT *
-    FROM ELECTION_PERIOD
-    WHERE (
-        "timestamp" >= cast('{start_datetime_utc}' AS timestamp)
-        AND "timestamp" <= cast('{end_datetime_utc}' AS timestamp)
-        AND "dc_product" != 'WDIV'
-    ) OR (
-        "timestamp" >= cast('{start_datetime_london}' AS timestamp)
-        AND "timestamp" <= cast('{end_datetime_london}' AS timestamp)
-        AND "dc_product" = 'WDIV'
-    )
+    FROM "dc-wide-logs"."{slice_table}"
+    WHERE NOT "calls_devs_dc_api"
+        AND ((
+            "hour_start" >= cast('{start_datetime_utc}' AS timestamp)
+            AND "hour_start" < cast('{end_datetime_utc}' AS timestamp)
+            AND "dc_product" != 'WDIV'
+        ) OR (
+            "hour_start" >= cast('{start_datetime_london}' AS timestamp)
+            AND "hour_start" < cast('{end_datetime_london}' AS timestamp)
+            AND "dc_product" = 'WDIV'
+        ))
 )
 SELECT
-    count(*) AS total,
-    count(CASE WHEN had_election = 'true' THEN 1 END) AS had_election_true,
-    count(CASE WHEN had_election = 'false' THEN 1 END) AS had_election_false
+    coalesce(sum("searches"), 0) AS total,
+    coalesce(sum(CASE WHEN had_election THEN "searches" END), 0) AS had_election_true,
+    coalesce(sum(CASE WHEN NOT had_election THEN "searches" END), 0) AS had_election_false
 FROM
-    LOGS
+    SEARCHES
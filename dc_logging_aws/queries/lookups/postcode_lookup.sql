@@ -0,0 +1,8 @@
+INSERT INTO "dc-wide-logs"."postcode_lookup"
+SELECT
+    upper(replace( "pcds",' ', '')) AS normalised_postcode,
+    upper(split_part("pcds", ' ', 1)) AS outward_code,
+    "lad25cd"
+FROM "pollingstations.public.data"."onspd_table"
+-- Sorted, so that each file's statistics cover a narrow range of postcodes
+ORDER BY 1;
@@ -0,0 +1,37 @@
+INSERT INTO "dc-wide-logs"."dc_postcode_searches_hourly"
+WITH LOGS AS (
+    SELECT
+        "timestamp",
+        "dc_product",
+        "api_key",
+        "utm_source",
+        "calls_devs_dc_api",
+        "had_election",
+        -- Logs from older clients don't have a normalised postcode
+        coalesce(
+            "normalised_postcode",
+            upper(replace(replace("postcode",' ', '' ),'+',''))
+        ) AS normalised_postcode
+    FROM "dc-wide-logs"."dc_postcode_searches_all"
+    WHERE "day" = '{day}'
+        AND "hour" = {hour}
+        AND NOT ("dc_product" = 'WDIV' AND replace("postcode",' ','') = 'BS44NN') --updown
+)
+SELECT
+    date_trunc('hour', "timestamp") AS hour_start,
+    "dc_product",
+    "api_key",
+    "utm_source",
+    "calls_devs_dc_api",
+    "had_election",
+    CASE WHEN length(LOGS.normalised_postcode) > 3
+        THEN substr(LOGS.normalised_postcode, 1, length(LOGS.normalised_postcode) - 3)
+    END AS postcode_district,
+    lookup."lad25cd",
+    count(*) AS searches,
+    '{rollup_day}' AS "day",
+    {hour} AS "hour"
+FROM
+    LOGS LEFT JOIN "dc-wide-logs"."postcode_lookup" lookup
+        ON LOGS.normalised_postcode = lookup."normalised_postcode"
+GROUP BY 1, 2, 3, 4, 5, 6, 7, 8;
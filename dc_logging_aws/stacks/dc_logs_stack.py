@@ -1,10 +1,11 @@
 import os
 import sys
-import typing
-from datetime import datetime
 from pathlib import Path
 from typing import Type
 
+import aws_cdk.aws_events as events
+import aws_cdk.aws_events_targets as targets
+import aws_cdk.aws_glue as glue_l1
 import aws_cdk.aws_glue_alpha as glue
 import aws_cdk.aws_iam as iam
 import aws_cdk.aws_kinesisfirehose as firehose
@@ -12,12 +13,33 @@ import aws_cdk.aws_lambda as aws_lambda
 import aws_cdk.aws_lambda_python_alpha as lambda_python
 import aws_cdk.aws_s3 as s3
 import boto3
-from aws_cdk import Duration, Stack
+from aws_cdk import Duration, Size, Stack
 from constructs import Construct
 
 sys.path.append(str(Path(__file__).resolve().parent.parent.parent))
 
 from dc_logging_client.log_client import BaseLoggingClient  # noqa
+from models.glue_schema import (  # noqa
+    glue_columns,
+    glue_schema,
+    presto_view_text,
+)
+
+# Formats the logs can be stored in, set with the `logs-storage-format`
+# context. With a columnar format, Firehose converts each JSON record using the
+# schema of the Glue table, so that Athena only reads the columns a query uses.
+STORAGE_FORMATS = ("json", "parquet", "orc")
+
+# Every log table is partitioned by product, as well as by day and hour, as
+# reports filter and group by it
+PRODUCT_PARTITION_KEY = "dc_product"
+
+DATABASE_NAME = "dc-wide-logs"
+
+COLUMNAR_SERIALIZERS = {
+    "parquet": {"ParquetSerDe": {"Compression": "SNAPPY"}},
+    "orc": {"OrcSerDe": {"Compression": "SNAPPY"}},
+}
 
 
 class DCLogsStack(Stack):
@@ -26,6 +48,12 @@ class DCLogsStack(Stack):
         org_client = boto3.client("organizations", region_name=self.region)
         self.org_id = org_client.describe_organization()["Organization"]["Id"]
         self.dc_environment = self.node.try_get_context("dc-environment")
+        self.storage_format = (
+            self.node.try_get_context("logs-storage-format") or "json"
+        )
+        assert (
+            self.storage_format in STORAGE_FORMATS
+        ), f"context `logs-storage-format` must be one of {STORAGE_FORMATS}"
         self.create_iam_role()
         self.database = self.get_database()
         self.bucket = self.get_bucket()
@@ -69,7 +97,7 @@ class DCLogsStack(Stack):
         return glue.Database(
             self,
             "DCLogs",
-            database_name="dc-wide-logs",
+            database_name=DATABASE_NAME,
         )
 
     def get_bucket(self):
@@ -86,51 +114,66 @@ class DCLogsStack(Stack):
         tables = []
         streams = []
         for cls in stream_class_list:
-            tables.append(self.create_table_from_stream_class(cls))
-            streams.append(self.create_stream(cls))
+            # The JSON table is kept in columnar mode, so the logs from before
+            # the switch can still be read
+            storage_formats = ["json"]
+            if self.columnar:
+                storage_formats.append(self.storage_format)
+            cls_tables = [
+                self.create_table_from_stream_class(cls, storage_format)
+                for storage_format in storage_formats
+            ]
+            table = cls_tables[-1]
+            tables.append(table)
+            view = self.create_logs_view(cls, storage_formats)
+            for cls_table in cls_tables:
+                view.node.add_dependency(cls_table)
+            streams.append(self.create_legacy_stream(cls))
+            streams.append(self.create_stream(cls, table))
             self.create_lambda_function(cls)
+            # Only JSON files can be merged, but the JSON table is always
+            # there
+            self.create_compaction_function(cls)
         return tables
 
-    def _field_type_to_glue_type(self, field_type):
-        # Special case Union types
-        type_list = list(typing.get_args(field_type))
-        if type_list:
-            # This is a Union type
-            field_type = type_list[0]
-
-        types = {
-            str: glue.Schema.STRING,
-            int: glue.Schema.INTEGER,
-            datetime: glue.Schema.TIMESTAMP,
-        }
-        return types.get(field_type, glue.Schema.STRING)
-
-    def create_table_from_stream_class(self, cls: Type[BaseLoggingClient]):
-        columns = []
-        entry_fields = cls.entry_class.__dataclass_fields__
-        for field_name, field in entry_fields.items():
-            field_type = self._field_type_to_glue_type(field.type)
-            column = glue.Column(
-                name=field_name,
-                type=field_type,
-            )
-            columns.append(column)
+    @property
+    def columnar(self) -> bool:
+        return self.storage_format != "json"
 
-        table_name = f"{cls.stream_name.replace('-', '_')}_table"
+    def s3_prefix(
+        self, cls: Type[BaseLoggingClient], storage_format: str = None
+    ) -> str:
+        # Columnar files are kept apart from the JSON ones, as a table can
+        # only read one format
+        storage_format = storage_format or self.storage_format
+        if storage_format != "json":
+            return f"{cls.stream_name}-{storage_format}"
+        return cls.stream_name
 
-        table = glue.Table(
-            self,
-            id=table_name,
-            database=self.database,
-            table_name=table_name,
-            columns=columns,
-            bucket=self.bucket,
-            s3_prefix=cls.stream_name,
-            partition_keys=[
-                glue.Column(name="day", type=glue.Schema.STRING),
-                glue.Column(name="hour", type=glue.Schema.INTEGER),
-            ],
-            data_format=glue.DataFormat(
+    def table_name(
+        self, cls: Type[BaseLoggingClient], storage_format: str
+    ) -> str:
+        if storage_format != "json":
+            return f"{cls.stream_name.replace('-', '_')}_{storage_format}_table"
+        return f"{cls.stream_name.replace('-', '_')}_table"
+
+    def create_table_from_stream_class(
+        self, cls: Type[BaseLoggingClient], storage_format: str
+    ):
+        # Athena doesn't allow a partition key to also be a column. The value
+        # is taken from the path instead.
+        columns = glue_columns(cls.entry_class, exclude=[PRODUCT_PARTITION_KEY])
+
+        table_name = self.table_name(cls, storage_format)
+
+        if storage_format != "json":
+            data_format = {
+                "parquet": glue.DataFormat.PARQUET,
+                "orc": glue.DataFormat.ORC,
+            }[storage_format]
+            storage_parameters = []
+        else:
+            data_format = glue.DataFormat(
                 input_format=glue.InputFormat(
                     "org.apache.hadoop.mapred.TextInputFormat"
                 ),
@@ -140,12 +183,30 @@ class DCLogsStack(Stack):
                 serialization_library=glue.SerializationLibrary(
                     "org.openx.data.jsonserde.JsonSerDe"
                 ),
-            ),
-            storage_parameters=[
+            )
+            storage_parameters = [
                 glue.StorageParameter.compression_type(
                     glue.CompressionType.GZIP
                 )
+            ]
+
+        table = glue.Table(
+            self,
+            id=table_name,
+            database=self.database,
+            table_name=table_name,
+            columns=columns,
+            bucket=self.bucket,
+            s3_prefix=self.s3_prefix(cls, storage_format),
+            partition_keys=[
+                glue.Column(name="day", type=glue.Schema.STRING),
+                glue.Column(name="hour", type=glue.Schema.INTEGER),
+                glue.Column(
+                    name=PRODUCT_PARTITION_KEY, type=glue.Schema.STRING
+                ),
             ],
+            data_format=data_format,
+            storage_parameters=storage_parameters,
         )
 
         # Projection isn't supported directly by the CDK, so we have to set
@@ -163,9 +224,14 @@ class DCLogsStack(Stack):
             ("projection.hour.type", "integer"),
             ("projection.hour.range", "0,23"),
             ("projection.hour.digits", "2"),
+            (f"projection.{PRODUCT_PARTITION_KEY}.type", "enum"),
+            (
+                f"projection.{PRODUCT_PARTITION_KEY}.values",
+                ",".join(product.value for product in cls.dc_product),
+            ),
             (
                 "storage.location.template",
-                f"s3://{self.bucket.bucket_name}/{cls.stream_name}/${{day}}/${{hour}}",
+                f"s3://{self.bucket.bucket_name}/{self.s3_prefix(cls, storage_format)}/${{day}}/${{hour}}/${{{PRODUCT_PARTITION_KEY}}}",
             ),
             ("projection.enabled", "true"),
         ]
@@ -177,8 +243,66 @@ class DCLogsStack(Stack):
 
         return table
 
-    def create_stream(self, cls):
-        firehose.DeliveryStream(
+    def view_name(self, cls: Type[BaseLoggingClient]) -> str:
+        return f"{cls.stream_name.replace('-', '_')}_all"
+
+    def create_logs_view(self, cls: Type[BaseLoggingClient], storage_formats):
+        """
+        A view of every table holding the stream's logs, so reports read the
+        JSON logs from before a switch to a columnar format as well as the
+        columnar ones. Reports should query this rather than a table.
+        """
+        columns = {
+            name: column_type.input_string
+            for name, column_type in glue_schema(
+                cls.entry_class, exclude=[PRODUCT_PARTITION_KEY]
+            ).items()
+        }
+        columns.update(
+            {"day": "string", "hour": "int", PRODUCT_PARTITION_KEY: "string"}
+        )
+        column_list = ", ".join(f'"{name}"' for name in columns)
+        sql = "\nUNION ALL\n".join(
+            f'SELECT {column_list} FROM "{DATABASE_NAME}".'
+            f'"{self.table_name(cls, storage_format)}"'
+            for storage_format in storage_formats
+        )
+
+        return glue_l1.CfnTable(
+            self,
+            self.view_name(cls),
+            catalog_id=self.account,
+            database_name=self.database.database_name,
+            table_input=glue_l1.CfnTable.TableInputProperty(
+                name=self.view_name(cls),
+                table_type="VIRTUAL_VIEW",
+                parameters={"presto_view": "true", "comment": "Presto View"},
+                view_original_text=presto_view_text(
+                    sql, DATABASE_NAME, columns
+                ),
+                view_expanded_text="/* Presto View */",
+                storage_descriptor=glue_l1.CfnTable.StorageDescriptorProperty(
+                    columns=[
+                        glue_l1.CfnTable.ColumnProperty(
+                            name=name, type=column_type
+                        )
+                        for name, column_type in columns.items()
+                    ],
+                    serde_info=glue_l1.CfnTable.SerdeInfoProperty(),
+                ),
+            ),
+        )
+
+    def create_legacy_stream(self, cls):
+        """
+        The stream from before the logs were partitioned by product, which
+        writes straight under the hour. Firehose can only partition a stream
+        when it's created, so it's kept as it was while clients move to the
+        new stream. The hourly rollup moves what it delivers into the
+        product's path before counting the hour. See the README for when it
+        can be removed.
+        """
+        return firehose.DeliveryStream(
             self,
             cls.stream_name,
             destination=firehose.S3Bucket(
@@ -189,6 +313,148 @@ class DCLogsStack(Stack):
             delivery_stream_name=cls.stream_name,
         )
 
+    def create_stream(self, cls, table: glue.Table):
+        role = iam.Role(
+            self,
+            f"{cls.delivery_stream_name}-delivery-role",
+            assumed_by=iam.ServicePrincipal("firehose.amazonaws.com"),
+        )
+        prefix = self.s3_prefix(cls)
+
+        # Dynamic partitioning and format conversion both require buffers of
+        # at least 64 MiB. The columnar formats compress each file
+        # themselves, so Firehose must leave their output uncompressed.
+        stream = firehose.DeliveryStream(
+            self,
+            cls.delivery_stream_name,
+            destination=firehose.S3Bucket(
+                self.bucket,
+                data_output_prefix=(
+                    f"{prefix}/!{{timestamp:yyyy/MM/dd/HH}}"
+                    f"/!{{partitionKeyFromQuery:{PRODUCT_PARTITION_KEY}}}/"
+                ),
+                error_output_prefix=(
+                    f"{prefix}-errors/!{{firehose:error-output-type}}"
+                    "/!{timestamp:yyyy/MM/dd/HH}/"
+                ),
+                buffering_interval=Duration.minutes(5),
+                buffering_size=Size.mebibytes(128),
+                compression=(
+                    None if self.columnar else firehose.Compression.GZIP
+                ),
+                role=role,
+            ),
+            delivery_stream_name=cls.delivery_stream_name,
+        )
+
+        # Neither dynamic partitioning nor format conversion are supported by
+        # the CDK, so as with partition projection, we set them on the
+        # CloudFormation template directly.
+        cfn_stream = stream.node.default_child
+        destination_config = "ExtendedS3DestinationConfiguration"
+        cfn_stream.add_property_override(
+            f"{destination_config}.DynamicPartitioningConfiguration",
+            {"Enabled": True, "RetryOptions": {"DurationInSeconds": 300}},
+        )
+        cfn_stream.add_property_override(
+            f"{destination_config}.ProcessingConfiguration",
+            {
+                "Enabled": True,
+                "Processors": [
+                    {
+                        "Type": "MetadataExtraction",
+                        "Parameters": [
+                            {
+                                "ParameterName": "MetadataExtractionQuery",
+                                "ParameterValue": f"{{{PRODUCT_PARTITION_KEY}: .{PRODUCT_PARTITION_KEY}}}",
+                            },
+                            {
+                                "ParameterName": "JsonParsingEngine",
+                                "ParameterValue": "JQ-1.6",
+                            },
+                        ],
+                    }
+                ],
+            },
+        )
+
+        if not self.columnar:
+            return stream
+
+        # Firehose needs to read the table to know the schema to convert to
+        role.add_to_policy(
+            iam.PolicyStatement(
+                actions=[
+                    "glue:GetTable",
+                    "glue:GetTableVersion",
+                    "glue:GetTableVersions",
+                ],
+                resources=[
+                    self.database.catalog_arn,
+                    self.database.database_arn,
+                    table.table_arn,
+                ],
+            )
+        )
+        stream.node.add_dependency(table)
+        cfn_stream.add_property_override(
+            f"{destination_config}.DataFormatConversionConfiguration",
+            {
+                "Enabled": True,
+                # The Hive SerDe reads the "yyyy-MM-dd HH:mm:ss.SSS"
+                # timestamps written by `as_log_line` as timestamps
+                "InputFormatConfiguration": {
+                    "Deserializer": {"HiveJsonSerDe": {}}
+                },
+                "OutputFormatConfiguration": {
+                    "Serializer": COLUMNAR_SERIALIZERS[self.storage_format]
+                },
+                "SchemaConfiguration": {
+                    "CatalogId": self.account,
+                    "DatabaseName": self.database.database_name,
+                    "TableName": table.table_name,
+                    "Region": self.region,
+                    "RoleARN": role.role_arn,
+                    "VersionId": "LATEST",
+                },
+            },
+        )
+        return stream
+
+    def create_compaction_function(self, cls):
+        """
+        Merges the small files Firehose writes into one per product and hour.
+        Only gzipped JSON is merged, as columnar files can't be concatenated.
+        """
+        compaction_lambda = aws_lambda.Function(
+            self,
+            f"compact-{cls.stream_name}",
+            function_name=f"compact-{cls.stream_name}-{self.dc_environment}",
+            runtime=aws_lambda.Runtime.PYTHON_3_12,
+            code=aws_lambda.Code.from_asset(
+                "./dc_logging_aws/lambdas/compact_logs"
+            ),
+            handler="handler.handler",
+            timeout=Duration.minutes(15),
+            memory_size=1024,
+            # Merged files larger than the spooling limit are written to /tmp
+            ephemeral_storage_size=Size.mebibytes(2048),
+            environment={
+                "BUCKET_NAME": self.bucket.bucket_name,
+                "PREFIX": self.s3_prefix(cls, "json"),
+            },
+        )
+        self.bucket.grant_read_write(compaction_lambda)
+        self.bucket.grant_delete(compaction_lambda)
+
+        # Each run compacts the hour that closed `CLOSED_AFTER` before it
+        events.Rule(
+            self,
+            f"compact-{cls.stream_name}-schedule",
+            schedule=events.Schedule.cron(minute="30"),
+            targets=[targets.LambdaFunction(compaction_lambda)],
+        )
+
     def create_lambda_function(self, cls):
         client_layer = lambda_python.PythonLayerVersion(
             self,
@@ -206,7 +472,7 @@ class DCLogsStack(Stack):
             runtime=aws_lambda.Runtime.PYTHON_3_12,
             timeout=Duration.minutes(2),
             environment={
-                "STREAM_NAME": cls.stream_name,
+                "STREAM_NAME": cls.delivery_stream_name,
                 "ENTRY_CLASS": cls.entry_class.__name__,
             },
             layers=[client_layer],
@@ -238,9 +504,9 @@ class DCLogsStack(Stack):
 
         stream_ingest_lambda.add_to_role_policy(
             iam.PolicyStatement(
-                actions=["firehose:PutRecord"],
+                actions=["firehose:PutRecord", "firehose:PutRecordBatch"],
                 resources=[
-                    f"arn:aws:firehose:*:*:deliverystream/{cls.stream_name}"
+                    f"arn:aws:firehose:*:*:deliverystream/{cls.delivery_stream_name}"
                 ],
                 effect=iam.Effect.ALLOW,
             )
@@ -1,17 +1,25 @@
+import re
 from pathlib import Path
 from typing import List
 
 import aws_cdk.aws_glue_alpha as glue
-from aws_cdk import Duration, Fn, Stack, aws_lambda
+from aws_cdk import ArnFormat, Duration, Fn, Stack, aws_lambda
+from aws_cdk import aws_events as events
+from aws_cdk import aws_events_targets as targets
+from aws_cdk import aws_iam as iam
 from aws_cdk import aws_s3 as s3
 from aws_cdk import aws_stepfunctions as sfn
 from aws_cdk import aws_stepfunctions_tasks as tasks
 from constructs import Construct
-from constructs.athena_named_query_from_model import AthenaNamedQueryFromModel
+from constructs.athena_named_query_from_model import (
+    AthenaNamedQueryFromModel,
+    query_version,
+)
 from constructs.lambdas.athena_query_lambda import AthenaQueryLambda
 from constructs.lambdas.get_parameter_store_variables import (
     GetParameterStoreVariables,
 )
+from constructs.tasks.athena_query import AthenaQueryTask
 from constructs.tasks.postcode_searches_query import PostcodeSearchesQueryTask
 from models.buckets import (
     dc_monitoring_production_logging,
@@ -23,13 +31,21 @@ from models.models import BaseQuery, GlueDatabase, GlueTable, S3Bucket
 from models.queries import (
     by_local_authority_query,
     by_product_query,
+    election_period_hours_append_query,
+    election_period_hours_cutoff_query,
+    election_period_hours_query,
+    election_period_slice_query,
+    hourly_rollup_query,
+    postcode_lookup_query,
     total_searches_query,
 )
 from models.tables import (
+    dc_postcode_searches_hourly_table,
     dc_postcode_searches_table,
     devs_dc_api_keys_table,
     ec_api_keys_table,
     onspd_table,
+    postcode_lookup_table,
 )
 
 
@@ -69,18 +85,44 @@ class PostcodeSearchesStack(Stack):
         calculate_reporting_period_task = self.calculate_reporting_period_task()
 
         parallel_get_totals = sfn.Parallel(
-            self, "Get totals for election day, week and period."
+            self,
+            "Get totals for election day, week and period.",
+            query_language=sfn.QueryLanguage.JSONATA,
         )
 
         for task in self.query_tasks():
             parallel_get_totals.branch(task)
 
+        # The slice is dropped even if a report fails, after which the
+        # execution fails with the report's error
+        drop_election_period_slice_task = self.drop_election_period_slice_task()
+        parallel_get_totals.add_catch(
+            drop_election_period_slice_task,
+            errors=[sfn.Errors.ALL],
+            assign={"report_error": "{% $states.errorOutput %}"},
+        )
+        parallel_get_totals.next(drop_election_period_slice_task)
+
+        # The reports are skipped if the slice couldn't be made
+        slice_made_choice = (
+            sfn.Choice(
+                self,
+                "Election Period Logs Filtered?",
+                query_language=sfn.QueryLanguage.JSONATA,
+            )
+            .when(
+                sfn.Condition.jsonata("{% $report_error = null %}"),
+                parallel_get_totals,
+            )
+            .otherwise(drop_election_period_slice_task)
+        )
+
         definition = (
             assign_input_to_variables_task.next(
                 get_parameter_store_variables_task
             )
             .next(calculate_reporting_period_task)
-            .next(parallel_get_totals)
+            .next(self.election_period_slice_task(then=slice_made_choice))
         )
 
         self.step_function = sfn.StateMachine(
@@ -91,6 +133,54 @@ class PostcodeSearchesStack(Stack):
             timeout=Duration.minutes(10),
         )
 
+        self.rollup_step_function = sfn.StateMachine(
+            self,
+            "PostcodeSearchesHourlyRollup",
+            state_machine_name="PostcodeSearchesHourlyRollup",
+            definition=self.hourly_rollup_definition(),
+            timeout=Duration.minutes(10),
+        )
+
+        self.rollup_backfill_step_function = sfn.StateMachine(
+            self,
+            "PostcodeSearchesHourlyRollupBackfill",
+            state_machine_name="PostcodeSearchesHourlyRollupBackfill",
+            definition=self.hourly_rollup_backfill_definition(),
+            timeout=Duration.hours(24),
+        )
+
+        # Tables made from other tables are refreshed weekly, to pick up
+        # changes such as new ONSPD releases. Start their state machines to
+        # refresh them sooner.
+        for table in self.managed_tables():
+            if not table.populated_with:
+                continue
+            events.Rule(
+                self,
+                f"Populate-{table.table_name}-schedule",
+                schedule=events.Schedule.cron(
+                    week_day="MON", hour="3", minute="0"
+                ),
+                targets=[
+                    targets.SfnStateMachine(
+                        self.populate_table_state_machine(table)
+                    )
+                ],
+            )
+
+        # Roll up each hour once Firehose has finished writing its logs
+        events.Rule(
+            self,
+            "PostcodeSearchesHourlyRollupSchedule",
+            schedule=events.Schedule.cron(minute="10"),
+            targets=[
+                targets.SfnStateMachine(
+                    self.rollup_step_function,
+                    input=events.RuleTargetInput.from_object({}),
+                )
+            ],
+        )
+
     def query_tasks(self) -> List[sfn.IChainable]:
         return [
             PostcodeSearchesQueryTask(
@@ -197,11 +287,23 @@ class PostcodeSearchesStack(Stack):
         return [dc_postcode_searches_table]
 
     def managed_tables(self) -> List[GlueTable]:
-        return [onspd_table, devs_dc_api_keys_table, ec_api_keys_table]
+        return [
+            onspd_table,
+            devs_dc_api_keys_table,
+            ec_api_keys_table,
+            dc_postcode_searches_hourly_table,
+            postcode_lookup_table,
+        ]
 
     def collect_tables(self):
+        # Tables must come after any tables they depend on
         for table in self.managed_tables():
-            self.tables_by_name[table.table_name] = self.make_table(table)
+            s3_table = self.make_table(table)
+            for dependency in table.depends_on or []:
+                s3_table.node.add_dependency(
+                    self.tables_by_name[dependency.table_name]
+                )
+            self.tables_by_name[table.table_name] = s3_table
 
         for table in self.existing_tables():
             self.tables_by_name[table.table_name] = self.get_table(table)
@@ -262,6 +364,12 @@ class PostcodeSearchesStack(Stack):
             query_language=sfn.QueryLanguage.JSONATA,
             assign={
                 "polling_day": "{% $states.input.polling_day %}",
+                # Unique to each execution, so runs can overlap
+                "run_id": "{% $lowercase($replace($states.context.Execution.Name, /[^A-Za-z0-9]/, '_')) %}",
+                # Pass `"incremental": true` to only count the hours rolled up
+                # since the last incremental run for the polling day
+                "incremental": "{% $states.input.incremental = true %}",
+                "report_error": None,
             },
         )
 
@@ -313,14 +421,524 @@ class PostcodeSearchesStack(Stack):
                 "start_of_election_week_london": "{% $states.result.Payload.start_of_election_week_london %}",
                 "start_of_polling_day_utc": "{% $states.result.Payload.start_of_polling_day_utc %}",
                 "start_of_polling_day_london": "{% $states.result.Payload.start_of_polling_day_london %}",
+                "rollup_cutoff_day_athena": "{% $states.result.Payload.rollup_cutoff_day_athena %}",
+                "rollup_cutoff_hour": "{% $states.result.Payload.rollup_cutoff_hour %}",
+                "slice_table": "{% 'election_period_slice_' & $run_id %}",
+                # Kept between incremental runs for the same polling day
+                "hours_table": (
+                    "{% $incremental"
+                    " ? 'election_period_hours_' & $replace($states.result.Payload.polling_day_athena, '/', '')"
+                    " : 'election_period_hours_' & $run_id %}"
+                ),
+                "hours_location": (
+                    "{% $incremental"
+                    " ? $states.result.Payload.polling_day_athena & '/incremental/election_period_hours/'"
+                    " : 'election-period-slices/election_period_hours_' & $run_id & '/' %}"
+                ),
+            },
+        )
+
+    def election_period_slice_task(self, then: sfn.IChainable):
+        """
+        Filter the logs for the election period into `$slice_table`, then
+        run `then`. If that fails, `$report_error` is set.
+
+        The hourly counts are first brought up to date in `$hours_table`,
+        see `election_period_hours_task`. For most runs that's a table of
+        their own, dropped once the slice is made. Incremental runs share a
+        table for the polling day, so take a lock on it first, which is
+        released once the slice is made.
+        """
+        bucket = self.buckets_by_name[
+            postcode_searches_results_bucket.bucket_name
+        ]
+        lock_key = "{% $polling_day_athena & '/incremental/lock' %}"
+
+        filter_logs_task = sfn.Parallel(
+            self,
+            "Filter Election Period Logs",
+            query_language=sfn.QueryLanguage.JSONATA,
+        ).branch(
+            self.election_period_hours_task(
+                then=AthenaQueryTask(
+                    self,
+                    "Filter Election Period Logs Query",
+                    task_name="Filter Election Period Logs Query",
+                    athena_lambda_function=self.run_athena_query_lambda.lambda_function,
+                    payload={
+                        "QueryContext": {
+                            "slice_table": "{% $slice_table %}",
+                            "hours_table": "{% $hours_table %}",
+                            "start_of_election_period_day": "{% $start_of_election_period_day_athena %}",
+                            "polling_day": "{% $polling_day_athena %}",
+                            "updown_api_key": "{% $updown_api_key %}",
+                            "start_datetime_utc": "{% $start_of_election_period_utc %}",
+                            "end_datetime_utc": "{% $close_of_polls_utc %}",
+                            "start_datetime_london": "{% $start_of_election_period_london %}",
+                            "end_datetime_london": "{% $close_of_polls_london %}",
+                            "hours_cutoff_day": "{% $hours_cutoff_day %}",
+                            "hours_cutoff_hour": "{% $hours_cutoff_hour %}",
+                        },
+                        "QueryName": election_period_slice_query.name,
+                        "QueryVersion": query_version(
+                            election_period_slice_query
+                        ),
+                    },
+                    query_execution_id_variable="slice_query_execution_id",
+                ).task
+            )
+        )
+
+        release_lock_task = tasks.CallAwsService(
+            self,
+            "Release Incremental Lock",
+            service="s3",
+            action="deleteObject",
+            parameters={"Bucket": bucket.bucket_name, "Key": lock_key},
+            iam_resources=[bucket.arn_for_objects("*/incremental/*")],
+            iam_action="s3:DeleteObject",
+            query_language=sfn.QueryLanguage.JSONATA,
+        )
+        release_lock_task.next(then)
+
+        drop_hours_task = AthenaQueryTask(
+            self,
+            "Drop Run Election Period Hours",
+            task_name="Drop Run Election Period Hours",
+            athena_lambda_function=self.run_athena_query_lambda.lambda_function,
+            payload={
+                "QueryString": "DROP TABLE IF EXISTS `dc-wide-logs`.`{hours_table}`",
+                "QueryContext": {"hours_table": "{% $hours_table %}"},
+            },
+            query_execution_id_variable="drop_run_hours_query_execution_id",
+        ).task.next(
+            self.delete_files_task(
+                "Run Election Period Hours",
+                postcode_searches_results_bucket,
+                "election-period-slices/",
+                "{% $hours_location %}",
+                then=then,
+            )
+        )
+
+        clear_up_choice = (
+            sfn.Choice(
+                self,
+                "Shared Election Period Hours?",
+                query_language=sfn.QueryLanguage.JSONATA,
+            )
+            .when(
+                sfn.Condition.jsonata("{% $incremental %}"), release_lock_task
+            )
+            .otherwise(drop_hours_task)
+        )
+        filter_logs_task.next(clear_up_choice)
+        filter_logs_task.add_catch(
+            clear_up_choice,
+            errors=[sfn.Errors.ALL],
+            assign={"report_error": "{% $states.errorOutput %}"},
+        )
+
+        return (
+            sfn.Choice(
+                self,
+                "Incremental Reporting?",
+                query_language=sfn.QueryLanguage.JSONATA,
+            )
+            .when(
+                sfn.Condition.jsonata("{% $incremental %}"),
+                self.acquire_incremental_lock_task(
+                    lock_key, then=filter_logs_task
+                ),
+            )
+            .otherwise(filter_logs_task)
+        )
+
+    def acquire_incremental_lock_task(
+        self, lock_key: str, then: sfn.IChainable
+    ) -> sfn.IChainable:
+        """
+        Create the object at `lock_key`, holding this execution's ARN, then
+        run `then`.
+
+        S3 only creates the object if it doesn't already exist. If it does,
+        the lock is taken over if the execution holding it has stopped, for
+        example by timing out. Otherwise, this execution fails.
+        """
+        bucket = self.buckets_by_name[
+            postcode_searches_results_bucket.bucket_name
+        ]
+        execution_arns = self.format_arn(
+            service="states",
+            resource="execution",
+            resource_name="PostcodeSearchesReporting:*",
+            arn_format=ArnFormat.COLON_RESOURCE_NAME,
+        )
+
+        def put_lock_task(name, condition):
+            return tasks.CallAwsService(
+                self,
+                name,
+                service="s3",
+                action="putObject",
+                parameters={
+                    "Bucket": bucket.bucket_name,
+                    "Key": lock_key,
+                    "Body": "{% $states.context.Execution.Id %}",
+                    **condition,
+                },
+                iam_resources=[bucket.arn_for_objects("*/incremental/*")],
+                iam_action="s3:PutObject",
+                query_language=sfn.QueryLanguage.JSONATA,
+            )
+
+        acquire_lock_task = put_lock_task(
+            "Acquire Incremental Lock", {"IfNoneMatch": "*"}
+        )
+        # Only replaces the lock if it hasn't changed since it was read
+        take_over_lock_task = put_lock_task(
+            "Take Over Incremental Lock", {"IfMatch": "{% $lock_etag %}"}
+        )
+
+        read_lock_task = tasks.CallAwsService(
+            self,
+            "Read Incremental Lock",
+            service="s3",
+            action="getObject",
+            parameters={"Bucket": bucket.bucket_name, "Key": lock_key},
+            iam_resources=[bucket.arn_for_objects("*/incremental/*")],
+            iam_action="s3:GetObject",
+            query_language=sfn.QueryLanguage.JSONATA,
+            assign={
+                "lock_holder": "{% $states.result.Body %}",
+                "lock_etag": "{% $states.result.ETag %}",
+            },
+        )
+        describe_holder_task = tasks.CallAwsService(
+            self,
+            "Describe Incremental Lock Holder",
+            service="sfn",
+            action="describeExecution",
+            parameters={"ExecutionArn": "{% $lock_holder %}"},
+            iam_resources=[execution_arns],
+            iam_action="states:DescribeExecution",
+            query_language=sfn.QueryLanguage.JSONATA,
+            assign={"lock_holder_status": "{% $states.result.Status %}"},
+        )
+        holder_running_choice = (
+            sfn.Choice(
+                self,
+                "Incremental Lock Holder Running?",
+                query_language=sfn.QueryLanguage.JSONATA,
+            )
+            .when(
+                sfn.Condition.jsonata("{% $lock_holder_status = 'RUNNING' %}"),
+                sfn.Fail(
+                    self,
+                    "Incremental Run In Progress",
+                    query_language=sfn.QueryLanguage.JSONATA,
+                    error="IncrementalRunInProgress",
+                    cause="{% 'Already being updated by ' & $lock_holder %}",
+                ),
+            )
+            .otherwise(take_over_lock_task)
+        )
+
+        acquire_lock_task.next(then)
+        acquire_lock_task.add_catch(read_lock_task, errors=[sfn.Errors.ALL])
+        # The lock was released since trying to acquire it
+        read_lock_task.add_catch(acquire_lock_task, errors=[sfn.Errors.ALL])
+        read_lock_task.next(describe_holder_task)
+        # Executions are only kept for 90 days after they stop
+        describe_holder_task.add_catch(
+            take_over_lock_task,
+            errors=["Sfn.ExecutionDoesNotExistException"],
+        )
+        describe_holder_task.next(holder_running_choice)
+        take_over_lock_task.next(then)
+        # Another execution took it over first
+        take_over_lock_task.add_catch(read_lock_task, errors=[sfn.Errors.ALL])
+        return acquire_lock_task
+
+    def election_period_hours_task(self, then: sfn.IChainable):
+        """
+        Bring the hourly counts for the election period in `$hours_table` up
+        to the rollup cutoff, then run `then`.
+
+        The table is built from the start of the election period, unless
+        this is an incremental run. Then, the table is kept for the polling
+        day, and only the hours rolled up since the last run are appended.
+
+        The first hour that isn't in the table is assigned to
+        `$hours_cutoff_day` and `$hours_cutoff_hour`. The slice reads the
+        logs themselves for any hour from then on that isn't in the table,
+        which covers hours whose rollup is missing. Incremental runs save
+        it in `{polling_day}/incremental/state.json`, next to the reports,
+        to append from next time.
+        """
+        bucket = self.buckets_by_name[
+            postcode_searches_results_bucket.bucket_name
+        ]
+        state_key = "{% $polling_day_athena & '/incremental/state.json' %}"
+
+        def hours_query_context(from_day, from_hour):
+            return {
+                "hours_table": "{% $hours_table %}",
+                "hours_location": "{% $hours_location %}",
+                "from_day": from_day,
+                "from_hour": from_hour,
+                "polling_day": "{% $polling_day_athena %}",
+                "rollup_cutoff_day": "{% $rollup_cutoff_day_athena %}",
+                "rollup_cutoff_hour": "{% $rollup_cutoff_hour %}",
+            }
+
+        save_state_task = tasks.CallAwsService(
+            self,
+            "Save Incremental State",
+            service="s3",
+            action="putObject",
+            parameters={
+                "Bucket": bucket.bucket_name,
+                "Key": state_key,
+                "ContentType": "application/json",
+                "Body": (
+                    "{% $string({"
+                    "'start_of_election_period_utc': $start_of_election_period_utc, "
+                    "'close_of_polls_utc': $close_of_polls_utc, "
+                    "'rollup_cutoff_day': $hours_cutoff_day, "
+                    "'rollup_cutoff_hour': $hours_cutoff_hour"
+                    "}) %}"
+                ),
+            },
+            iam_resources=[bucket.arn_for_objects("*/incremental/*")],
+            iam_action="s3:PutObject",
+            query_language=sfn.QueryLanguage.JSONATA,
+        )
+        save_state_task.next(then)
+
+        read_cutoff_task = tasks.CallAwsService(
+            self,
+            "Read Election Period Hours Cutoff",
+            service="athena",
+            action="getQueryResults",
+            parameters={
+                "QueryExecutionId": "{% $hours_cutoff_query_execution_id %}"
+            },
+            iam_resources=["*"],
+            iam_action="athena:GetQueryResults",
+            additional_iam_statements=[
+                iam.PolicyStatement(
+                    actions=["s3:GetObject"],
+                    resources=[bucket.arn_for_objects("*")],
+                )
+            ],
+            query_language=sfn.QueryLanguage.JSONATA,
+            # The first row is the column names
+            assign={
+                "hours_cutoff_day": "{% $states.result.ResultSet.Rows[1].Data[0].VarCharValue %}",
+                "hours_cutoff_hour": "{% $number($states.result.ResultSet.Rows[1].Data[1].VarCharValue) %}",
+            },
+        )
+        read_cutoff_task.next(
+            sfn.Choice(
+                self,
+                "Save Election Period Hours?",
+                query_language=sfn.QueryLanguage.JSONATA,
+            )
+            .when(sfn.Condition.jsonata("{% $incremental %}"), save_state_task)
+            .otherwise(then)
+        )
+
+        cutoff_task = AthenaQueryTask(
+            self,
+            "Find Election Period Hours Cutoff",
+            task_name="Find Election Period Hours Cutoff",
+            athena_lambda_function=self.run_athena_query_lambda.lambda_function,
+            payload={
+                "QueryContext": hours_query_context(
+                    "{% $start_of_election_period_day_athena %}", 0
+                ),
+                "QueryName": election_period_hours_cutoff_query.name,
+                "QueryVersion": query_version(
+                    election_period_hours_cutoff_query
+                ),
+            },
+            query_execution_id_variable="hours_cutoff_query_execution_id",
+        ).task
+        cutoff_task.next(read_cutoff_task)
+
+        build_task = AthenaQueryTask(
+            self,
+            "Build Election Period Hours",
+            task_name="Build Election Period Hours",
+            athena_lambda_function=self.run_athena_query_lambda.lambda_function,
+            payload={
+                "QueryContext": hours_query_context(
+                    "{% $start_of_election_period_day_athena %}", 0
+                ),
+                "QueryName": election_period_hours_query.name,
+                "QueryVersion": query_version(election_period_hours_query),
+            },
+            query_execution_id_variable="hours_build_query_execution_id",
+        ).task
+        build_task.next(cutoff_task)
+
+        rebuild_task = AthenaQueryTask(
+            self,
+            "Drop Election Period Hours",
+            task_name="Drop Election Period Hours",
+            athena_lambda_function=self.run_athena_query_lambda.lambda_function,
+            payload={
+                "QueryString": "DROP TABLE IF EXISTS `dc-wide-logs`.`{hours_table}`",
+                "QueryContext": {"hours_table": "{% $hours_table %}"},
+            },
+            query_execution_id_variable="hours_drop_query_execution_id",
+        ).task.next(
+            self.delete_files_task(
+                "Election Period Hours",
+                postcode_searches_results_bucket,
+                "*/incremental/",
+                "{% $hours_location %}",
+                then=build_task,
+            )
+        )
+
+        append_task = AthenaQueryTask(
+            self,
+            "Append Election Period Hours",
+            task_name="Append Election Period Hours",
+            athena_lambda_function=self.run_athena_query_lambda.lambda_function,
+            payload={
+                "QueryContext": hours_query_context(
+                    "{% $incremental_state.rollup_cutoff_day %}",
+                    "{% $incremental_state.rollup_cutoff_hour %}",
+                ),
+                "QueryName": election_period_hours_append_query.name,
+                "QueryVersion": query_version(
+                    election_period_hours_append_query
+                ),
             },
+            query_execution_id_variable="hours_append_query_execution_id",
+        ).task
+        append_task.next(cutoff_task)
+
+        # The saved counts can only be added to if they're for the same
+        # election period
+        same_period = (
+            "$incremental_state != null"
+            " and $incremental_state.start_of_election_period_utc = $start_of_election_period_utc"
+            " and $incremental_state.close_of_polls_utc = $close_of_polls_utc"
+        )
+        same_cutoff = (
+            "$incremental_state.rollup_cutoff_day = $rollup_cutoff_day_athena"
+            " and $incremental_state.rollup_cutoff_hour = $rollup_cutoff_hour"
+        )
+        update_choice = (
+            sfn.Choice(
+                self,
+                "Election Period Hours Up To Date?",
+                query_language=sfn.QueryLanguage.JSONATA,
+            )
+            .when(
+                sfn.Condition.jsonata(
+                    f"{{% {same_period} and {same_cutoff} %}}"
+                ),
+                sfn.Pass(
+                    self,
+                    "Use Saved Election Period Hours Cutoff",
+                    query_language=sfn.QueryLanguage.JSONATA,
+                    assign={
+                        "hours_cutoff_day": "{% $incremental_state.rollup_cutoff_day %}",
+                        "hours_cutoff_hour": "{% $incremental_state.rollup_cutoff_hour %}",
+                    },
+                ).next(then),
+            )
+            .when(sfn.Condition.jsonata(f"{{% {same_period} %}}"), append_task)
+            .otherwise(rebuild_task)
+        )
+
+        read_state_task = tasks.CallAwsService(
+            self,
+            "Read Incremental State",
+            service="s3",
+            action="getObject",
+            parameters={"Bucket": bucket.bucket_name, "Key": state_key},
+            iam_resources=[bucket.arn_for_objects("*/incremental/*")],
+            iam_action="s3:GetObject",
+            query_language=sfn.QueryLanguage.JSONATA,
+            assign={"incremental_state": "{% $parse($states.result.Body) %}"},
+        )
+        read_state_task.next(update_choice)
+        # Missing or unreadable state means starting again
+        read_state_task.add_catch(
+            update_choice,
+            errors=[sfn.Errors.ALL],
+            assign={"incremental_state": None},
+        )
+
+        return (
+            sfn.Choice(
+                self,
+                "Keep Election Period Hours?",
+                query_language=sfn.QueryLanguage.JSONATA,
+            )
+            .when(sfn.Condition.jsonata("{% $incremental %}"), read_state_task)
+            .otherwise(build_task)
+        )
+
+    def drop_election_period_slice_task(self):
+        drop_table_task = AthenaQueryTask(
+            self,
+            "Drop Election Period Logs",
+            task_name="Drop Election Period Logs",
+            athena_lambda_function=self.run_athena_query_lambda.lambda_function,
+            payload={
+                "QueryString": "DROP TABLE IF EXISTS `dc-wide-logs`.`{slice_table}`",
+                "QueryContext": {"slice_table": "{% $slice_table %}"},
+            },
+            query_execution_id_variable="drop_slice_query_execution_id",
+        ).task
+        report_result = (
+            sfn.Choice(
+                self,
+                "Reports Succeeded?",
+                query_language=sfn.QueryLanguage.JSONATA,
+            )
+            .when(
+                sfn.Condition.jsonata("{% $report_error = null %}"),
+                sfn.Succeed(self, "Reports Complete"),
+            )
+            .otherwise(
+                sfn.Fail(
+                    self,
+                    "Reports Failed",
+                    query_language=sfn.QueryLanguage.JSONATA,
+                    error="{% $report_error.Error %}",
+                    cause="{% $report_error.Cause %}",
+                )
+            )
+        )
+        return drop_table_task.next(
+            self.delete_files_task(
+                "Election Period Logs",
+                postcode_searches_results_bucket,
+                "election-period-slices/",
+                "{% 'election-period-slices/' & $slice_table & '/' %}",
+                then=report_result,
+            )
         )
 
     def queries(self) -> List[BaseQuery]:
         return [
+            election_period_hours_query,
+            election_period_hours_append_query,
+            election_period_hours_cutoff_query,
+            election_period_slice_query,
             total_searches_query,
             by_local_authority_query,
             by_product_query,
+            hourly_rollup_query,
+            postcode_lookup_query,
         ]
 
     def make_queries(self, workgroup_name):
@@ -331,3 +949,260 @@ class PostcodeSearchesStack(Stack):
                 query=query,
                 workgroup_name=workgroup_name,
             )
+
+    def hourly_rollup_definition(self) -> sfn.IChainable:
+        """
+        Count the searches in an hour of logs into the hourly table.
+
+        Defaults to the previous hour. Pass `{"hour": "2024-05-02T13:00Z"}` as
+        the input to roll up (or redo) another hour. Any existing counts for
+        the hour are deleted first, so running this twice doesn't double count.
+        """
+        hour_millis = (
+            "($exists($states.input.hour)"
+            " ? $toMillis($states.input.hour)"
+            " : $toMillis($now()) - 3600000)"
+        )
+        assign_hour_task = sfn.Pass(
+            self,
+            "Assign Rollup Hour",
+            query_language=sfn.QueryLanguage.JSONATA,
+            assign={
+                "logs_day": f"{{% $fromMillis({hour_millis}, '[Y0001]/[M01]/[D01]') %}}",
+                "rollup_day": f"{{% $fromMillis({hour_millis}, '[Y0001]-[M01]-[D01]') %}}",
+                "rollup_hour": f"{{% $number($fromMillis({hour_millis}, '[H01]')) %}}",
+            },
+        )
+
+        # Logs from the stream that isn't partitioned by product are only
+        # in the table once they've been moved into the product's path, so
+        # that's done before counting the hour
+        partition_logs_task = tasks.LambdaInvoke(
+            self,
+            "Partition Rollup Hour Logs",
+            lambda_function=self.partition_logs_lambda(),
+            payload=sfn.TaskInput.from_object(
+                {"hour": f"{{% $fromMillis({hour_millis}) %}}"}
+            ),
+            query_language=sfn.QueryLanguage.JSONATA,
+        )
+
+        table = dc_postcode_searches_hourly_table
+        rollup_query_task = AthenaQueryTask(
+            self,
+            "Run Hourly Rollup Query",
+            task_name="Run Hourly Rollup Query",
+            athena_lambda_function=self.run_athena_query_lambda.lambda_function,
+            payload={
+                "QueryContext": {
+                    "day": "{% $logs_day %}",
+                    "hour": "{% $rollup_hour %}",
+                    "rollup_day": "{% $rollup_day %}",
+                },
+                "QueryName": hourly_rollup_query.name,
+                "QueryVersion": query_version(hourly_rollup_query),
+            },
+            query_execution_id_variable="rollup_query_execution_id",
+        ).task
+
+        return assign_hour_task.next(partition_logs_task).next(
+            self.delete_files_task(
+                "Rollup",
+                table.bucket,
+                table.s3_prefix,
+                f"{{% '{table.s3_prefix}day=' & $rollup_day & '/hour=' & $rollup_hour & '/' %}}",
+                then=rollup_query_task,
+            )
+        )
+
+    def partition_logs_lambda(self) -> aws_lambda.Function:
+        """
+        Moves the files the `dc-postcode-searches` stream writes directly
+        under the hour into each product's path. It shares its code with
+        the compaction Lambda.
+        """
+        table = dc_postcode_searches_table
+        bucket = self.buckets_by_name[table.bucket.bucket_name]
+        function = aws_lambda.Function(
+            self,
+            "partition_postcode_search_logs",
+            function_name="partition_postcode_search_logs",
+            runtime=aws_lambda.Runtime.PYTHON_3_12,
+            code=aws_lambda.Code.from_asset(
+                str(
+                    Path(__file__).resolve().parent.parent
+                    / "lambdas"
+                    / "compact_logs"
+                )
+            ),
+            handler="handler.partition_handler",
+            timeout=Duration.minutes(5),
+            memory_size=1024,
+            environment={
+                "BUCKET_NAME": bucket.bucket_name,
+                "PREFIX": table.s3_prefix,
+            },
+        )
+        bucket.grant_read_write(function, f"{table.s3_prefix}/*")
+        bucket.grant_delete(function, f"{table.s3_prefix}/*")
+        return function
+
+    def hourly_rollup_backfill_definition(self) -> sfn.IChainable:
+        """
+        Roll up (or redo) every hour from `start` up to `end`, given as the
+        input, e.g. `{"start": "2024-04-01T00:00Z", "end": "2024-05-03T00:00Z"}`.
+
+        Each hour is an execution of the hourly rollup state machine, a few
+        at a time.
+        """
+        hours = (
+            "[0..$floor(($toMillis($states.input.end)"
+            " - $toMillis($states.input.start)) / 3600000) - 1]"
+        )
+        return sfn.Map(
+            self,
+            "Roll Up Each Hour",
+            query_language=sfn.QueryLanguage.JSONATA,
+            items=sfn.ProvideItems.jsonata(
+                f"{{% $map({hours}, function($i) {{"
+                " $fromMillis($toMillis($states.input.start) + $i * 3600000)"
+                " }) %}"
+            ),
+            max_concurrency=4,
+        ).item_processor(
+            tasks.StepFunctionsStartExecution(
+                self,
+                "Roll Up Hour",
+                state_machine=self.rollup_step_function,
+                integration_pattern=sfn.IntegrationPattern.RUN_JOB,
+                input=sfn.TaskInput.from_object(
+                    {"hour": "{% $states.input %}"}
+                ),
+                query_language=sfn.QueryLanguage.JSONATA,
+            )
+        )
+
+    def delete_files_task(
+        self,
+        name: str,
+        bucket: S3Bucket,
+        key_prefix: str,
+        prefix: str,
+        then: sfn.IChainable,
+    ) -> sfn.IChainable:
+        """
+        Delete the files under `prefix` (which can be a JSONata expression)
+        in `bucket`, then run `then`. `key_prefix` is the fixed start of
+        `prefix`, which the state machine is allowed to delete from.
+
+        Athena can't overwrite the data in a table, or delete it when the
+        table is dropped, so this is used to clear up after it.
+
+        Each listing returns at most 1,000 files, as does each delete, so
+        the files are listed and deleted a page at a time until none are
+        left. As each page is deleted before listing again, the next listing
+        starts from the first file left, without a continuation token.
+        """
+        bucket = self.buckets_by_name[bucket.bucket_name]
+        # Named for the task, as a Parallel branch can't assign a variable
+        # that's also assigned outside it
+        keys_variable = re.sub(r"\W", "_", name.lower()) + "_keys"
+        list_existing_task = tasks.CallAwsService(
+            self,
+            f"List Existing {name} Files",
+            service="s3",
+            action="listObjectsV2",
+            parameters={"Bucket": bucket.bucket_name, "Prefix": prefix},
+            iam_resources=[bucket.bucket_arn],
+            iam_action="s3:ListBucket",
+            query_language=sfn.QueryLanguage.JSONATA,
+            assign={
+                keys_variable: "{% $exists($states.result.Contents) ? [$states.result.Contents.{'Key': Key}] : [] %}"
+            },
+        )
+        delete_existing_task = tasks.CallAwsService(
+            self,
+            f"Delete Existing {name} Files",
+            service="s3",
+            action="deleteObjects",
+            parameters={
+                "Bucket": bucket.bucket_name,
+                "Delete": {
+                    "Objects": f"{{% ${keys_variable} %}}",
+                    # Only files that couldn't be deleted are returned
+                    "Quiet": True,
+                },
+            },
+            iam_resources=[bucket.arn_for_objects(f"{key_prefix}*")],
+            iam_action="s3:DeleteObject",
+            query_language=sfn.QueryLanguage.JSONATA,
+            assign={
+                keys_variable: "{% $exists($states.result.Errors) ? [$states.result.Errors.{'Key': Key}] : [] %}"
+            },
+        )
+        # Otherwise the same files would be listed and deleted forever
+        delete_failed = sfn.Fail(
+            self,
+            f"{name} Files Not Deleted",
+            error="DeleteFilesFailed",
+            cause=f"Some of the {name} files couldn't be deleted",
+            query_language=sfn.QueryLanguage.JSONATA,
+        )
+        return list_existing_task.next(
+            sfn.Choice(
+                self,
+                f"{name} Files Exist?",
+                query_language=sfn.QueryLanguage.JSONATA,
+            )
+            .when(
+                sfn.Condition.jsonata(f"{{% $count(${keys_variable}) > 0 %}}"),
+                delete_existing_task.next(
+                    sfn.Choice(
+                        self,
+                        f"{name} Files Deleted?",
+                        query_language=sfn.QueryLanguage.JSONATA,
+                    )
+                    .when(
+                        sfn.Condition.jsonata(
+                            f"{{% $count(${keys_variable}) > 0 %}}"
+                        ),
+                        delete_failed,
+                    )
+                    .otherwise(list_existing_task)
+                ),
+            )
+            .otherwise(then)
+        )
+
+    def populate_table_state_machine(
+        self, table: GlueTable
+    ) -> sfn.StateMachine:
+        """
+        Replace the contents of a managed table with the results of its
+        `populated_with` query
+        """
+        populate_query_task = AthenaQueryTask(
+            self,
+            f"Run {table.populated_with.name}",
+            task_name=f"Run {table.populated_with.name}",
+            athena_lambda_function=self.run_athena_query_lambda.lambda_function,
+            payload={
+                "QueryContext": {},
+                "QueryName": table.populated_with.name,
+                "QueryVersion": query_version(table.populated_with),
+            },
+            query_execution_id_variable="populate_query_execution_id",
+        ).task
+        return sfn.StateMachine(
+            self,
+            f"Populate-{table.table_name}",
+            state_machine_name=f"Populate-{table.table_name}",
+            definition=self.delete_files_task(
+                table.table_name,
+                table.bucket,
+                table.s3_prefix,
+                table.s3_prefix,
+                then=populate_query_task,
+            ),
+            timeout=Duration.minutes(10),
+        )
@@ -2,4 +2,5 @@ from importlib.metadata import version
 
 __version__ = version("dc_logging_utils")
 
+from .async_log_client import *  # noqa
 from .log_client import *  # noqa
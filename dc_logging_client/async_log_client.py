@@ -0,0 +1,188 @@
+import asyncio
+import contextlib
+import logging
+from typing import List, Optional
+
+from .log_client import BaseLoggingClient
+from .log_entries import BaseLogEntry, PostcodeLogEntry
+from .transports import BaseTransport
+
+__all__ = [
+    "AsyncDCWidePostcodeLoggingClient",
+]
+
+logger = logging.getLogger(__name__)
+
+# Put on the queue to make the sending task send what it has without waiting
+# for the batch to fill
+_FLUSH = object()
+
+
+class BaseAsyncLoggingClient(BaseLoggingClient):
+    """
+    Logger client for use from asyncio code.
+
+    `await log(entry)` puts the entry on a queue and returns. A task on the
+    event loop collects queued entries into batches and sends them without
+    blocking the loop. Call `aclose()` before the loop stops, for example
+    in an ASGI lifespan shutdown handler, to send anything still queued.
+    """
+
+    def __init__(
+        self,
+        fake: bool = False,
+        function_arn: str = None,
+        region: str = "eu-west-2",
+        max_batch_size: int = 100,
+        max_batch_interval: float = 5.0,
+        max_queue_size: int = 10_000,
+        transport: Optional[BaseTransport] = None,
+    ):
+        """
+        :param fake: If True, no data is actually logged. DEBUG entries
+                     are sent to the local `logger` client.
+        :param function_arn: The ARN of the Lambda function to submit records to
+        :param transport: How to submit records. Defaults to invoking the
+                          Lambda function at `function_arn`
+        :param max_batch_size: Send once this many entries are waiting
+        :param max_batch_interval: Send once the oldest waiting entry is this
+                                   many seconds old
+        :param max_queue_size: How many entries can wait to be sent before
+                               `log` waits for space
+        """
+        super().__init__(
+            fake=fake,
+            function_arn=function_arn,
+            region=region,
+            transport=transport,
+            max_batch_size=max_batch_size,
+            max_batch_interval=max_batch_interval,
+        )
+        self.max_queue_size = max_queue_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._sender_task: Optional[asyncio.Task] = None
+        # Entries a sending task took from the queue, but was cancelled
+        # before sending
+        self._unsent: List[str] = []
+
+    async def log(self, data: BaseLogEntry):
+        self.check_entry(data)
+        log_line = data.as_log_line(newline=False)
+        logger.debug(f"{self.stream_name}\t{log_line}")
+        if self.fake:
+            return
+        self._ensure_sender_task()
+        await self._queue.put(log_line)
+
+    async def flush(self):
+        """
+        Wait until everything queued so far has been sent or failed
+        """
+        if self._queue is not None:
+            await self._queue.put(_FLUSH)
+            await self._queue.join()
+
+    async def aclose(self):
+        """
+        Send everything queued and stop the sending task
+        """
+        await self.flush()
+        if self._sender_task is not None:
+            self._sender_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._sender_task
+            self._sender_task = None
+            self._queue = None
+
+    def close(self):
+        # The inherited `close` would call `flush` without awaiting it, so
+        # nothing would be sent
+        raise RuntimeError(
+            f"{type(self).__name__} is closed with `await aclose()`"
+        )
+
+    def _ensure_sender_task(self):
+        if self._sender_task is not None and not self._sender_task.done():
+            return
+        # The task stops with its event loop, and a queue can't be used from
+        # another loop, so what it hadn't sent is moved to a new queue for the
+        # new task to send
+        unsent, self._unsent = self._unsent, []
+        while self._queue is not None and not self._queue.empty():
+            line = self._queue.get_nowait()
+            if line is not _FLUSH:
+                unsent.append(line)
+        self._queue = asyncio.Queue(
+            maxsize=max(self.max_queue_size, len(unsent))
+        )
+        for line in unsent:
+            self._queue.put_nowait(line)
+        self._sender_task = asyncio.get_running_loop().create_task(
+            self._send_batches(), name=f"{self.stream_name}-sender"
+        )
+
+    async def _send_batches(self):
+        carried_over = None
+        while True:
+            if carried_over is not None:
+                first, carried_over = carried_over, None
+            else:
+                first = await self._queue.get()
+                if first is _FLUSH:
+                    self._queue.task_done()
+                    continue
+            batch = [first]
+            try:
+                carried_over = await self._fill_batch(batch)
+            except asyncio.CancelledError:
+                self._unsent = batch
+                raise
+            try:
+                # boto3 is synchronous, so the request is made on the loop's
+                # default executor rather than on the loop itself
+                await asyncio.to_thread(self._send_batch, batch)
+            except asyncio.CancelledError:
+                # The batch is still sent by its thread
+                if carried_over is not None:
+                    self._unsent = [carried_over]
+                raise
+            except Exception:
+                logger.exception(f"Failed to log {len(batch)} entries")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _fill_batch(self, batch: List[str]) -> Optional[str]:
+        """
+        Add queued entries to `batch` until it's full or due. Returns the
+        entry that didn't fit, if any.
+        """
+        loop = asyncio.get_running_loop()
+        batch_bytes = len(batch[0].encode("utf-8")) + 1
+        deadline = loop.time() + self.max_batch_interval
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            try:
+                if timeout > 0:
+                    line = await asyncio.wait_for(
+                        self._queue.get(), timeout=timeout
+                    )
+                else:
+                    line = self._queue.get_nowait()
+            except (asyncio.TimeoutError, asyncio.QueueEmpty):
+                break
+            if line is _FLUSH:
+                self._queue.task_done()
+                break
+            line_bytes = len(line.encode("utf-8")) + 1
+            if batch_bytes + line_bytes > self.max_batch_bytes:
+                return line
+            batch.append(line)
+            batch_bytes += line_bytes
+        return None
+
+
+class AsyncDCWidePostcodeLoggingClient(BaseAsyncLoggingClient):
+    stream_name = "dc-postcode-searches"
+    delivery_stream_name = "dc-postcode-searches-by-product"
+    entry_class = PostcodeLogEntry
@@ -0,0 +1,108 @@
+"""
+A process-wide cache of boto3 clients.
+
+Creating a client is slow: it loads the service model and endpoint data, and
+each client has its own connection pool. Logging clients are often created
+per request, so they share clients from here instead, along with their
+connections.
+
+The cache is emptied in forked child processes, as connection pools can't be
+shared across a fork.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+import boto3
+from botocore.config import Config
+
+__all__ = [
+    "Credentials",
+    "get_client",
+]
+
+# botocore's default is 10
+DEFAULT_MAX_POOL_CONNECTIONS = 10
+DEFAULT_TCP_KEEPALIVE = True
+
+# Assumed role credentials are replaced regularly, and each set gets its own
+# clients, so we only keep the most recently used
+MAX_CACHED_CLIENTS = 32
+
+
+class Credentials(NamedTuple):
+    access_key_id: str
+    secret_access_key: str
+    session_token: Optional[str] = None
+
+
+_lock = threading.Lock()
+_clients: "OrderedDict[tuple, object]" = OrderedDict()
+
+
+def get_client(
+    service_name: str,
+    region_name: str,
+    credentials: Optional[Credentials] = None,
+    max_pool_connections: int = DEFAULT_MAX_POOL_CONNECTIONS,
+    tcp_keepalive: bool = DEFAULT_TCP_KEEPALIVE,
+):
+    """
+    Return a client for `service_name`, creating it if this process doesn't
+    have one with the same region, credentials and connection settings.
+
+    :param credentials: If None, the default credential chain is used
+    :param max_pool_connections: The most connections the client keeps open
+    :param tcp_keepalive: Whether to send TCP keep-alive probes on idle
+                          connections, so they aren't silently dropped
+    """
+    key = (
+        service_name,
+        region_name,
+        credentials,
+        max_pool_connections,
+        tcp_keepalive,
+    )
+    with _lock:
+        if key in _clients:
+            _clients.move_to_end(key)
+            return _clients[key]
+
+        client_kwargs = {}
+        if credentials:
+            client_kwargs = {
+                "aws_access_key_id": credentials.access_key_id,
+                "aws_secret_access_key": credentials.secret_access_key,
+                "aws_session_token": credentials.session_token,
+            }
+        # Creating clients from boto3's default session isn't thread safe, but
+        # we're holding the lock
+        client = boto3.client(
+            service_name,
+            region_name=region_name,
+            config=Config(
+                max_pool_connections=max_pool_connections,
+                tcp_keepalive=tcp_keepalive,
+            ),
+            **client_kwargs,
+        )
+        _clients[key] = client
+        while len(_clients) > MAX_CACHED_CLIENTS:
+            _clients.popitem(last=False)
+        return client
+
+
+def clear():
+    """
+    Forget all cached clients
+    """
+    global _lock
+    # Another thread might have held the lock when we forked, in which case
+    # it would never be released in the child
+    _lock = threading.Lock()
+    _clients.clear()
+
+
+os.register_at_fork(after_in_child=clear)
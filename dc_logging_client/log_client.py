@@ -1,22 +1,43 @@
 import abc
+import atexit
+import functools
 import logging
 import os
-
-import boto3
+import threading
+import time
+import weakref
+from typing import Callable, List, Optional
 
 from .log_entries import (
     BaseLogEntry,
     DCProduct,
     PostcodeLogEntry,
 )
+from .sender import BackgroundSender, OverflowPolicy, SenderStats
+from .transports import BaseTransport, FirehoseTransport, LambdaTransport
 
 __all__ = [
     "DCWidePostcodeLoggingClient",
     "DCProduct",
+    "FirehoseTransport",
+    "LambdaTransport",
+    "OverflowPolicy",
 ]
 
 logger = logging.getLogger(__name__)
 
+# Buffered and background clients that haven't been closed. Only weakly held,
+# so clients created per request can still be garbage collected.
+_open_clients: "weakref.WeakSet[BaseLoggingClient]" = weakref.WeakSet()
+
+
+def _close_open_clients():
+    for client in list(_open_clients):
+        client.close()
+
+
+atexit.register(_close_open_clients)
+
 
 class BaseLoggingClient(abc.ABC):
     """
@@ -24,6 +45,10 @@ class BaseLoggingClient(abc.ABC):
     """
 
     stream_name = None
+    # The Firehose stream entries are put on. A stream's partitioning can't
+    # be changed once it's created, so this can move to a new stream while
+    # `stream_name` keeps naming the logs.
+    delivery_stream_name = None
     entry_class = None
     dc_product = DCProduct
 
@@ -32,47 +57,285 @@ class BaseLoggingClient(abc.ABC):
         fake: bool = False,
         function_arn: str = None,
         region: str = "eu-west-2",
+        buffered: bool = False,
+        max_batch_size: int = 100,
+        max_batch_interval: float = 5.0,
+        background: bool = False,
+        max_queue_size: int = 10_000,
+        worker_count: int = 2,
+        overflow_policy: OverflowPolicy = OverflowPolicy.drop_oldest,
+        transport: Optional[BaseTransport] = None,
     ):
         """
         :param fake: If True, no data is actually logged. DEBUG entries
                      are sent to the local `logger` client.
         :param function_arn: The ARN of the Lambda function to submit records to
+        :param transport: How to submit records. Defaults to invoking the
+                          Lambda function at `function_arn`
+        :param buffered: If True, entries are held in memory and submitted
+                         in batches rather than one invocation per entry
+        :param max_batch_size: When buffered, flush once this many entries
+                               are waiting
+        :param max_batch_interval: When buffered, flush once the oldest
+                                   waiting entry is this many seconds old
+        :param background: If True, entries are sent from a pool of worker
+                           threads so `log` never waits on the network
+        :param max_queue_size: When in the background, how many entries can
+                               wait to be sent before `overflow_policy` applies
+        :param worker_count: When in the background, the number of threads
+                             sending entries
+        :param overflow_policy: When in the background, what to do with new
+                                entries if the queue is full
         """
         self.fake = fake
         self.function_arn = self.get_function_arn(function_arn)
         self.region = region
-        if not fake:
+        self.buffered = buffered
+        self.max_batch_size = max_batch_size
+        self.max_batch_interval = max_batch_interval
+
+        self._buffer: List[str] = []
+        self._buffer_bytes = 0
+        self._buffer_started: Optional[float] = None
+        self._buffer_lock = threading.Lock()
+        self._buffer_pid = os.getpid()
+        self._flush_thread: Optional[threading.Thread] = None
+        self._closed = threading.Event()
+        self.sender: Optional[BackgroundSender] = None
+
+        self.transport = transport
+        if not fake and not transport:
             if not self.function_arn:
                 raise ValueError("`function_arn` when not faking")
-            self.client = boto3.client("lambda", region_name=self.region)
+            self.transport = LambdaTransport(
+                self.function_arn, region=self.region
+            )
+        # Batches are sent early if adding another entry would make them
+        # too large for the transport to send in one request
+        self.max_batch_bytes = (
+            self.transport or LambdaTransport
+        ).max_batch_bytes
+
+        if background and not fake:
+            # The workers mustn't hold a reference to the client, or it
+            # would never be garbage collected
+            self.sender = BackgroundSender(
+                functools.partial(
+                    self.transport.send, self.delivery_stream_name
+                ),
+                max_queue_size=max_queue_size,
+                worker_count=worker_count,
+                overflow_policy=overflow_policy,
+                # Without buffering, workers send whatever is queued rather
+                # than waiting for a batch to fill
+                max_batch_size=max_batch_size if buffered else 1,
+                max_batch_bytes=self.max_batch_bytes,
+                max_batch_wait=max_batch_interval if buffered else 0.0,
+                name=self.stream_name,
+            )
+        if (buffered or self.sender) and not fake:
+            _open_clients.add(self)
+            # Stop the threads and send anything left if the client is
+            # garbage collected without being closed
+            if self.sender:
+                finalizer = weakref.finalize(self, self.sender.stop)
+            else:
+                finalizer = weakref.finalize(
+                    self,
+                    _send_remaining,
+                    self._closed,
+                    self._buffer,
+                    functools.partial(
+                        self.transport.send, self.delivery_stream_name
+                    ),
+                )
+            # At exit, clients are closed by `_close_open_clients` instead
+            finalizer.atexit = False
 
     def get_function_arn(self, function_arn):
         if function_arn:
             return function_arn
         return os.environ.get("LOGGER_FUNCTION_ARN")
 
-    def log(self, data: BaseLogEntry):
+    def check_entry(self, data: BaseLogEntry):
         if not isinstance(data, self.entry_class):
             raise ValueError(
                 f"{type(data)} isn't a valid log entry for stream '{self.stream_name}'"
             )
-        logger.debug(f"{self.stream_name}\t{data.as_log_line()}")
-        if not self.fake:
-            response = self.client.invoke(
-                FunctionName=self.function_arn,
-                InvocationType="Event",
-                Payload=data.as_log_line(),
-            )
-            if response["ResponseMetadata"]["HTTPStatusCode"] != 202:
-                logger.warning(
-                    f"Failed to log `{data.as_log_line()}`. Got `{response}`"
-                )
-            if response.get("FunctionError"):
-                logger.warning(
-                    f"Failed to log `{data.as_log_line()}`. Got `{response["Payload"].read().decode('utf-8')}`"
+
+    def log(self, data: BaseLogEntry):
+        self.check_entry(data)
+        log_line = data.as_log_line(newline=False)
+        logger.debug(f"{self.stream_name}\t{log_line}")
+        if self.fake:
+            return
+        if self.sender:
+            self.sender.submit(log_line)
+        elif self.buffered:
+            self._add_to_buffer(log_line)
+        else:
+            self.transport.send(self.delivery_stream_name, [log_line])
+
+    def flush(self):
+        """
+        Send any buffered entries now, regardless of the batch limits
+        """
+        if self.sender:
+            self.sender.flush()
+            return
+        with self._buffer_lock:
+            batch = self._take_buffer()
+        if batch:
+            self._send_buffered(batch)
+
+    def close(self):
+        """
+        Stop the background flush thread and send anything still buffered.
+
+        Buffered and background clients are closed when the interpreter
+        exits, so it doesn't normally need calling directly.
+        """
+        _open_clients.discard(self)
+        self._closed.set()
+        if self.sender:
+            self.sender.close()
+            return
+        self.flush()
+
+    def stats(self) -> Optional[SenderStats]:
+        """
+        Counts of queued, sent, dropped and failed entries when logging in the
+        background
+        """
+        if not self.sender:
+            return None
+        return self.sender.stats()
+
+    def _add_to_buffer(self, log_line: str):
+        batches = []
+        with self._buffer_lock:
+            if self._buffer_pid != os.getpid():
+                # We've been forked, e.g. by a pre-loading web server. Any
+                # entries in the buffer belong to the parent, which will send
+                # them itself, and the flush thread didn't survive the fork.
+                self._buffer_pid = os.getpid()
+                self._take_buffer()
+                self._flush_thread = None
+
+            line_bytes = len(log_line.encode("utf-8")) + 1
+            if (
+                self._buffer
+                and self._buffer_bytes + line_bytes > self.max_batch_bytes
+            ):
+                batches.append(self._take_buffer())
+
+            if not self._buffer:
+                self._buffer_started = time.monotonic()
+            self._buffer.append(log_line)
+            self._buffer_bytes += line_bytes
+
+            if len(self._buffer) >= self.max_batch_size:
+                batches.append(self._take_buffer())
+
+            if self._flush_thread is None:
+                self._flush_thread = threading.Thread(
+                    target=_flush_periodically,
+                    args=(weakref.ref(self), self._closed),
+                    name=f"{self.stream_name}-flush",
+                    daemon=True,
                 )
+                self._flush_thread.start()
+
+        for batch in batches:
+            self._send_buffered(batch)
+
+    def _take_buffer(self) -> List[str]:
+        """
+        Empty the buffer, returning what was in it. Call with the lock held.
+        """
+        # Emptied in place, as the client's finalizer holds the list
+        batch = self._buffer[:]
+        self._buffer.clear()
+        self._buffer_bytes = 0
+        self._buffer_started = None
+        return batch
+
+    def _time_until_flush(self) -> float:
+        with self._buffer_lock:
+            started = self._buffer_started
+        if started is None:
+            return self.max_batch_interval
+        return max(0.0, started + self.max_batch_interval - time.monotonic())
+
+    def _flush_if_due(self):
+        batch = None
+        with self._buffer_lock:
+            started = self._buffer_started
+            if (
+                started is not None
+                and time.monotonic() - started >= self.max_batch_interval
+            ):
+                batch = self._take_buffer()
+        if batch:
+            self._send_buffered(batch)
+
+    def _send_buffered(self, batch: List[str]):
+        try:
+            self._send_batch(batch)
+        except Exception:
+            # Buffered entries are sent away from the code that logged them,
+            # often on the flush thread, so there's nobody to raise to
+            logger.exception(f"Failed to log {len(batch)} entries")
+
+    def _send_batch(self, batch: List[str]) -> bool:
+        return self.transport.send(self.delivery_stream_name, batch)
+
+
+def _flush_periodically(
+    client_ref: "weakref.ref[BaseLoggingClient]", closed: threading.Event
+):
+    """
+    Flush a buffered client's entries once they've waited long enough.
+
+    Only a weak reference to the client is kept while waiting, so the thread
+    doesn't stop an unused client from being garbage collected. The client's
+    finalizer sets `closed`, which ends the thread.
+    """
+    while True:
+        client = client_ref()
+        if client is None:
+            return
+        timeout = client._time_until_flush()
+        del client
+        if closed.wait(timeout):
+            return
+
+        client = client_ref()
+        if client is None:
+            return
+        client._flush_if_due()
+        del client
+
+
+def _send_remaining(
+    closed: threading.Event,
+    buffer: List[str],
+    send_batch: Callable[[List[str]], bool],
+):
+    """
+    Finalizer for buffered clients, stopping the flush thread and sending
+    anything left in `buffer`
+    """
+    closed.set()
+    if not buffer:
+        return
+    try:
+        send_batch(buffer[:])
+    except Exception:
+        logger.exception(f"Failed to log {len(buffer)} entries")
 
 
 class DCWidePostcodeLoggingClient(BaseLoggingClient):
     stream_name = "dc-postcode-searches"
+    delivery_stream_name = "dc-postcode-searches-by-product"
     entry_class = PostcodeLogEntry
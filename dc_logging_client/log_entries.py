@@ -1,9 +1,12 @@
 import abc
+import dataclasses
 import datetime
 import enum
 import json
+import typing
 from dataclasses import dataclass, field
-from typing import Union
+from json.encoder import encode_basestring_ascii
+from typing import Any, Callable, Dict, List, Tuple, Union
 
 
 @enum.unique
@@ -17,67 +20,239 @@ class DCProduct(enum.Enum):
 
     @classmethod
     def from_str_value(cls, value):
-        for enum_key, enum_value in cls.__members__.items():
-            if value == getattr(cls, enum_key).value:
-                return getattr(cls, enum_key)
-        raise ValueError("No item with string value found")
+        """
+        Look up a member by its value, e.g. "WCIVF". Failing that, names and
+        values are matched ignoring case, spaces and hyphens, so "wcivf" and
+        "aggregator-api" work too.
+        """
+        try:
+            return cls._value2member_map_[value]
+        except (KeyError, TypeError):
+            pass
+        try:
+            return _DC_PRODUCT_ALIASES[_product_alias(value)]
+        except (KeyError, AttributeError):
+            raise ValueError("No item with string value found") from None
+
+
+def _product_alias(value: str) -> str:
+    return value.strip().lower().replace("-", "_").replace(" ", "_")
+
+
+_DC_PRODUCT_ALIASES: Dict[str, DCProduct] = {}
+for _member in DCProduct:
+    _DC_PRODUCT_ALIASES[_product_alias(_member.name)] = _member
+    _DC_PRODUCT_ALIASES[_product_alias(_member.value)] = _member
+
+
+def _format_datetime(value: datetime.datetime) -> str:
+    # Athena uses Java's SimpleDateFormat, which doesn't support
+    # microseconds. We therefore need to remove the last 3 digits
+    #
+    # https://docs.aws.amazon.com/athena/latest/ug/data-types.html#data-types-timestamps
+    if value.tzinfo is None and value.year >= 1000:
+        # Much quicker than strftime, and the same output for naive datetimes
+        # with 4 digit years
+        return value.isoformat(sep=" ", timespec="milliseconds")
+    return value.strftime("%Y-%m-%d %H:%M:%S.%f")[0:-3]
+
+
+def _json_default(value: Any) -> Any:
+    """
+    Encode values JSON doesn't support in the shape the Glue schema for
+    their type expects
+    """
+    if isinstance(value, datetime.datetime):
+        return _format_datetime(value)
+    if isinstance(value, enum.Enum):
+        return value.value
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return {
+            f.name: getattr(value, f.name) for f in dataclasses.fields(value)
+        }
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    return str(value)
+
+
+_json_encoder = json.JSONEncoder(sort_keys=True, default=_json_default)
+
+
+def _encode_any(value: Any) -> str:
+    """
+    Encode a value of any type, as `json.dumps` would have with
+    `default=_json_default`
+    """
+    if value is None:
+        return "null"
+    if isinstance(value, datetime.datetime):
+        value = _format_datetime(value)
+    return _json_encoder.encode(value)
+
+
+def _encode_str(value: Any) -> str:
+    if isinstance(value, str):
+        # The C implementation, where available
+        return encode_basestring_ascii(value)
+    return _encode_any(value)
+
+
+def _encode_bool(value: Any) -> str:
+    if value is True:
+        return "true"
+    if value is False:
+        return "false"
+    return _encode_any(value)
+
+
+def _encode_int(value: Any) -> str:
+    if isinstance(value, int) and not isinstance(value, bool):
+        return int.__repr__(value)
+    return _encode_any(value)
+
+
+def _encode_datetime(value: Any) -> str:
+    if isinstance(value, datetime.datetime):
+        return f'"{_format_datetime(value)}"'
+    return _encode_any(value)
+
+
+# Encoders for the types fields are declared with. Each has a fast path for
+# values of that type, and falls back to `_encode_any` for anything
+# else, e.g. `None`, or a timestamp passed in as a string.
+_FIELD_ENCODERS: Dict[Any, Callable[[Any], str]] = {
+    str: _encode_str,
+    bool: _encode_bool,
+    int: _encode_int,
+    datetime.datetime: _encode_datetime,
+}
+
+LogLineSerializer = Callable[["BaseLogEntry"], str]
+_serializers: Dict[type, LogLineSerializer] = {}
+
+
+def _field_encoder(field_type: Any) -> Callable[[Any], str]:
+    # Optional and Union types use the encoder for their first non-None type
+    args = [arg for arg in typing.get_args(field_type) if arg is not type(None)]
+    if typing.get_origin(field_type) is Union and args:
+        field_type = args[0]
+    return _FIELD_ENCODERS.get(field_type, _encode_any)
+
+
+def _compile_serializer(cls: type) -> LogLineSerializer:
+    """
+    Work out the JSON for each key and the encoder for each field once per
+    class, rather than for every entry
+    """
+    try:
+        type_hints = typing.get_type_hints(cls)
+    except (NameError, TypeError):
+        type_hints = {}
+
+    parts: List[Tuple[str, str, Callable[[Any], str]]] = []
+    for entry_field in sorted(dataclasses.fields(cls), key=lambda f: f.name):
+        separator = ", " if parts else "{"
+        key = encode_basestring_ascii(entry_field.name)
+        field_type = type_hints.get(entry_field.name, entry_field.type)
+        parts.append(
+            (
+                f"{separator}{key}: ",
+                entry_field.name,
+                _field_encoder(field_type),
+            )
+        )
+
+    if not parts:
+        return lambda entry: "{}"
+
+    def serialize(entry: "BaseLogEntry") -> str:
+        return (
+            "".join(
+                [
+                    prefix + encode(getattr(entry, name))
+                    for prefix, name, encode in parts
+                ]
+            )
+            + "}"
+        )
+
+    return serialize
+
+
+def normalise_postcode(postcode: str) -> str:
+    """
+    The postcode as it's stored in the postcode lookup table, e.g. "SW1A1AA"
+    """
+    return postcode.upper().replace(" ", "").replace("+", "")
+
+
+# Entries are held in memory in bulk, e.g. by buffered clients or the legacy
+# importer, so the classes use __slots__ rather than a __dict__ per instance.
+# For that to work every base class needs empty __slots__, with the fields
+# declared as slots on the concrete entry class.
 
 
 @dataclass
 class BaseLogEntry(abc.ABC):
+    __slots__ = ()
+
     def as_log_line(self, newline=True):
-        newline_char = ""
+        """
+        The entry as a line of JSON, with keys in sorted order
+        """
+        cls = type(self)
+        serializer = _serializers.get(cls)
+        if serializer is None:
+            serializer = _serializers[cls] = _compile_serializer(cls)
         if newline:
-            newline_char = "\n"
-
-        data = self.__dict__
-        for k, v in data.items():
-            if isinstance(v, datetime.datetime):
-                # Athena uses Java's SimpleDateFormat, which doesn't support
-                # microseconds. We therefore need to remove the last 3 digits
-                #
-                # https://docs.aws.amazon.com/athena/latest/ug/data-types.html#data-types-timestamps
-                data[k] = v.strftime("%Y-%m-%d %H:%M:%S.%f")[0:-3]
-
-        json_data = json.dumps(data, sort_keys=True, default=str)
-        return f"{json_data}{newline_char}"
+            return f"{serializer(self)}\n"
+        return serializer(self)
 
 
 @dataclass
 class ValidDCProductMixin:
+    __slots__ = ()
+
     dc_product: DCProduct
 
     def __post_init__(self):
-        if not isinstance(self.dc_product, DCProduct):
+        dc_product = self.dc_product
+        if not isinstance(dc_product, DCProduct):
             try:
-                self.dc_product = DCProduct.from_str_value(self.dc_product)
+                dc_product = DCProduct.from_str_value(dc_product)
             except ValueError:
                 raise ValueError(
                     f"'{self.dc_product}' is not currently supported"
-                )
-        self.dc_product = self.dc_product.value
+                ) from None
+        self.dc_product = dc_product.value
 
 
 @dataclass
 class UTMMixin:
+    __slots__ = ()
+
     utm_source: Union[None, str] = field(default_factory=str)
     utm_campaign: Union[None, str] = field(default_factory=str)
     utm_medium: Union[None, str] = field(default_factory=str)
 
 
-@dataclass
+@dataclass(slots=True)
 class PostcodeLogEntry(BaseLogEntry, UTMMixin, ValidDCProductMixin):
     postcode: str = field(default_factory=str)
     timestamp: datetime.datetime = field(default_factory=datetime.datetime.now)
     api_key: str = ""
     calls_devs_dc_api: bool = False
     had_election: bool = False
+    # Set from `postcode`. Any value passed in is replaced.
+    normalised_postcode: str = ""
 
     def __post_init__(self):
-        super().__post_init__()
+        # slots=True replaces the class, which breaks zero argument super()
+        super(PostcodeLogEntry, self).__post_init__()
 
         if not self.postcode:
             raise ValueError("Postcode required")
+        self.normalised_postcode = normalise_postcode(self.postcode)
         if not self.timestamp:
             self.timestamp = datetime.datetime.now()
 
@@ -0,0 +1,242 @@
+import enum
+import logging
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Put on the queue to make a worker send what it has without waiting for the
+# batch to fill
+_FLUSH = object()
+
+
+@enum.unique
+class OverflowPolicy(enum.Enum):
+    """
+    What to do with a new entry when the send queue is full
+    """
+
+    drop_oldest = "DROP_OLDEST"
+    drop_newest = "DROP_NEWEST"
+    block = "BLOCK"
+
+
+@dataclass
+class SenderStats:
+    queued: int = 0
+    sent: int = 0
+    dropped: int = 0
+    failed: int = 0
+
+
+class BackgroundSender:
+    """
+    Sends log lines from a pool of worker threads, so the thread calling
+    `submit` never waits on the network.
+
+    Lines wait in a bounded queue. Each worker takes up to `max_batch_size`
+    lines at a time and passes them to `send_batch`, which should return
+    False (or raise) if they weren't accepted.
+    """
+
+    def __init__(
+        self,
+        send_batch: Callable[[List[str]], bool],
+        max_queue_size: int = 10_000,
+        worker_count: int = 2,
+        overflow_policy: OverflowPolicy = OverflowPolicy.drop_oldest,
+        max_batch_size: int = 100,
+        max_batch_bytes: Optional[int] = None,
+        max_batch_wait: float = 0.0,
+        name: str = "dc-logging",
+    ):
+        """
+        :param send_batch: Called from a worker thread with a list of lines
+        :param max_queue_size: Lines that can wait before `overflow_policy`
+                               applies
+        :param worker_count: Number of threads sending batches
+        :param overflow_policy: What to do when the queue is full
+        :param max_batch_size: The most lines passed to one `send_batch` call
+        :param max_batch_bytes: The most UTF-8 bytes passed to one
+                                `send_batch` call
+        :param max_batch_wait: Seconds a worker will wait for a batch to
+                               fill. If 0, workers send whatever is queued
+        :param name: Prefix for the worker thread names
+        """
+        self.send_batch = send_batch
+        self.max_queue_size = max_queue_size
+        self.worker_count = worker_count
+        self.overflow_policy = OverflowPolicy(overflow_policy)
+        self.max_batch_size = max_batch_size
+        self.max_batch_bytes = max_batch_bytes
+        self.max_batch_wait = max_batch_wait
+        self.name = name
+
+        self._stats = SenderStats()
+        self._stats_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._pid = None
+        self._queue: Optional[queue.Queue] = None
+        self._stopped = threading.Event()
+        self._workers: List[threading.Thread] = []
+
+    def submit(self, line: str):
+        """
+        Queue a line for sending, applying the overflow policy if the queue
+        is full
+        """
+        self._ensure_started()
+        if self.overflow_policy == OverflowPolicy.block:
+            self._queue.put(line)
+            self._count(queued=1)
+            return
+
+        while True:
+            try:
+                self._queue.put_nowait(line)
+                self._count(queued=1)
+                return
+            except queue.Full:
+                if self.overflow_policy == OverflowPolicy.drop_newest:
+                    self._count(dropped=1)
+                    return
+            # Drop the oldest entry to make room. Workers might have emptied
+            # the queue in the meantime, in which case we simply try again.
+            try:
+                dropped = self._queue.get_nowait()
+            except queue.Empty:
+                continue
+            self._queue.task_done()
+            if dropped is not _FLUSH:
+                self._count(dropped=1)
+
+    def flush(self):
+        """
+        Block until everything queued so far has been sent or failed
+        """
+        if self._queue is not None and self._pid == os.getpid():
+            if self.max_batch_wait:
+                for _ in self._workers:
+                    self._queue.put(_FLUSH)
+            self._queue.join()
+
+    def close(self):
+        """
+        Send everything queued and stop the workers
+        """
+        self.flush()
+        self._stopped.set()
+        for worker in self._workers:
+            worker.join()
+
+    def stop(self):
+        """
+        Stop the workers once they've sent everything queued, without
+        waiting for them
+        """
+        self._stopped.set()
+
+    def stats(self) -> SenderStats:
+        """
+        A snapshot of the counters for this process
+        """
+        with self._stats_lock:
+            return SenderStats(**self._stats.__dict__)
+
+    def _count(self, **counts: int):
+        with self._stats_lock:
+            for counter, value in counts.items():
+                setattr(
+                    self._stats, counter, getattr(self._stats, counter) + value
+                )
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            # Either this is the first submit, or we've been forked and the
+            # parent's workers didn't come with us. Anything the parent had
+            # queued is the parent's to send.
+            self._queue = queue.Queue(maxsize=self.max_queue_size)
+            self._stopped = threading.Event()
+            self._stats = SenderStats()
+            self._workers = [
+                threading.Thread(
+                    target=self._work,
+                    name=f"{self.name}-sender-{i}",
+                    daemon=True,
+                )
+                for i in range(self.worker_count)
+            ]
+            for worker in self._workers:
+                worker.start()
+            self._pid = os.getpid()
+
+    def _work(self):
+        carried_over = None
+        while True:
+            if carried_over is not None:
+                first, carried_over = carried_over, None
+            else:
+                try:
+                    first = self._queue.get(timeout=0.5)
+                except queue.Empty:
+                    # Only stop once everything queued has been sent
+                    if self._stopped.is_set():
+                        return
+                    continue
+                if first is _FLUSH:
+                    self._queue.task_done()
+                    continue
+            batch, carried_over = self._fill_batch(first)
+            self._send(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    def _fill_batch(self, first: str):
+        """
+        Build a batch starting with `first`. Returns the batch and, if it
+        would have pushed the batch over `max_batch_bytes`, the line that
+        should start the next one.
+        """
+        batch = [first]
+        batch_bytes = len(first.encode("utf-8")) + 1
+        deadline = time.monotonic() + self.max_batch_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout > 0:
+                    line = self._queue.get(timeout=timeout)
+                else:
+                    line = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if line is _FLUSH:
+                self._queue.task_done()
+                break
+            line_bytes = len(line.encode("utf-8")) + 1
+            if (
+                self.max_batch_bytes
+                and batch_bytes + line_bytes > self.max_batch_bytes
+            ):
+                return batch, line
+            batch.append(line)
+            batch_bytes += line_bytes
+        return batch, None
+
+    def _send(self, batch: List[str]):
+        try:
+            accepted = self.send_batch(batch)
+        except Exception:
+            logger.exception(f"Failed to send {len(batch)} log entries")
+            accepted = False
+        if accepted:
+            self._count(sent=len(batch))
+        else:
+            self._count(failed=len(batch))
@@ -0,0 +1,224 @@
+import abc
+import datetime
+import logging
+import os
+import threading
+from typing import Iterator, List, Optional
+
+from .boto_clients import (
+    DEFAULT_MAX_POOL_CONNECTIONS,
+    DEFAULT_TCP_KEEPALIVE,
+    Credentials,
+    get_client,
+)
+
+__all__ = [
+    "FirehoseTransport",
+    "LambdaTransport",
+]
+
+logger = logging.getLogger(__name__)
+
+
+class BaseTransport(abc.ABC):
+    """
+    Sends serialized log entries to a log stream
+    """
+
+    # The largest batch, in UTF-8 bytes, that can be sent in one request
+    max_batch_bytes: int
+
+    @abc.abstractmethod
+    def send(self, stream_name: str, lines: List[str]) -> bool:
+        """
+        Send `lines`, each a serialized log entry without a trailing newline.
+
+        Returns False if any of them weren't accepted.
+        """
+
+
+class LambdaTransport(BaseTransport):
+    """
+    Invokes the ingest Lambda function for the stream, which relays entries
+    to Firehose. Any account in the DC organisation can invoke it.
+    """
+
+    # Lambda rejects asynchronous invocations with payloads larger than 256KB
+    max_batch_bytes = 250 * 1024
+
+    def __init__(
+        self,
+        function_arn: str,
+        region: str = "eu-west-2",
+        max_pool_connections: int = DEFAULT_MAX_POOL_CONNECTIONS,
+        tcp_keepalive: bool = DEFAULT_TCP_KEEPALIVE,
+    ):
+        """
+        :param function_arn: The ARN of the ingest function for the stream
+        :param max_pool_connections: The most connections to keep open to
+                                     the Lambda API
+        :param tcp_keepalive: Whether to send TCP keep-alive probes on idle
+                              connections
+        """
+        self.function_arn = function_arn
+        self.region = region
+        self.max_pool_connections = max_pool_connections
+        self.tcp_keepalive = tcp_keepalive
+        self._client = None
+        self._client_pid: Optional[int] = None
+
+    @property
+    def client(self):
+        # Shared with every other transport in the process using the same
+        # settings. A client from before a fork shares its connections with
+        # the parent, so the child gets its own.
+        if self._client is None or self._client_pid != os.getpid():
+            self._client = get_client(
+                "lambda",
+                self.region,
+                max_pool_connections=self.max_pool_connections,
+                tcp_keepalive=self.tcp_keepalive,
+            )
+            self._client_pid = os.getpid()
+        return self._client
+
+    @client.setter
+    def client(self, client):
+        self._client = client
+        self._client_pid = os.getpid()
+
+    def send(self, stream_name: str, lines: List[str]) -> bool:
+        # A single entry is sent on its own, a batch as a list
+        payload = lines[0] if len(lines) == 1 else f"[{','.join(lines)}]"
+        response = self.client.invoke(
+            FunctionName=self.function_arn,
+            InvocationType="Event",
+            Payload=payload,
+        )
+        if response["ResponseMetadata"]["HTTPStatusCode"] != 202:
+            logger.warning(f"Failed to log `{payload}`. Got `{response}`")
+            return False
+        if response.get("FunctionError"):
+            error = response["Payload"].read().decode("utf-8")
+            logger.warning(f"Failed to log `{payload}`. Got `{error}`")
+            return False
+        return True
+
+
+class FirehoseTransport(BaseTransport):
+    """
+    Puts entries straight on to the Firehose stream, skipping the ingest
+    Lambda.
+
+    The stream is in the monitoring account, so we assume the
+    `put-record-from-{account}` role that `DCLogsStack` creates for each
+    account in the organisation. The role's credentials are cached and
+    replaced shortly before they expire.
+    """
+
+    # Firehose's limits for a single PutRecordBatch request
+    max_batch_records = 500
+    max_batch_bytes = 4 * 1024 * 1024
+
+    def __init__(
+        self,
+        role_arn: str,
+        region: str = "eu-west-2",
+        session_name: str = "dc-logging",
+        refresh_before_expiry: datetime.timedelta = datetime.timedelta(
+            minutes=5
+        ),
+        max_pool_connections: int = DEFAULT_MAX_POOL_CONNECTIONS,
+        tcp_keepalive: bool = DEFAULT_TCP_KEEPALIVE,
+    ):
+        """
+        :param role_arn: The ARN of the `put-record-from-{account}` role in
+                         the monitoring account
+        :param session_name: Identifies us in the monitoring account's
+                             CloudTrail
+        :param refresh_before_expiry: How long before the assumed role's
+                                      credentials expire to replace them
+        :param max_pool_connections: The most connections to keep open to
+                                     the Firehose API
+        :param tcp_keepalive: Whether to send TCP keep-alive probes on idle
+                              connections
+        """
+        self.role_arn = role_arn
+        self.region = region
+        self.session_name = session_name
+        self.refresh_before_expiry = refresh_before_expiry
+        self.max_pool_connections = max_pool_connections
+        self.tcp_keepalive = tcp_keepalive
+        self.sts_client = get_client("sts", region)
+
+        self._lock = threading.Lock()
+        self._client = None
+        self._client_pid = os.getpid()
+        self._expiration: Optional[datetime.datetime] = None
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client_pid != os.getpid():
+                # We've been forked, and the parent's clients can't be used
+                # here. The credentials can, but they come with a client.
+                self._client = None
+                self.sts_client = get_client("sts", self.region)
+                self._client_pid = os.getpid()
+            if self._client is None or self._credentials_expiring():
+                self._client = self._assume_role()
+            return self._client
+
+    def send(self, stream_name: str, lines: List[str]) -> bool:
+        all_sent = True
+        for chunk in self._chunks(lines):
+            response = self.client.put_record_batch(
+                DeliveryStreamName=stream_name,
+                Records=[{"Data": f"{line}\n"} for line in chunk],
+            )
+            if response.get("FailedPutCount"):
+                all_sent = False
+                for line, result in zip(chunk, response["RequestResponses"]):
+                    if result.get("ErrorCode"):
+                        logger.warning(
+                            f"Failed to log `{line}`. Got `{result['ErrorCode']}: {result.get('ErrorMessage')}`"
+                        )
+        return all_sent
+
+    def _credentials_expiring(self) -> bool:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        return self._expiration - now < self.refresh_before_expiry
+
+    def _assume_role(self):
+        credentials = self.sts_client.assume_role(
+            RoleArn=self.role_arn,
+            RoleSessionName=self.session_name,
+        )["Credentials"]
+        self._expiration = credentials["Expiration"]
+        return get_client(
+            "firehose",
+            self.region,
+            credentials=Credentials(
+                credentials["AccessKeyId"],
+                credentials["SecretAccessKey"],
+                credentials["SessionToken"],
+            ),
+            max_pool_connections=self.max_pool_connections,
+            tcp_keepalive=self.tcp_keepalive,
+        )
+
+    def _chunks(self, lines: List[str]) -> Iterator[List[str]]:
+        chunk: List[str] = []
+        chunk_bytes = 0
+        for line in lines:
+            line_bytes = len(line.encode("utf-8")) + 1
+            if chunk and (
+                len(chunk) >= self.max_batch_records
+                or chunk_bytes + line_bytes > self.max_batch_bytes
+            ):
+                yield chunk
+                chunk, chunk_bytes = [], 0
+            chunk.append(line)
+            chunk_bytes += line_bytes
+        if chunk:
+            yield chunk
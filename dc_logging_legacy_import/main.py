@@ -1,15 +1,30 @@
 import argparse
+import concurrent.futures
 import datetime
 import gzip
-from typing import Iterator, List, Tuple
+import io
+import itertools
+import json
+import os
+import re
+import tempfile
+from collections import defaultdict
+from json.encoder import encode_basestring_ascii
+from pathlib import Path
+from typing import IO, Dict, Iterable, Iterator, List, Set, Tuple, Union
 
 import boto3
+import boto3.s3.transfer
 import psycopg
 import tqdm
 
-from dc_logging_client.log_entries import PostcodeLogEntry
+from dc_logging_client.log_entries import (
+    DCProduct,
+    PostcodeLogEntry,
+    normalise_postcode,
+)
 
-s3 = boto3.resource("s3")
+s3 = None
 
 
 class Options:
@@ -18,99 +33,385 @@ class Options:
     bucket: str
     prefix: str
     dc_product: str
+    shard_hours: int
+    workers: int
+    upload_threads: int
+    manifest: str
+    multipart_threshold: int
+    fast: bool
+    target_file_size: int
 
 
+Shard = Tuple[datetime.datetime, datetime.datetime]
+
+
+# Compressed hourly files larger than this are written to disk until uploaded
+SPOOLED_FILE_MAX_SIZE = 32 * 1024 * 1024
+
+# Rows fetched from the database at a time by `--fast`
+FETCH_BLOCK_SIZE = 10_000
+
+# Shards are counted from here, at midnight
+SHARD_EPOCH = datetime.datetime(2017, 5, 1)
+
 PRODUCT_TABLES = {
     "WCIVF": "core_loggedpostcode",
     "WDIV": "data_finder_loggedpostcode",
 }
 
 
-def hourly_batches(
-    cur: psycopg.cursor,
-) -> Iterator[Tuple[Tuple[int], List[PostcodeLogEntry]]]:
-    dayhour = (0, 0, 0, 0)
-    batch: List[PostcodeLogEntry] = []
+LogLines = Iterator[Tuple[datetime.datetime, str]]
+
+
+def entry_log_lines(cur: psycopg.cursor) -> LogLines:
+    """
+    The hour and log line for each row, made with `PostcodeLogEntry`
+    """
     for row in cur:
-        if row[0].hour != dayhour[3]:
-            dayhour = (row[0].year, row[0].month, row[0].day, row[0].hour)
-            if batch:
-                yield batch
-            batch = []
-
-        batch.append(
-            PostcodeLogEntry(
-                timestamp=row[0],
-                postcode=row[1],
-                utm_source=row[2],
-                utm_medium=row[3],
-                utm_campaign=row[4],
-                dc_product=OPTIONS.dc_product,
-                api_key="",
-                calls_devs_dc_api=False,
+        entry = PostcodeLogEntry(
+            timestamp=row[0],
+            postcode=row[1],
+            utm_source=row[2],
+            utm_medium=row[3],
+            utm_campaign=row[4],
+            dc_product=OPTIONS.dc_product,
+            api_key="",
+            calls_devs_dc_api=False,
+        )
+        yield row[5], entry.as_log_line()
+
+
+def format_timestamps(timestamps: List[datetime.datetime]) -> List[str]:
+    """
+    Format a block of timestamps as `as_log_line` does, to the millisecond
+    and without a time zone
+    """
+    if all(timestamp.year >= 1000 for timestamp in timestamps):
+        return [
+            timestamp.replace(tzinfo=None).isoformat(
+                sep=" ", timespec="milliseconds"
             )
+            for timestamp in timestamps
+        ]
+    return [
+        timestamp.strftime("%Y-%m-%d %H:%M:%S.%f")[0:-3]
+        for timestamp in timestamps
+    ]
+
+
+def encode_optional_str(value: Union[None, str]) -> str:
+    if value is None:
+        return "null"
+    return encode_basestring_ascii(value)
+
+
+def encode_rows(rows: List[tuple]) -> List[str]:
+    """
+    The log lines for a block of rows, exactly as `entry_log_lines` makes
+    them, but without making an entry for each row
+    """
+    dc_product = DCProduct.from_str_value(OPTIONS.dc_product).value
+    # Keys are in sorted order, as in `as_log_line`
+    prefix = (
+        '{"api_key": "", "calls_devs_dc_api": false, '
+        f'"dc_product": {encode_basestring_ascii(dc_product)}, '
+        '"had_election": false, "normalised_postcode": '
+    )
+    timestamps = format_timestamps([row[0] for row in rows])
+    lines = []
+    for (
+        _,
+        postcode,
+        utm_source,
+        utm_medium,
+        utm_campaign,
+        _,
+    ), timestamp in zip(rows, timestamps):
+        if not postcode:
+            raise ValueError("Postcode required")
+        lines.append(
+            f"{prefix}{encode_basestring_ascii(normalise_postcode(postcode))}, "
+            f'"postcode": {encode_basestring_ascii(postcode)}, '
+            f'"timestamp": "{timestamp}", '
+            f'"utm_campaign": {encode_optional_str(utm_campaign)}, '
+            f'"utm_medium": {encode_optional_str(utm_medium)}, '
+            f'"utm_source": {encode_optional_str(utm_source)}}}\n'
         )
-    yield batch
+    return lines
+
+
+def fast_log_lines(cur: psycopg.cursor) -> LogLines:
+    """
+    The same as `entry_log_lines`, fetching and encoding the rows in blocks
+    """
+    while rows := cur.fetchmany(FETCH_BLOCK_SIZE):
+        yield from zip([row[5] for row in rows], encode_rows(rows))
+
+
+def hourly_batches(
+    log_lines: LogLines,
+) -> Iterator[Tuple[datetime.datetime, Iterator[str]]]:
+    """
+    The hour and the log lines for each hour, read as they're consumed. Each
+    hour must be consumed before the next.
+    """
+    for hour, lines in itertools.groupby(log_lines, key=lambda line: line[0]):
+        yield hour, (line for _, line in lines)
+
+
+def serialize_to_files(
+    batch: Tuple[datetime.datetime, Iterable[str]],
+) -> Iterator[Tuple[str, IO[bytes]]]:
+    """
+    Compress the log lines as they're read into temporary files, which are
+    kept in memory unless they get large.
+
+    Each hour is one file, unless `--target-file-size` is set. Then, busy
+    hours are split into files of about that size, compressed, so Athena can
+    read them in parallel. Files can't hold more than one hour, as they'd be
+    in the wrong partition.
+    """
+    hour, lines = batch
+    # Matches the `day`/`hour`/`dc_product` partitions of the table
+    date = hour.strftime("%Y/%m/%d/%H")
+    key = f"{date}/{OPTIONS.dc_product}/{OPTIONS.dc_product}"
+
+    part = 0
+    data = compressed = None
+    for line in lines:
+        if compressed is None:
+            data = tempfile.SpooledTemporaryFile(max_size=SPOOLED_FILE_MAX_SIZE)
+            compressed = gzip.GzipFile(fileobj=data, mode="wb")
+        compressed.write(line.encode("utf-8"))
+        if OPTIONS.target_file_size and data.tell() >= OPTIONS.target_file_size:
+            compressed.close()
+            data.seek(0)
+            yield (f"{key}-{part}" if part else key), data
+            part += 1
+            compressed = None
+
+    if compressed is not None:
+        compressed.close()
+        data.seek(0)
+        yield (f"{key}-{part}" if part else key), data
+
+
+def object_key(key: str) -> str:
+    return f"{OPTIONS.prefix}{key}.gz"
+
+
+def upload_file(key: str, data: IO[bytes]) -> int:
+    """
+    Upload and close a file from `serialize_to_files`, returning its size.
+    Files larger than `--multipart-threshold` are uploaded in parts.
+    """
+    with data:
+        size = data.seek(0, io.SEEK_END)
+        data.seek(0)
+        s3.upload_fileobj(
+            data,
+            OPTIONS.bucket,
+            object_key(key),
+            Config=boto3.s3.transfer.TransferConfig(
+                multipart_threshold=OPTIONS.multipart_threshold,
+                multipart_chunksize=OPTIONS.multipart_threshold,
+            ),
+        )
+    return size
+
 
+def delete_stale_files(written: Dict[str, Set[str]]):
+    """
+    Delete the files earlier imports wrote to the partitions in `written`
+    that this one didn't, e.g. the extra parts of an hour imported with a
+    smaller `--target-file-size`. Files from anywhere else, like Firehose,
+    are left alone.
+    """
+    name = re.compile(rf"{re.escape(OPTIONS.dc_product)}(-\d+)?\.gz")
+    paginator = s3.get_paginator("list_objects_v2")
+    for partition, keys in written.items():
+        partition_prefix = f"{OPTIONS.prefix}{partition}/"
+        stale = [
+            {"Key": item["Key"]}
+            for page in paginator.paginate(
+                Bucket=OPTIONS.bucket, Prefix=partition_prefix
+            )
+            for item in page.get("Contents", [])
+            if item["Key"] not in keys
+            and name.fullmatch(item["Key"][len(partition_prefix) :])
+        ]
+        # At most 1,000 keys per request
+        for i in range(0, len(stale), 1000):
+            s3.delete_objects(
+                Bucket=OPTIONS.bucket,
+                Delete={"Objects": stale[i : i + 1000], "Quiet": True},
+            )
 
-def serialize_to_file(batch: List[PostcodeLogEntry]) -> (str, str):
-    date = ""
-    data = ""
-    for entry in batch:
-        if date == "":
-            date = entry.timestamp.strftime("%Y/%m/%d/%H")
-        data += entry.as_log_line()
 
-    return (f"{date}/{OPTIONS.dc_product}", data)
+def shards(
+    start: datetime.datetime, end: datetime.datetime, shard_hours: int
+) -> List[Shard]:
+    """
+    Split `start` to `end` into ranges of `shard_hours`, each including its
+    start but not its end. They're counted from `SHARD_EPOCH`, so no hour's
+    file is written by more than one shard, and the shards are the same
+    between runs with different start times, even if `shard_hours` doesn't
+    divide a day.
+    """
+    step = datetime.timedelta(hours=shard_hours)
+    shard_start = SHARD_EPOCH + (start - SHARD_EPOCH) // step * step
+    ranges = []
+    while shard_start <= end:
+        ranges.append((shard_start, shard_start + step))
+        shard_start += step
+    return ranges
 
 
-def upload_file(key, data):
-    s3.Object(OPTIONS.bucket, f"{OPTIONS.prefix}{key}.gz").put(
-        Body=gzip.compress(data.encode("utf-8"))
+def manifest_entry(shard: Shard) -> str:
+    # The logs imported for the shard, which the first and last shards only
+    # have some of
+    return json.dumps(
+        {
+            "bucket": OPTIONS.bucket,
+            "prefix": OPTIONS.prefix,
+            "dc_product": OPTIONS.dc_product,
+            "from": max(shard[0], OPTIONS.start).isoformat(),
+            "to": min(shard[1], OPTIONS.end).isoformat(),
+        },
+        sort_keys=True,
     )
 
 
-def main():
-    with psycopg.connect() as conn:
-        min, max = (None, None)
-        # Get max and min for progress
-        with conn.execute(
+def read_manifest(path: Path) -> Set[str]:
+    """
+    The shards already uploaded by previous runs
+    """
+    if not path.exists():
+        return set()
+    with path.open() as manifest:
+        return {line.strip() for line in manifest if line.strip()}
+
+
+def init_worker(options: Options):
+    # Each process needs the options, and its own boto3 client. Clients (but
+    # not resources) can be shared by the upload threads.
+    global OPTIONS, s3
+    OPTIONS = options
+    s3 = boto3.client("s3")
+
+
+def import_shard(shard: Shard) -> Tuple[int, int]:
+    """
+    Upload the logs in `shard`, returning the number of files and bytes
+    uploaded
+    """
+    shard_start, shard_end = shard
+    uploads = set()
+    # The keys written to each partition
+    written = defaultdict(set)
+    uploaded = 0
+    uploaded_bytes = 0
+    # Timestamps and hours are read in UTC, like the table's partitions.
+    # Otherwise, the two 1am hours when the clocks go back would be written
+    # to the same files.
+    with psycopg.connect(options="-c TimeZone=UTC") as conn, conn.cursor(
+        f"{OPTIONS.dc_product}-{shard_start:%Y%m%d%H}"
+    ) as cur, concurrent.futures.ThreadPoolExecutor(
+        max_workers=OPTIONS.upload_threads
+    ) as uploader:
+        cur.execute(
             f"""
-                SELECT MIN(created), MAX(created)
+                SELECT
+                    created as timestamp,
+                    postcode,
+                    utm_source,
+                    utm_medium,
+                    utm_campaign,
+                    date_trunc('hour', created) as hour
                 FROM {PRODUCT_TABLES[OPTIONS.dc_product]}
                 WHERE created >= %s AND created <= %s
+                AND created >= %s AND created < %s
+                ORDER BY created ASC
             """,
-            (OPTIONS.start, OPTIONS.end),
-        ) as cur:
-            min, max = cur.fetchone()
-            round_min = min.replace(minute=0, second=0, microsecond=0)
-            round_max = max.replace(minute=0, second=0, microsecond=0)
-
-            total_partitions = (round_max - round_min).total_seconds() / 3600
-
-        print("⬇️  Fetching data from postgres")
-        with conn.cursor(
-            f"{OPTIONS.dc_product}-{datetime.datetime.now()}"
-        ) as cur:
-            cur.execute(
-                f"""
-                    SELECT
-                        created as timestamp,
-                        postcode,
-                        utm_source,
-                        utm_medium,
-                        utm_campaign
-                    FROM {PRODUCT_TABLES[OPTIONS.dc_product]}
-                    WHERE created >= %s AND created <= %s
-                    ORDER BY created ASC
-                """,
-                (OPTIONS.start, OPTIONS.end),
+            (OPTIONS.start, OPTIONS.end, shard_start, shard_end),
+        )
+        if OPTIONS.fast:
+            log_lines = fast_log_lines(cur)
+        else:
+            log_lines = entry_log_lines(cur)
+        for batch in hourly_batches(log_lines):
+            for key, data in serialize_to_files(batch):
+                written[key.rsplit("/", 1)[0]].add(object_key(key))
+                # Limit how many serialized files are waiting to upload
+                if len(uploads) >= OPTIONS.upload_threads * 2:
+                    done, uploads = concurrent.futures.wait(
+                        uploads,
+                        return_when=concurrent.futures.FIRST_COMPLETED,
+                    )
+                    for future in done:
+                        uploaded_bytes += future.result()
+                        uploaded += 1
+                uploads.add(uploader.submit(upload_file, key, data))
+
+        for future in concurrent.futures.as_completed(uploads):
+            uploaded_bytes += future.result()
+            uploaded += 1
+    delete_stale_files(written)
+    return uploaded, uploaded_bytes
+
+
+def main():
+    all_shards = shards(OPTIONS.start, OPTIONS.end, OPTIONS.shard_hours)
+    manifest_path = Path(OPTIONS.manifest)
+    completed = read_manifest(manifest_path)
+    todo = [
+        shard for shard in all_shards if manifest_entry(shard) not in completed
+    ]
+    print(
+        f"⬇️  Importing {len(todo)} of {len(all_shards)} shards "
+        f"({len(all_shards) - len(todo)} already in {manifest_path})"
+    )
+
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=OPTIONS.workers,
+        initializer=init_worker,
+        initargs=(OPTIONS,),
+    ) as pool, manifest_path.open("a") as manifest, tqdm.tqdm(
+        total=len(todo) * OPTIONS.shard_hours, unit="partition"
+    ) as progress:
+        futures = {pool.submit(import_shard, shard): shard for shard in todo}
+        files = 0
+        uploaded_bytes = 0
+        failed = []
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                shard_files, shard_bytes = future.result()
+            except Exception as error:
+                # Carry on with the other shards, so they're recorded
+                failed.append((futures[future], error))
+                continue
+            files += shard_files
+            uploaded_bytes += shard_bytes
+            # Only recorded once every file in the shard is uploaded, so an
+            # interrupted run starts the shard again
+            manifest.write(manifest_entry(futures[future]) + "\n")
+            manifest.flush()
+            progress.update(OPTIONS.shard_hours)
+            progress.set_postfix(
+                files=files,
+                uploaded=tqdm.tqdm.format_sizeof(uploaded_bytes, "B", 1024),
+            )
+
+    if failed:
+        for (shard_start, shard_end), error in sorted(failed):
+            print(
+                f"❌ Failed to import {shard_start:%Y-%m-%d %H:00} to "
+                f"{shard_end:%Y-%m-%d %H:00}: {error!r}"
             )
-            for batch in tqdm.tqdm(
-                hourly_batches(cur), total=int(total_partitions)
-            ):
-                key, data = serialize_to_file(batch)
-                upload_file(key, data)
+        raise SystemExit(
+            f"{len(failed)} of {len(todo)} shards failed. Run the same "
+            "command again to retry them."
+        )
 
 
 if __name__ == "__main__":
@@ -119,12 +420,12 @@ if __name__ == "__main__":
     parser.add_argument(
         "--start",
         type=lambda d: datetime.datetime.strptime(d, "%Y-%m-%d %H:%M:%S.%f"),
-        help="Start date and hour inclusive (YYYY-mm-DD HH:MM:SS.fff)",
+        help="Start date and hour inclusive, in UTC (YYYY-mm-DD HH:MM:SS.fff)",
     )
     parser.add_argument(
         "--end",
         type=lambda d: datetime.datetime.strptime(d, "%Y-%m-%d %H:%M:%S.%f"),
-        help="End date and hour inclusive (YYYY-mm-DD HH:MM:SS.fff)",
+        help="End date and hour inclusive, in UTC (YYYY-mm-DD HH:MM:SS.fff)",
         required=True,
     )
     parser.add_argument(
@@ -145,6 +446,50 @@ if __name__ == "__main__":
         help="DC Product to upload as (WCIVF, WDIV)",
         required=True,
     )
+    parser.add_argument(
+        "--shard-hours",
+        type=int,
+        default=24,
+        help="Hours of logs for each worker to fetch and upload at a time",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of shards to import at once",
+    )
+    parser.add_argument(
+        "--upload-threads",
+        type=int,
+        default=8,
+        help="Number of concurrent S3 uploads for each worker",
+    )
+    parser.add_argument(
+        "--multipart-threshold",
+        type=lambda mb: int(mb) * 1024 * 1024,
+        default=64 * 1024 * 1024,
+        help="Size in MiB of compressed hourly files to upload in parts "
+        "(default: 64)",
+    )
+    parser.add_argument(
+        "--fast",
+        action="store_true",
+        help="Fetch rows in blocks and write their JSON directly, rather "
+        "than making a PostcodeLogEntry for each",
+    )
+    parser.add_argument(
+        "--target-file-size",
+        type=lambda mb: int(mb) * 1024 * 1024,
+        help="Split hours into compressed files of about this many MiB, "
+        "rather than one file per hour. Re-running an import replaces the "
+        "files, and deletes any parts it no longer writes",
+    )
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        help="File recording the shards uploaded, so an interrupted import "
+        "can be resumed (default: legacy-import-<dc product>.jsonl)",
+    )
 
     global OPTIONS
     OPTIONS: Options = parser.parse_args()
@@ -152,5 +497,7 @@ if __name__ == "__main__":
         OPTIONS.start = datetime.datetime.strptime(
             "2017/05/01/00", "%Y/%m/%d/%H"
         )
+    if not OPTIONS.manifest:
+        OPTIONS.manifest = f"legacy-import-{OPTIONS.dc_product}.jsonl"
 
     main()
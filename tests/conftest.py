@@ -13,7 +13,7 @@ from moto import mock_aws
 from mypy_boto3_firehose import FirehoseClient
 from mypy_boto3_s3 import S3Client
 
-from dc_logging_client import DCWidePostcodeLoggingClient
+from dc_logging_client import DCWidePostcodeLoggingClient, boto_clients
 
 
 @pytest.fixture(scope="session", autouse=True)
@@ -32,6 +32,17 @@ def moto_proxy_start():
     os.killpg(os.getpgid(moto_proxy.pid), signal.SIGTERM)
 
 
+@pytest.fixture(autouse=True)
+def clear_boto_clients():
+    """
+    Clients are cached for the whole process, which would leak them, and the
+    credentials and mocks they were created with, between tests
+    """
+    boto_clients.clear()
+    yield
+    boto_clients.clear()
+
+
 @pytest.fixture(scope="session")
 def aws_credentials(moto_proxy_start):
     """Mocked AWS Credentials for moto."""
@@ -64,7 +75,7 @@ def mock_log_streams(mock_aws_services):
     stream_class_list = [DCWidePostcodeLoggingClient]
     for cls in stream_class_list:
         firehose_client.create_delivery_stream(
-            DeliveryStreamName=cls.stream_name,
+            DeliveryStreamName=cls.delivery_stream_name,
             ExtendedS3DestinationConfiguration={
                 "BucketARN": "arn:aws:s3:::test-bucket",
                 "BufferingHints": {
@@ -0,0 +1,92 @@
+import asyncio
+from dataclasses import dataclass
+
+import pytest
+
+from dc_logging_client import AsyncDCWidePostcodeLoggingClient
+from dc_logging_client.log_entries import BaseLogEntry
+from tests.test_log_client import RecordingLambdaClient
+
+
+def make_async_logger(**kwargs):
+    logger = AsyncDCWidePostcodeLoggingClient(
+        function_arn="arn:aws:lambda:eu-west-2:000000000000:function:ingest",
+        **kwargs,
+    )
+    logger.transport.client = RecordingLambdaClient()
+    return logger
+
+
+def test_async_log_batches_entries():
+    logger = make_async_logger(max_batch_size=2, max_batch_interval=60)
+
+    async def log_entries():
+        for postcode in ["SW1A 1AA", "SW1A 1AB", "SW1A 1AC"]:
+            await logger.log(
+                logger.entry_class(
+                    postcode=postcode, dc_product=logger.dc_product.wcivf
+                )
+            )
+        await logger.aclose()
+
+    asyncio.run(log_entries())
+    first_batch, second_batch = logger.transport.client.payloads
+    assert [entry["postcode"] for entry in first_batch] == [
+        "SW1A 1AA",
+        "SW1A 1AB",
+    ]
+    assert second_batch["postcode"] == "SW1A 1AC"
+
+
+def test_async_log_invalid_entry():
+    logger = make_async_logger()
+
+    @dataclass
+    class DummyLogEntry(BaseLogEntry):
+        foo: str
+
+    with pytest.raises(ValueError) as e_info:
+        asyncio.run(logger.log(DummyLogEntry(foo="SW1A 1AA")))
+    assert str(e_info.value).endswith(
+        "isn't a valid log entry for stream 'dc-postcode-searches'"
+    )
+
+
+def test_async_close_needs_awaiting():
+    logger = make_async_logger()
+
+    async def log_entry():
+        await logger.log(
+            logger.entry_class(
+                postcode="SW1A 1AA", dc_product=logger.dc_product.wcivf
+            )
+        )
+        with pytest.raises(RuntimeError, match="aclose"):
+            logger.close()
+        await logger.aclose()
+
+    asyncio.run(log_entry())
+    assert logger.transport.client.payloads[0]["postcode"] == "SW1A 1AA"
+
+
+def test_async_log_keeps_entries_queued_when_loop_stops():
+    logger = make_async_logger(max_batch_interval=60)
+
+    async def log_entry(postcode):
+        await logger.log(
+            logger.entry_class(
+                postcode=postcode, dc_product=logger.dc_product.wcivf
+            )
+        )
+
+    # The sending task is cancelled when the loop stops, before it sends
+    asyncio.run(log_entry("SW1A 1AA"))
+    assert logger.transport.client.payloads == []
+
+    async def log_entry_and_close():
+        await log_entry("SW1A 1AB")
+        await logger.aclose()
+
+    asyncio.run(log_entry_and_close())
+    (batch,) = logger.transport.client.payloads
+    assert [entry["postcode"] for entry in batch] == ["SW1A 1AA", "SW1A 1AB"]
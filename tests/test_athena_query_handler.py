@@ -0,0 +1,141 @@
+import importlib
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).parent.parent
+
+
+class FakeAthenaClient:
+    """
+    Holds named queries, returning `page_size` IDs per page, and records the
+    calls made to it
+    """
+
+    def __init__(self, named_queries, page_size=2):
+        self.named_queries = {
+            f"id-{i}": named_query
+            for i, named_query in enumerate(named_queries)
+        }
+        self.page_size = page_size
+        self.calls = []
+        self.started = []
+        self.start_kwargs = []
+
+    def list_named_queries(self, WorkGroup, NextToken=None):
+        self.calls.append("list_named_queries")
+        ids = list(self.named_queries)
+        start = int(NextToken or 0)
+        response = {"NamedQueryIds": ids[start : start + self.page_size]}
+        if start + self.page_size < len(ids):
+            response["NextToken"] = str(start + self.page_size)
+        return response
+
+    def batch_get_named_query(self, NamedQueryIds):
+        self.calls.append("batch_get_named_query")
+        assert len(NamedQueryIds) <= 50
+        return {
+            "NamedQueries": [
+                self.named_queries[query_id] for query_id in NamedQueryIds
+            ]
+        }
+
+    def start_query_execution(self, QueryString, **kwargs):
+        self.started.append(QueryString)
+        self.start_kwargs.append(kwargs)
+        return {"QueryExecutionId": f"execution-{len(self.started)}"}
+
+    def get_query_execution(self, QueryExecutionId):
+        return {"QueryExecution": {"Status": {"State": "SUCCEEDED"}}}
+
+
+def named_query(name, query_string, version="abc"):
+    return {
+        "Name": name,
+        "QueryString": query_string,
+        "Description": f"Version: {version}",
+    }
+
+
+@pytest.fixture
+def athena_handler(monkeypatch):
+    monkeypatch.setenv("WORKGROUP_NAME", "test-workgroup")
+    monkeypatch.setenv("DATABASE_NAME", "test-database")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "eu-west-2")
+    monkeypatch.syspath_prepend(
+        str(ROOT / "dc_logging_aws/lambdas/run_athena_query_and_report_status")
+    )
+    monkeypatch.delitem(sys.modules, "handler", raising=False)
+    module = importlib.import_module("handler")
+    client = FakeAthenaClient(
+        [named_query(f"query_{i}", f"SELECT {i}") for i in range(5)]
+        + [named_query("by_day", "SELECT * WHERE day = '{day}'")]
+    )
+    monkeypatch.setattr(module, "athena_client", client)
+    yield module
+    sys.modules.pop("handler", None)
+
+
+def test_named_query_found_past_first_page(athena_handler):
+    response = athena_handler.handler(
+        {"QueryName": "by_day", "QueryContext": {"day": "2024/05/02"}}, None
+    )
+    client = athena_handler.athena_client
+    assert response == {"queryExecutionId": "execution-1"}
+    assert client.started == ["SELECT * WHERE day = '2024/05/02'"]
+    # Three pages of IDs, then one batch to get all the queries
+    assert client.calls == ["list_named_queries"] * 3 + [
+        "batch_get_named_query"
+    ]
+
+
+def test_named_query_cached(athena_handler, monkeypatch):
+    client = athena_handler.athena_client
+    athena_handler.get_named_query_by_name("query_1", "test-workgroup", "abc")
+    athena_handler.get_named_query_by_name("query_2", "test-workgroup")
+    assert client.calls.count("batch_get_named_query") == 1
+
+    # Redeploying changes the version, so the query is fetched again
+    client.named_queries["id-1"] = named_query("query_1", "SELECT 10", "def")
+    query = athena_handler.get_named_query_by_name(
+        "query_1", "test-workgroup", "def"
+    )
+    assert query["QueryString"] == "SELECT 10"
+    assert client.calls.count("batch_get_named_query") == 2
+
+    # Without a version, the cache expires
+    client.named_queries["id-2"] = named_query("query_2", "SELECT 20")
+    assert (
+        athena_handler.get_named_query_by_name("query_2", "test-workgroup")[
+            "QueryString"
+        ]
+        == "SELECT 2"
+    )
+    monkeypatch.setattr(athena_handler, "NAMED_QUERY_CACHE_TTL", -1)
+    assert (
+        athena_handler.get_named_query_by_name("query_2", "test-workgroup")[
+            "QueryString"
+        ]
+        == "SELECT 20"
+    )
+
+
+def test_named_query_not_found(athena_handler):
+    with pytest.raises(ValueError):
+        athena_handler.get_named_query_by_name("missing", "test-workgroup")
+
+
+def test_query_started_with_context(athena_handler):
+    client = athena_handler.athena_client
+    event = {"QueryName": "by_day", "QueryContext": {"day": "2024/05/02"}}
+    assert athena_handler.handler(event, None) == {
+        "queryExecutionId": "execution-1"
+    }
+    assert client.started == ["SELECT * WHERE day = '2024/05/02'"]
+    assert client.start_kwargs == [
+        {
+            "QueryExecutionContext": {"Database": "test-database"},
+            "WorkGroup": "test-workgroup",
+        }
+    ]
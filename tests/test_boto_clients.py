@@ -0,0 +1,38 @@
+import os
+
+from dc_logging_client import boto_clients
+from dc_logging_client.boto_clients import Credentials, get_client
+
+
+def test_clients_are_shared():
+    client = get_client("lambda", "eu-west-2")
+    assert get_client("lambda", "eu-west-2") is client
+    assert get_client("lambda", "eu-west-1") is not client
+    assert get_client("firehose", "eu-west-2") is not client
+    assert (
+        get_client("lambda", "eu-west-2", max_pool_connections=50) is not client
+    )
+    assert (
+        get_client("lambda", "eu-west-2", Credentials("key", "secret"))
+        is not client
+    )
+
+
+def test_cache_is_bounded():
+    for i in range(boto_clients.MAX_CACHED_CLIENTS + 5):
+        get_client("firehose", "eu-west-2", Credentials(f"key-{i}", "secret"))
+    assert len(boto_clients._clients) == boto_clients.MAX_CACHED_CLIENTS
+
+
+def test_cache_is_cleared_in_forked_children():
+    client = get_client("lambda", "eu-west-2")
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        # In the child
+        shared = get_client("lambda", "eu-west-2") is client
+        os.write(write_fd, b"shared" if shared else b"new")
+        os._exit(0)
+    os.waitpid(pid, 0)
+    assert os.read(read_fd, 10) == b"new"
+    assert get_client("lambda", "eu-west-2") is client
@@ -0,0 +1,312 @@
+import datetime
+import gzip
+import importlib
+import json
+import sys
+import uuid
+from pathlib import Path
+
+import boto3
+import pytest
+
+ROOT = Path(__file__).parent.parent
+
+PREFIX = "dc-postcode-searches"
+HOUR = datetime.datetime(2024, 5, 2, 21)
+HOUR_PATH = f"{PREFIX}/2024/05/02/21"
+
+
+@pytest.fixture
+def compact_logs(monkeypatch, mock_aws_services):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "eu-west-2")
+    monkeypatch.syspath_prepend(
+        str(ROOT / "dc_logging_aws/lambdas/compact_logs")
+    )
+    monkeypatch.delitem(sys.modules, "handler", raising=False)
+    module = importlib.import_module("handler")
+    yield module
+    sys.modules.pop("handler", None)
+
+
+@pytest.fixture
+def bucket(compact_logs, monkeypatch):
+    name = f"test-compaction-{uuid.uuid4()}"
+    compact_logs.s3_client.create_bucket(
+        Bucket=name,
+        CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+    )
+    monkeypatch.setenv("BUCKET_NAME", name)
+    monkeypatch.setenv("PREFIX", PREFIX)
+    return name
+
+
+def put_log_file(bucket, key, lines, newline=True):
+    body = "\n".join(lines) + ("\n" if newline else "")
+    boto3.client("s3", region_name="eu-west-2").put_object(
+        Bucket=bucket, Key=key, Body=gzip.compress(body.encode("utf-8"))
+    )
+
+
+def list_keys(bucket, prefix=""):
+    s3_client = boto3.client("s3", region_name="eu-west-2")
+    response = s3_client.list_objects_v2(Bucket=bucket, Prefix=prefix)
+    return sorted(item["Key"] for item in response.get("Contents", []))
+
+
+def read_lines(bucket, key):
+    s3_client = boto3.client("s3", region_name="eu-west-2")
+    body = s3_client.get_object(Bucket=bucket, Key=key)["Body"].read()
+    return gzip.decompress(body).decode("utf-8").splitlines()
+
+
+def put_partition(bucket):
+    for i in range(3):
+        put_log_file(
+            bucket,
+            f"{HOUR_PATH}/WCIVF/stream-{i}.gz",
+            [json.dumps({"n": i, "line": j}) for j in range(2)],
+            # Firehose doesn't add a newline after the last record
+            newline=i != 1,
+        )
+    put_log_file(bucket, f"{HOUR_PATH}/EE/stream-0.gz", ["{}"])
+
+
+def test_compact_hour(compact_logs, bucket):
+    put_partition(bucket)
+
+    response = compact_logs.handler({"hour": "2024-05-02T22:00+01:00"}, None)
+    assert response == {
+        "hour": "2024-05-02T21:00:00",
+        "compactions": [
+            {
+                "hour": "2024-05-02T21:00:00",
+                "dc_product": "WCIVF",
+                "status": "complete",
+                "files": 3,
+                "compacted_files": 1,
+            }
+        ],
+        "failed_files": [],
+    }
+
+    compacted = f"{HOUR_PATH}/WCIVF/compacted-2024050221-0.gz"
+    # A single file is left alone
+    assert list_keys(bucket, f"{PREFIX}/") == [
+        f"{HOUR_PATH}/EE/stream-0.gz",
+        compacted,
+    ]
+    assert read_lines(bucket, compacted) == [
+        json.dumps({"n": i, "line": j}) for i in range(3) for j in range(2)
+    ]
+
+    # Nothing is left staged, and the manifest records the swap
+    assert list_keys(bucket, f"{PREFIX}-compaction/staging/") == []
+    manifest_key = f"{PREFIX}-compaction/manifests/2024/05/02/21/WCIVF.json"
+    assert list_keys(bucket, f"{PREFIX}-compaction/") == [manifest_key]
+    manifest = json.load(
+        boto3.client("s3", region_name="eu-west-2").get_object(
+            Bucket=bucket, Key=manifest_key
+        )["Body"]
+    )
+    assert manifest["status"] == "complete"
+    assert manifest["sources"] == [
+        f"{HOUR_PATH}/WCIVF/stream-{i}.gz" for i in range(3)
+    ]
+    assert [output["key"] for output in manifest["outputs"]] == [compacted]
+
+    # Compacting again does nothing
+    assert compact_logs.compact_hour(bucket, PREFIX, HOUR) == []
+    assert read_lines(bucket, compacted) == [
+        json.dumps({"n": i, "line": j}) for i in range(3) for j in range(2)
+    ]
+
+
+def test_unpartitioned_file_split_by_product(compact_logs, bucket, caplog):
+    # Written by the stream from before the logs were partitioned by product
+    wcivf = [json.dumps({"dc_product": "WCIVF", "n": i}) for i in range(2)]
+    ee = [json.dumps({"dc_product": "EE", "n": 2})]
+    put_log_file(bucket, f"{HOUR_PATH}/legacy.gz", [wcivf[0], *ee, wcivf[1]])
+    put_log_file(bucket, f"{HOUR_PATH}/WCIVF/stream-0.gz", ["{}"])
+    put_log_file(bucket, f"{HOUR_PATH}/broken.gz", ["not json"])
+
+    manifests = compact_logs.compact_hour(bucket, PREFIX, HOUR)
+    assert [manifest["dc_product"] for manifest in manifests] == ["WCIVF"]
+
+    compacted = f"{HOUR_PATH}/WCIVF/compacted-2024050221-0.gz"
+    # Files that can't be split are left where they are
+    assert list_keys(bucket, f"{PREFIX}/") == [
+        f"{HOUR_PATH}/EE/legacy.gz",
+        compacted,
+        f"{HOUR_PATH}/broken.gz",
+    ]
+    assert read_lines(bucket, f"{HOUR_PATH}/EE/legacy.gz") == ee
+    assert read_lines(bucket, compacted) == wcivf + ["{}"]
+    assert [
+        (record.levelname, record.getMessage()) for record in caplog.records
+    ] == [
+        (
+            "ERROR",
+            f"Can't split {HOUR_PATH}/broken.gz: "
+            "JSONDecodeError('Expecting value: line 1 column 1 (char 0)')",
+        )
+    ]
+
+
+def test_partition_handler(compact_logs, bucket):
+    put_log_file(
+        bucket,
+        f"{HOUR_PATH}/legacy.gz",
+        [json.dumps({"dc_product": "EE", "n": 0})],
+    )
+    put_log_file(bucket, f"{HOUR_PATH}/broken.gz", ["not json"])
+    response = compact_logs.partition_handler(
+        {"hour": "2024-05-02T22:00:00+01:00"}, None
+    )
+    assert response == {
+        "hour": "2024-05-02T21:00:00",
+        "split_files": 1,
+        "failed_files": [f"{HOUR_PATH}/broken.gz"],
+    }
+    assert list_keys(bucket, f"{PREFIX}/") == [
+        f"{HOUR_PATH}/EE/legacy.gz",
+        f"{HOUR_PATH}/broken.gz",
+    ]
+
+
+def test_failed_split_in_compaction_summary(compact_logs, bucket):
+    put_log_file(bucket, f"{HOUR_PATH}/broken.gz", ["not json"])
+    response = compact_logs.handler({"hour": "2024-05-02T21:00"}, None)
+    assert response == {
+        "hour": "2024-05-02T21:00:00",
+        "compactions": [],
+        "failed_files": [f"{HOUR_PATH}/broken.gz"],
+    }
+
+
+@pytest.fixture
+def partition_history(compact_logs, monkeypatch):
+    monkeypatch.delitem(sys.modules, "partition_history", raising=False)
+    yield importlib.import_module("partition_history")
+    sys.modules.pop("partition_history", None)
+
+
+def test_partition_history(partition_history, bucket, capsys):
+    line = json.dumps({"dc_product": "WDIV"})
+    earlier_path = f"{PREFIX}/2019/12/12/07"
+    put_log_file(bucket, f"{earlier_path}/legacy.gz", [line])
+    put_log_file(bucket, f"{HOUR_PATH}/legacy.gz", [line])
+    put_log_file(bucket, f"{HOUR_PATH}/WDIV/stream-0.gz", [line])
+    put_log_file(bucket, f"{HOUR_PATH}/_SUCCESS", [])
+    put_log_file(bucket, f"{PREFIX}-compaction/pending/2024/05/02/21/x", [])
+
+    args = ["--bucket", bucket, "--prefix", PREFIX]
+    assert partition_history.main([*args, "--dry-run"]) == 0
+    assert "2 files to split" in capsys.readouterr().out
+    assert len(list_keys(bucket, f"{PREFIX}/")) == 4
+
+    assert partition_history.main(args) == 0
+    assert list_keys(bucket, f"{PREFIX}/") == [
+        f"{earlier_path}/WDIV/legacy.gz",
+        f"{HOUR_PATH}/WDIV/legacy.gz",
+        f"{HOUR_PATH}/WDIV/stream-0.gz",
+        f"{HOUR_PATH}/_SUCCESS",
+    ]
+    # Running it again finds nothing left to split
+    assert partition_history.main([*args, "--dry-run"]) == 0
+    assert "0 files to split" in capsys.readouterr().out
+
+
+def test_partition_history_reports_failures(partition_history, bucket):
+    put_log_file(bucket, f"{HOUR_PATH}/broken.gz", ["not json"])
+    assert partition_history.main(["--bucket", bucket]) == 1
+    assert list_keys(bucket, f"{PREFIX}/") == [f"{HOUR_PATH}/broken.gz"]
+
+
+def test_late_file_merged_into_compacted(compact_logs, bucket):
+    put_partition(bucket)
+    compact_logs.compact_hour(bucket, PREFIX, HOUR)
+    put_log_file(bucket, f"{HOUR_PATH}/WCIVF/stream-3.gz", ["late"])
+
+    compact_logs.compact_hour(bucket, PREFIX, HOUR)
+    assert list_keys(bucket, f"{HOUR_PATH}/WCIVF/") == [
+        f"{HOUR_PATH}/WCIVF/compacted-2024050221-0.gz"
+    ]
+    lines = read_lines(bucket, f"{HOUR_PATH}/WCIVF/compacted-2024050221-0.gz")
+    assert len(lines) == 7
+    assert lines[-1] == "late"
+
+
+def test_target_file_size(compact_logs, bucket, monkeypatch):
+    monkeypatch.setattr(compact_logs, "TARGET_FILE_SIZE", 1)
+    put_partition(bucket)
+
+    manifests = compact_logs.compact_hour(bucket, PREFIX, HOUR)
+    assert len(manifests[0]["outputs"]) == 3
+    assert list_keys(bucket, f"{HOUR_PATH}/WCIVF/") == [
+        f"{HOUR_PATH}/WCIVF/compacted-2024050221-{part}.gz" for part in range(3)
+    ]
+
+
+def test_interrupted_compaction_finished(compact_logs, bucket, monkeypatch):
+    put_partition(bucket)
+
+    def interrupted(bucket, manifest):
+        raise RuntimeError("Lambda timed out")
+
+    finish_compaction = compact_logs.finish_compaction
+    monkeypatch.setattr(compact_logs, "finish_compaction", interrupted)
+    with pytest.raises(RuntimeError):
+        compact_logs.compact_hour(bucket, PREFIX, HOUR)
+    # The sources are still in place, alongside the staged file
+    assert len(list_keys(bucket, f"{HOUR_PATH}/WCIVF/")) == 3
+    assert len(list_keys(bucket, f"{PREFIX}-compaction/staging/")) == 1
+
+    monkeypatch.setattr(compact_logs, "finish_compaction", finish_compaction)
+    assert compact_logs.compact_hour(bucket, PREFIX, HOUR) == []
+    assert list_keys(bucket, f"{HOUR_PATH}/WCIVF/") == [
+        f"{HOUR_PATH}/WCIVF/compacted-2024050221-0.gz"
+    ]
+    assert list_keys(bucket, f"{PREFIX}-compaction/staging/") == []
+
+
+def test_interrupted_compaction_finished_by_another_hour(
+    compact_logs, bucket, monkeypatch
+):
+    put_partition(bucket)
+
+    def interrupted(bucket, manifest):
+        raise RuntimeError("Lambda timed out")
+
+    finish_compaction = compact_logs.finish_compaction
+    monkeypatch.setattr(compact_logs, "finish_compaction", interrupted)
+    with pytest.raises(RuntimeError):
+        compact_logs.compact_hour(bucket, PREFIX, HOUR)
+    assert list_keys(bucket, f"{PREFIX}-compaction/pending/") == [
+        f"{PREFIX}-compaction/pending/2024/05/02/21/WCIVF.json"
+    ]
+
+    # The hour is never compacted again, as the next run is for the next one
+    monkeypatch.setattr(compact_logs, "finish_compaction", finish_compaction)
+    next_hour = HOUR + datetime.timedelta(hours=1)
+    assert compact_logs.compact_hour(bucket, PREFIX, next_hour) == []
+    assert list_keys(bucket, f"{HOUR_PATH}/WCIVF/") == [
+        f"{HOUR_PATH}/WCIVF/compacted-2024050221-0.gz"
+    ]
+    assert list_keys(bucket, f"{PREFIX}-compaction/staging/") == []
+    assert list_keys(bucket, f"{PREFIX}-compaction/pending/") == []
+    manifest = json.load(
+        boto3.client("s3", region_name="eu-west-2").get_object(
+            Bucket=bucket,
+            Key=f"{PREFIX}-compaction/manifests/2024/05/02/21/WCIVF.json",
+        )["Body"]
+    )
+    assert manifest["status"] == "complete"
+
+
+def test_dry_run(compact_logs, bucket):
+    put_partition(bucket)
+    keys = list_keys(bucket)
+
+    manifests = compact_logs.compact_hour(bucket, PREFIX, HOUR, dry_run=True)
+    assert [manifest["status"] for manifest in manifests] == ["dry run"]
+    assert list_keys(bucket) == keys
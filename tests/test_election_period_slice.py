@@ -0,0 +1,118 @@
+from pathlib import Path
+from string import Template
+
+import pytest
+
+duckdb = pytest.importorskip("duckdb")
+
+ROOT = Path(__file__).parent.parent
+QUERY_PATH = (
+    ROOT / "dc_logging_aws/queries/election_reporting/election_period_slice.sql"
+)
+
+QUERY_CONTEXT = {
+    "slice_table": "election_period_slice_test",
+    "hours_table": "election_period_hours_test",
+    "start_of_election_period_day": "2024/05/01",
+    "polling_day": "2024/05/02",
+    "updown_api_key": "updown",
+    "start_datetime_utc": "2024-05-01 00:00",
+    "end_datetime_utc": "2024-05-02 21:00",
+    "start_datetime_london": "2024-05-01 00:00",
+    "end_datetime_london": "2024-05-02 22:00",
+    "hours_cutoff_day": "2024/05/02",
+    "hours_cutoff_hour": 11,
+}
+
+
+def slice_select(context):
+    """
+    The SELECT the slice table is created from, as DuckDB runs most of
+    Athena's SQL, but not its CREATE TABLE options
+    """
+    query = Template(QUERY_PATH.read_text()).substitute(
+        slice_location="s3://results/election-period-slices/"
+    )
+    query = query.format(**context)
+    return query.split(") AS\n", 1)[1].strip().rstrip(";")
+
+
+@pytest.fixture
+def athena():
+    db = duckdb.connect()
+    db.execute('CREATE SCHEMA "dc-wide-logs"')
+    db.execute(
+        """
+        CREATE TABLE "dc-wide-logs"."dc_postcode_searches_all" (
+            "timestamp" TIMESTAMP, "dc_product" VARCHAR, "api_key" VARCHAR,
+            "utm_source" VARCHAR, "calls_devs_dc_api" BOOLEAN,
+            "had_election" BOOLEAN, "postcode" VARCHAR,
+            "normalised_postcode" VARCHAR, "day" VARCHAR, "hour" INTEGER
+        )
+        """
+    )
+    db.execute(
+        """
+        CREATE TABLE "dc-wide-logs"."postcode_lookup" (
+            "normalised_postcode" VARCHAR, "lad25cd" VARCHAR
+        )
+        """
+    )
+    db.execute(
+        """
+        INSERT INTO "dc-wide-logs"."postcode_lookup"
+        VALUES ('SW1A1AA', 'E09000033')
+        """
+    )
+    db.execute(
+        """
+        CREATE TABLE "dc-wide-logs"."election_period_hours_test" (
+            "hour_start" TIMESTAMP, "dc_product" VARCHAR, "api_key" VARCHAR,
+            "utm_source" VARCHAR, "calls_devs_dc_api" BOOLEAN,
+            "had_election" BOOLEAN, "lad25cd" VARCHAR, "searches" BIGINT,
+            "day" VARCHAR, "hour" INTEGER
+        )
+        """
+    )
+    return db
+
+
+def add_logs(db, hour, count):
+    for _ in range(count):
+        db.execute(
+            """
+            INSERT INTO "dc-wide-logs"."dc_postcode_searches_all"
+            VALUES (?, 'WCIVF', 'key', '', false, true, 'SW1A 1AA', 'SW1A1AA',
+                ?, ?)
+            """,
+            [f"2024-05-02 {hour:02}:30", "2024/05/02", hour],
+        )
+
+
+def add_rollup(db, hour, searches):
+    db.execute(
+        """
+        INSERT INTO "dc-wide-logs"."election_period_hours_test"
+        VALUES (?, 'WCIVF', 'key', '', false, true, 'E09000033', ?, ?, ?)
+        """,
+        [f"2024-05-02 {hour:02}:00", searches, "2024-05-02", hour],
+    )
+
+
+def test_slice_counts_hours_without_a_rollup(athena):
+    # 10:00 is before the first hour that wasn't rolled up. 12:00's rollup
+    # came late, so it's in the counts after 11:00, which isn't.
+    for hour, count in [(10, 3), (11, 2), (12, 4), (13, 1)]:
+        add_logs(athena, hour, count)
+    add_rollup(athena, 10, 3)
+    add_rollup(athena, 12, 4)
+
+    rows = athena.execute(
+        f"""
+        SELECT hour("hour_start"), sum("searches")
+        FROM ({slice_select(QUERY_CONTEXT)})
+        GROUP BY 1
+        ORDER BY 1
+        """
+    ).fetchall()
+    assert rows == [(10, 3), (11, 2), (12, 4), (13, 1)]
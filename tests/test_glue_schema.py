@@ -0,0 +1,105 @@
+import base64
+import dataclasses
+import datetime
+import json
+from typing import List, Optional, Union
+
+import pytest
+
+glue = pytest.importorskip("aws_cdk.aws_glue_alpha")
+
+from dc_logging_aws.models.glue_schema import (  # noqa
+    glue_schema,
+    glue_type,
+    presto_type,
+    presto_view_text,
+)
+from dc_logging_client.log_entries import DCProduct  # noqa
+
+
+@pytest.mark.parametrize(
+    "field_type,expected",
+    [
+        (str, "string"),
+        (bool, "boolean"),
+        (int, "int"),
+        (float, "double"),
+        (datetime.datetime, "timestamp"),
+        (DCProduct, "string"),
+        (Optional[int], "int"),
+        (int | None, "int"),
+        (Union[None, datetime.datetime], "timestamp"),
+        (Union[int, str], "string"),
+        (int | str | None, "string"),
+        (List[int], "array<int>"),
+        (list[int] | None, "array<int>"),
+        (dict, "string"),
+    ],
+)
+def test_glue_type(field_type, expected):
+    assert glue_type(field_type).input_string == expected
+
+
+@dataclasses.dataclass
+class Location:
+    lat: float
+    seen: datetime.datetime | None = None
+
+
+@dataclasses.dataclass
+class Entry:
+    postcode: str
+    dc_product: DCProduct
+    locations: list[Location]
+    count: int | None = None
+
+
+def test_glue_schema():
+    schema = glue_schema(Entry, exclude=["dc_product"])
+    assert {name: t.input_string for name, t in schema.items()} == {
+        "postcode": "string",
+        "locations": "array<struct<lat:double,seen:timestamp>>",
+        "count": "int",
+    }
+
+
+@pytest.mark.parametrize(
+    "glue_type_string,expected",
+    [
+        ("string", "varchar"),
+        ("int", "integer"),
+        ("boolean", "boolean"),
+        ("timestamp", "timestamp(3)"),
+        ("array<int>", "array(integer)"),
+        (
+            "array<struct<lat:double,seen:timestamp>>",
+            "array(row(lat double, seen timestamp(3)))",
+        ),
+        (
+            "struct<a:struct<b:int,c:string>,d:array<string>>",
+            "row(a row(b integer, c varchar), d array(varchar))",
+        ),
+    ],
+)
+def test_presto_type(glue_type_string, expected):
+    assert presto_type(glue_type_string) == expected
+
+
+def test_presto_view_text():
+    text = presto_view_text(
+        'SELECT "postcode", "day" FROM "logs"."searches"',
+        "logs",
+        {"postcode": "string", "day": "string"},
+    )
+    assert text.startswith("/* Presto View: ")
+    assert text.endswith(" */")
+    encoded = text[len("/* Presto View: ") : -len(" */")]
+    assert json.loads(base64.b64decode(encoded)) == {
+        "originalSql": 'SELECT "postcode", "day" FROM "logs"."searches"',
+        "catalog": "awsdatacatalog",
+        "schema": "logs",
+        "columns": [
+            {"name": "postcode", "type": "varchar"},
+            {"name": "day", "type": "varchar"},
+        ],
+    }
@@ -0,0 +1,228 @@
+import importlib
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError
+
+ROOT = Path(__file__).parent.parent
+
+
+class RecordingFirehoseClient:
+    """
+    Accepts every record, except that each `fail_first` record is rejected
+    on the first attempt
+    """
+
+    def __init__(self, fail_first=()):
+        self.fail_first = set(fail_first)
+        self.requests = []
+
+    def put_record_batch(self, DeliveryStreamName, Records):
+        self.requests.append([record["Data"] for record in Records])
+        responses = []
+        for record in Records:
+            if record["Data"] in self.fail_first:
+                self.fail_first.discard(record["Data"])
+                responses.append(
+                    {
+                        "ErrorCode": "ServiceUnavailableException",
+                        "ErrorMessage": "Slow down.",
+                    }
+                )
+            else:
+                responses.append({"RecordId": f"id-{len(responses)}"})
+        return {
+            "FailedPutCount": sum("ErrorCode" in r for r in responses),
+            "RequestResponses": responses,
+        }
+
+
+@pytest.fixture
+def ingest_handler(monkeypatch):
+    # The function is deployed with the client's log_entries module
+    # alongside it, rather than the package
+    monkeypatch.setenv("STREAM_NAME", "test-stream")
+    monkeypatch.setenv("ENTRY_CLASS", "PostcodeLogEntry")
+    monkeypatch.syspath_prepend(str(ROOT / "dc_logging_client"))
+    monkeypatch.syspath_prepend(str(ROOT / "dc_logging_aws/lambdas/ingest"))
+    monkeypatch.delitem(sys.modules, "handler", raising=False)
+    module = importlib.import_module("handler")
+    monkeypatch.setattr(module, "firehose_client", RecordingFirehoseClient())
+    monkeypatch.setattr(module.time, "sleep", lambda seconds: None)
+    yield module
+    sys.modules.pop("handler", None)
+
+
+# Each runs in a fresh interpreter, so nothing is already imported
+INIT_BENCHMARK = """
+import json, sys, time
+start = time.perf_counter()
+import handler
+print(json.dumps({
+    "init": time.perf_counter() - start,
+    "imported_boto3": "boto3" in sys.modules,
+}))
+"""
+# What init used to do
+REFERENCE_BENCHMARK = """
+import json, time
+start = time.perf_counter()
+import boto3, log_entries
+boto3.client("firehose", region_name="eu-west-2")
+print(json.dumps({"init": time.perf_counter() - start}))
+"""
+
+
+def run_benchmark(code, repeat=3):
+    env = {
+        **os.environ,
+        "STREAM_NAME": "test-stream",
+        "ENTRY_CLASS": "PostcodeLogEntry",
+        "PYTHONPATH": os.pathsep.join(
+            [
+                str(ROOT / "dc_logging_aws/lambdas/ingest"),
+                str(ROOT / "dc_logging_client"),
+            ]
+        ),
+    }
+    return [
+        json.loads(
+            subprocess.run(
+                [sys.executable, "-c", code],
+                env=env,
+                check=True,
+                capture_output=True,
+            ).stdout
+        )
+        for _ in range(repeat)
+    ]
+
+
+def test_handler_init_doesnt_import_boto3():
+    assert not run_benchmark(INIT_BENCHMARK, repeat=1)[0]["imported_boto3"]
+
+
+@pytest.mark.benchmark
+def test_handler_init_benchmark():
+    init = min(t["init"] for t in run_benchmark(INIT_BENCHMARK))
+    reference = min(t["init"] for t in run_benchmark(REFERENCE_BENCHMARK))
+    print(
+        f"\ningest init: {init * 1000:.0f}ms, "
+        f"with boto3: {reference * 1000:.0f}ms"
+    )
+
+
+def entry(postcode="SW1A 1AA"):
+    return {
+        "postcode": postcode,
+        "dc_product": "WCIVF",
+        "timestamp": "2023-01-01 12:00:00",
+    }
+
+
+def test_handler_single_entry(ingest_handler):
+    result = ingest_handler.handler(entry(), None)
+    assert result["sent"] == 1
+    assert result["statuses"] == [{"status": "sent", "record_id": "id-0"}]
+    [[line]] = ingest_handler.firehose_client.requests
+    assert b'"postcode": "SW1A 1AA"' in line
+    assert line.endswith(b"\n")
+
+
+def test_handler_retries_failed_records(ingest_handler):
+    entries = [entry(f"SW1A {i}AA") for i in range(3)]
+    client = ingest_handler.firehose_client
+    failing_line = (
+        ingest_handler.log_entries.PostcodeLogEntry(**entries[1])
+        .as_log_line()
+        .encode("utf-8")
+    )
+    client.fail_first = {failing_line}
+
+    result = ingest_handler.handler(entries, None)
+
+    assert (result["sent"], result["failed"], result["invalid"]) == (3, 0, 0)
+    # Only the record that failed is sent again
+    assert client.requests[1:] == [[failing_line]]
+
+
+def test_handler_reports_persistent_failures(ingest_handler):
+    class FailingClient(RecordingFirehoseClient):
+        def put_record_batch(self, DeliveryStreamName, Records):
+            self.fail_first = {record["Data"] for record in Records}
+            return super().put_record_batch(DeliveryStreamName, Records)
+
+    ingest_handler.firehose_client = FailingClient()
+    result = ingest_handler.handler([entry(), {"postcode": "SW1A 1AA"}], None)
+
+    assert (result["sent"], result["failed"], result["invalid"]) == (0, 1, 1)
+    assert result["statuses"][0] == {
+        "status": "failed",
+        "error": "ServiceUnavailableException: Slow down.",
+        "attempts": ingest_handler.MAX_ATTEMPTS,
+    }
+    assert result["statuses"][1]["status"] == "invalid"
+    assert len(ingest_handler.firehose_client.requests) == 5
+
+
+def test_handler_retries_failed_requests(ingest_handler):
+    class ThrottledClient(RecordingFirehoseClient):
+        def put_record_batch(self, DeliveryStreamName, Records):
+            if not self.requests:
+                self.requests.append(None)
+                raise ClientError(
+                    {
+                        "Error": {
+                            "Code": "ThrottlingException",
+                            "Message": "Rate exceeded",
+                        }
+                    },
+                    "PutRecordBatch",
+                )
+            return super().put_record_batch(DeliveryStreamName, Records)
+
+    ingest_handler.firehose_client = ThrottledClient()
+    result = ingest_handler.handler([entry(), entry("BS4 4NN")], None)
+    assert (result["sent"], result["failed"], result["invalid"]) == (2, 0, 0)
+    assert len(ingest_handler.firehose_client.requests) == 2
+
+
+def test_handler_reports_persistent_request_failures(ingest_handler):
+    class UnreachableClient(RecordingFirehoseClient):
+        def put_record_batch(self, DeliveryStreamName, Records):
+            self.requests.append(None)
+            raise EndpointConnectionError(endpoint_url="https://firehose")
+
+    ingest_handler.firehose_client = UnreachableClient()
+    result = ingest_handler.handler(entry(), None)
+    assert (result["sent"], result["failed"], result["invalid"]) == (0, 1, 0)
+    assert result["statuses"][0]["attempts"] == ingest_handler.MAX_ATTEMPTS
+    assert "https://firehose" in result["statuses"][0]["error"]
+    assert (
+        len(ingest_handler.firehose_client.requests)
+        == ingest_handler.MAX_ATTEMPTS
+    )
+
+
+def test_handler_chunks_batches(ingest_handler, monkeypatch):
+    monkeypatch.setattr(ingest_handler, "MAX_BATCH_RECORDS", 2)
+    result = ingest_handler.handler([entry()] * 5, None)
+    assert result["sent"] == 5
+    assert [len(r) for r in ingest_handler.firehose_client.requests] == [
+        2,
+        2,
+        1,
+    ]
+
+    ingest_handler.firehose_client.requests = []
+    monkeypatch.setattr(ingest_handler, "MAX_BATCH_RECORDS", 500)
+    monkeypatch.setattr(ingest_handler, "MAX_BATCH_BYTES", 250)
+    ingest_handler.handler([entry()] * 5, None)
+    requests = ingest_handler.firehose_client.requests
+    assert len(requests) > 1
+    assert all(sum(map(len, request)) <= 250 for request in requests)
+    assert sum(map(len, requests)) == 5
@@ -0,0 +1,354 @@
+import argparse
+import concurrent.futures
+import datetime
+import gzip
+import importlib.util
+import sys
+import timeit
+from pathlib import Path
+
+import boto3
+import pytest
+
+ROOT = Path(__file__).parent.parent
+
+
+class FakeCursor:
+    """
+    A server side cursor over `rows`
+    """
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+
+    def __iter__(self):
+        return self.rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def execute(self, query, params):
+        pass
+
+    def fetchmany(self, size):
+        return [row for _, row in zip(range(size), self.rows)]
+
+
+class FakeConnection:
+    """
+    A connection whose cursors return `rows`, recording how it was made
+    """
+
+    def __init__(self, rows, **kwargs):
+        self.rows = rows
+        self.kwargs = kwargs
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def cursor(self, name):
+        return FakeCursor(self.rows)
+
+
+@pytest.fixture
+def legacy_import(monkeypatch):
+    spec = importlib.util.spec_from_file_location(
+        "legacy_import", ROOT / "dc_logging_legacy_import/main.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.OPTIONS = argparse.Namespace(dc_product="WCIVF")
+    monkeypatch.setattr(module, "FETCH_BLOCK_SIZE", 3)
+    return module
+
+
+def with_hour(row):
+    # As Postgres adds it, with `date_trunc('hour', created)`
+    return (*row, row[0].replace(minute=0, second=0, microsecond=0))
+
+
+ROWS = [
+    (datetime.datetime(2022, 4, 21, 14, 0, 0), "SW1A 1AA", None, None, None),
+    (
+        datetime.datetime(2022, 4, 21, 14, 59, 59, 999999),
+        "sw1a+1aa",
+        "test",
+        "",
+        'cämpaign "quoted" \\ 🗳️',
+    ),
+    (
+        datetime.datetime(2022, 4, 21, 15, 0, 0, 1000),
+        " bs4 4nn ",
+        "source",
+        "medium",
+        "campaign",
+    ),
+    (
+        datetime.datetime(2022, 4, 21, 15, 30, tzinfo=datetime.timezone.utc),
+        "BS4 4NN",
+        None,
+        "medium",
+        None,
+    ),
+    (
+        datetime.datetime(
+            2022,
+            4,
+            21,
+            16,
+            30,
+            microsecond=123456,
+            tzinfo=datetime.timezone(datetime.timedelta(hours=1)),
+        ),
+        "BS4 4NN",
+        "",
+        "",
+        "",
+    ),
+]
+ROWS = [with_hour(row) for row in ROWS]
+
+
+def test_fast_log_lines_match_entries(legacy_import):
+    expected = list(legacy_import.entry_log_lines(FakeCursor(ROWS)))
+    assert list(legacy_import.fast_log_lines(FakeCursor(ROWS))) == expected
+
+
+def test_fast_log_lines_need_postcode(legacy_import):
+    row = with_hour((datetime.datetime(2022, 4, 21, 14), "", None, None, None))
+    with pytest.raises(ValueError):
+        list(legacy_import.entry_log_lines(FakeCursor([row])))
+    with pytest.raises(ValueError):
+        list(legacy_import.fast_log_lines(FakeCursor([row])))
+
+
+def test_hourly_batches(legacy_import):
+    legacy_import.OPTIONS.target_file_size = None
+    rows = [
+        with_hour(
+            (
+                datetime.datetime(2022, 4, day, 14, 30),
+                "SW1A 1AA",
+                None,
+                None,
+                None,
+            )
+        )
+        for day in (20, 20, 21, 22)
+    ]
+    files = [
+        (key, gzip.decompress(data.read()).decode("utf-8").count("\n"))
+        for batch in legacy_import.hourly_batches(
+            legacy_import.fast_log_lines(FakeCursor(rows))
+        )
+        for key, data in legacy_import.serialize_to_files(batch)
+    ]
+    # The same hour on different days is in different files
+    assert files == [
+        ("2022/04/20/14/WCIVF/WCIVF", 2),
+        ("2022/04/21/14/WCIVF/WCIVF", 1),
+        ("2022/04/22/14/WCIVF/WCIVF", 1),
+    ]
+
+
+def test_target_file_size(legacy_import):
+    legacy_import.OPTIONS.target_file_size = 1
+    rows = [
+        with_hour(
+            (
+                datetime.datetime(2022, 4, 21, 14, minute),
+                "SW1A 1AA",
+                None,
+                None,
+                None,
+            )
+        )
+        for minute in range(3)
+    ]
+    batches = legacy_import.hourly_batches(
+        legacy_import.fast_log_lines(FakeCursor(rows))
+    )
+    files = [
+        (key, gzip.decompress(data.read()).decode("utf-8").count("\n"))
+        for batch in batches
+        for key, data in legacy_import.serialize_to_files(batch)
+    ]
+    assert files == [
+        ("2022/04/21/14/WCIVF/WCIVF", 1),
+        ("2022/04/21/14/WCIVF/WCIVF-1", 1),
+        ("2022/04/21/14/WCIVF/WCIVF-2", 1),
+    ]
+
+
+def test_import_shard_replaces_earlier_files(
+    legacy_import, monkeypatch, mock_aws_services
+):
+    s3 = boto3.client("s3", region_name="eu-west-2")
+    s3.create_bucket(
+        Bucket="legacy-import",
+        CreateBucketConfiguration={"LocationConstraint": "eu-west-2"},
+    )
+    partition = "dc-postcode-searches/2022/04/21/14/WCIVF"
+    # An earlier import with a smaller target size, and a file from Firehose
+    for name in ("WCIVF", "WCIVF-1", "WCIVF-2", "firehose-1"):
+        s3.put_object(
+            Bucket="legacy-import", Key=f"{partition}/{name}.gz", Body=b""
+        )
+
+    connections = []
+
+    def connect(**kwargs):
+        connections.append(FakeConnection(ROWS[:2], **kwargs))
+        return connections[-1]
+
+    monkeypatch.setattr(legacy_import.psycopg, "connect", connect)
+    legacy_import.s3 = s3
+    legacy_import.OPTIONS = argparse.Namespace(
+        dc_product="WCIVF",
+        bucket="legacy-import",
+        prefix="dc-postcode-searches/",
+        start=datetime.datetime(2022, 4, 21),
+        end=datetime.datetime(2022, 4, 22),
+        upload_threads=2,
+        multipart_threshold=64 * 1024 * 1024,
+        fast=True,
+        target_file_size=None,
+    )
+
+    shard = (datetime.datetime(2022, 4, 21), datetime.datetime(2022, 4, 22))
+    assert legacy_import.import_shard(shard)[0] == 1
+    # Hours are grouped in UTC
+    assert connections[0].kwargs == {"options": "-c TimeZone=UTC"}
+    keys = [
+        item["Key"]
+        for item in s3.list_objects_v2(Bucket="legacy-import")["Contents"]
+    ]
+    assert sorted(keys) == [
+        f"{partition}/WCIVF.gz",
+        f"{partition}/firehose-1.gz",
+    ]
+    body = s3.get_object(Bucket="legacy-import", Key=f"{partition}/WCIVF.gz")
+    assert gzip.decompress(body["Body"].read()).count(b"\n") == 2
+
+
+def test_shards(legacy_import):
+    shards = legacy_import.shards(
+        datetime.datetime(2022, 4, 21, 14, 30),
+        datetime.datetime(2022, 4, 23, 1),
+        24,
+    )
+    # From midnight, including the hour `end` is in
+    assert shards == [
+        (datetime.datetime(2022, 4, day), datetime.datetime(2022, 4, day + 1))
+        for day in (21, 22, 23)
+    ]
+
+
+def test_shards_not_dividing_a_day(legacy_import):
+    start = datetime.datetime(2022, 4, 21, 14, 30)
+    end = datetime.datetime(2022, 4, 23, 1)
+    shards = legacy_import.shards(start, end, 7)
+    assert shards[0][0] <= start < shards[0][1]
+    assert shards[-1][0] <= end < shards[-1][1]
+    for (_, shard_end), (next_start, _) in zip(shards, shards[1:]):
+        assert shard_end == next_start
+    # A later start gets the same shards, so no hour is in two of them
+    later = legacy_import.shards(datetime.datetime(2022, 4, 22, 3), end, 7)
+    assert later == [shard for shard in shards if shard[1] > later[0][0]]
+
+
+def test_manifest_skips_done_shards(legacy_import, tmp_path):
+    legacy_import.OPTIONS = argparse.Namespace(
+        dc_product="WCIVF",
+        bucket="legacy-import",
+        prefix="dc-postcode-searches/",
+        start=datetime.datetime(2022, 4, 21, 14, 30),
+        end=datetime.datetime(2022, 4, 23, 1),
+    )
+    shards = legacy_import.shards(
+        legacy_import.OPTIONS.start, legacy_import.OPTIONS.end, 24
+    )
+    manifest = tmp_path / "manifest.jsonl"
+    assert legacy_import.read_manifest(manifest) == set()
+
+    manifest.write_text(legacy_import.manifest_entry(shards[0]) + "\n\n")
+    completed = legacy_import.read_manifest(manifest)
+    assert [
+        shard
+        for shard in shards
+        if legacy_import.manifest_entry(shard) not in completed
+    ] == shards[1:]
+    # The first shard only had the logs from `start`
+    assert '"from": "2022-04-21T14:30:00"' in completed.pop()
+
+
+class SerialExecutor(concurrent.futures.ThreadPoolExecutor):
+    """
+    Runs shards in a thread of this process, so they can be faked
+    """
+
+    def __init__(self, max_workers, initializer, initargs):
+        super().__init__(max_workers=1)
+
+
+def test_failed_shard_doesnt_stop_others(legacy_import, monkeypatch, tmp_path):
+    legacy_import.OPTIONS = argparse.Namespace(
+        dc_product="WCIVF",
+        bucket="legacy-import",
+        prefix="dc-postcode-searches/",
+        start=datetime.datetime(2022, 4, 21),
+        end=datetime.datetime(2022, 4, 23, 23),
+        shard_hours=24,
+        workers=1,
+        manifest=str(tmp_path / "manifest.jsonl"),
+    )
+
+    def import_shard(shard):
+        if shard[0].day == 22:
+            raise RuntimeError("Connection lost")
+        return 1, 100
+
+    monkeypatch.setattr(legacy_import, "import_shard", import_shard)
+    monkeypatch.setattr(
+        legacy_import.concurrent.futures, "ProcessPoolExecutor", SerialExecutor
+    )
+    with pytest.raises(SystemExit, match="1 of 3 shards failed"):
+        legacy_import.main()
+
+    completed = legacy_import.read_manifest(tmp_path / "manifest.jsonl")
+    shards = legacy_import.shards(
+        legacy_import.OPTIONS.start, legacy_import.OPTIONS.end, 24
+    )
+    assert completed == {
+        legacy_import.manifest_entry(shards[0]),
+        legacy_import.manifest_entry(shards[2]),
+    }
+
+
+@pytest.mark.benchmark
+def test_fast_log_lines_benchmark(legacy_import, monkeypatch):
+    monkeypatch.setattr(legacy_import, "FETCH_BLOCK_SIZE", 10_000)
+    rows = ROWS[:3] * 5_000
+
+    def rows_per_second(log_lines):
+        seconds = min(
+            timeit.repeat(
+                lambda: list(log_lines(FakeCursor(rows))), number=1, repeat=3
+            )
+        )
+        return len(rows) / seconds
+
+    entries = rows_per_second(legacy_import.entry_log_lines)
+    fast = rows_per_second(legacy_import.fast_log_lines)
+    print(
+        f"\nfast_log_lines: {fast:,.0f} rows/s, "
+        f"entry_log_lines: {entries:,.0f} rows/s"
+    )
+    if sys.gettrace() is None:
+        assert fast > entries
@@ -1,10 +1,13 @@
+import gc
 import json
+import time
+import weakref
 from dataclasses import dataclass
 
 import boto3
 import pytest
 
-from dc_logging_client import DCProduct
+from dc_logging_client import DCProduct, log_client
 from dc_logging_client.log_client import (
     DCWidePostcodeLoggingClient,
 )
@@ -37,6 +40,7 @@ def test_log(cdk, mock_log_streams):
         "api_key": "",
         "dc_product": "WCIVF",
         "postcode": "SW1A 1AA",
+        "normalised_postcode": "SW1A1AA",
         "had_election": False,
         "utm_campaign": "",
         "utm_medium": "",
@@ -68,3 +72,142 @@ def test_log_invalid_entry(cdk):
     # Allow creating an entry from a string value of the product enum
     entry = logger.entry_class(postcode="SW1A 1AA", dc_product="WCIVF")
     assert entry.dc_product == DCProduct.wcivf.value
+
+
+class RecordingLambdaClient:
+    """
+    Stands in for the boto3 Lambda client, keeping each invocation payload
+    """
+
+    def __init__(self):
+        self.payloads = []
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        self.payloads.append(json.loads(Payload))
+        return {"ResponseMetadata": {"HTTPStatusCode": 202}}
+
+
+def make_buffered_logger(**kwargs):
+    logger = DCWidePostcodeLoggingClient(
+        function_arn="arn:aws:lambda:eu-west-2:000000000000:function:ingest",
+        buffered=True,
+        **kwargs,
+    )
+    logger.transport.client = RecordingLambdaClient()
+    return logger
+
+
+def test_log_buffered_flushes_at_batch_size():
+    logger = make_buffered_logger(max_batch_size=3, max_batch_interval=60)
+    for postcode in ["SW1A 1AA", "SW1A 1AB", "SW1A 1AC", "SW1A 1AD"]:
+        logger.log(
+            logger.entry_class(
+                postcode=postcode, dc_product=logger.dc_product.wcivf
+            )
+        )
+    assert len(logger.transport.client.payloads) == 1
+    assert [
+        entry["postcode"] for entry in logger.transport.client.payloads[0]
+    ] == [
+        "SW1A 1AA",
+        "SW1A 1AB",
+        "SW1A 1AC",
+    ]
+
+    logger.close()
+    assert len(logger.transport.client.payloads) == 2
+    # A batch of one is sent as a single entry
+    assert logger.transport.client.payloads[1]["postcode"] == "SW1A 1AD"
+
+
+def test_log_buffered_flushes_after_interval():
+    logger = make_buffered_logger(max_batch_size=100, max_batch_interval=0.1)
+    logger.log(
+        logger.entry_class(
+            postcode="SW1A 1AA", dc_product=logger.dc_product.wcivf
+        )
+    )
+    assert logger.transport.client.payloads == []
+    for _ in range(50):
+        if logger.transport.client.payloads:
+            break
+        time.sleep(0.05)
+    assert len(logger.transport.client.payloads) == 1
+    logger.close()
+
+
+def test_log_background():
+    logger = DCWidePostcodeLoggingClient(
+        function_arn="arn:aws:lambda:eu-west-2:000000000000:function:ingest",
+        background=True,
+    )
+    logger.transport.client = RecordingLambdaClient()
+    logger.log(
+        logger.entry_class(
+            postcode="SW1A 1AA", dc_product=logger.dc_product.wcivf
+        )
+    )
+    logger.flush()
+    # Without buffering, each entry is sent on its own
+    assert logger.transport.client.payloads[0]["postcode"] == "SW1A 1AA"
+    assert logger.stats().sent == 1
+    logger.close()
+
+
+def test_log_buffered_client_garbage_collected():
+    logger = make_buffered_logger(max_batch_size=100, max_batch_interval=60)
+    lambda_client = logger.transport.client
+    logger.log(
+        logger.entry_class(
+            postcode="SW1A 1AA", dc_product=logger.dc_product.wcivf
+        )
+    )
+    flush_thread = logger._flush_thread
+    logger_ref = weakref.ref(logger)
+    assert logger in log_client._open_clients
+
+    # Neither the flush thread nor the exit hook keep the client alive
+    del logger
+    gc.collect()
+    assert logger_ref() is None
+    flush_thread.join(timeout=5)
+    assert not flush_thread.is_alive()
+    # What was still buffered is sent
+    assert lambda_client.payloads[0]["postcode"] == "SW1A 1AA"
+
+
+def test_log_background_client_garbage_collected():
+    logger = DCWidePostcodeLoggingClient(
+        function_arn="arn:aws:lambda:eu-west-2:000000000000:function:ingest",
+        background=True,
+    )
+    lambda_client = logger.transport.client = RecordingLambdaClient()
+    logger.log(
+        logger.entry_class(
+            postcode="SW1A 1AA", dc_product=logger.dc_product.wcivf
+        )
+    )
+    workers = logger.sender._workers
+    logger_ref = weakref.ref(logger)
+
+    del logger
+    gc.collect()
+    assert logger_ref() is None
+    for worker in workers:
+        worker.join(timeout=5)
+        assert not worker.is_alive()
+    assert lambda_client.payloads[0]["postcode"] == "SW1A 1AA"
+
+
+def test_open_clients_closed_at_exit():
+    logger = make_buffered_logger(max_batch_size=100, max_batch_interval=60)
+    logger.log(
+        logger.entry_class(
+            postcode="SW1A 1AA", dc_product=logger.dc_product.wcivf
+        )
+    )
+    log_client._close_open_clients()
+    assert len(logger.transport.client.payloads) == 1
+    assert logger not in log_client._open_clients
+    logger._flush_thread.join(timeout=5)
+    assert not logger._flush_thread.is_alive()
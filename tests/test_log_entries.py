@@ -0,0 +1,243 @@
+import dataclasses
+import datetime
+import gc
+import json
+import sys
+import timeit
+import tracemalloc
+from typing import List
+
+import pytest
+
+from dc_logging_client.log_entries import (
+    BaseLogEntry,
+    DCProduct,
+    PostcodeLogEntry,
+    UTMMixin,
+    ValidDCProductMixin,
+    normalise_postcode,
+)
+
+
+def reference_log_line(entry, newline=True):
+    """
+    How `as_log_line` used to serialize entries, for comparison
+    """
+    data = {f.name: getattr(entry, f.name) for f in dataclasses.fields(entry)}
+    for k, v in data.items():
+        if isinstance(v, datetime.datetime):
+            data[k] = v.strftime("%Y-%m-%d %H:%M:%S.%f")[0:-3]
+    newline_char = "\n" if newline else ""
+    json_data = json.dumps(data, sort_keys=True, default=str)
+    return f"{json_data}{newline_char}"
+
+
+ENTRIES = [
+    {"postcode": "SW1A 1AA", "dc_product": "WCIVF"},
+    {
+        "postcode": "SW1A 1AA",
+        "dc_product": "AGGREGATOR_API",
+        "timestamp": datetime.datetime(2023, 5, 4, 21, 59, 59, 999999),
+        "api_key": "abc123",
+        "calls_devs_dc_api": True,
+        "had_election": True,
+        "utm_source": "test",
+        "utm_campaign": 'cämpaign "quoted" \\ 🗳️',
+        "utm_medium": None,
+    },
+    {
+        "postcode": "BS4 4NN",
+        "dc_product": "WDIV",
+        "timestamp": "2023-05-04 12:00:00.123",
+    },
+    {
+        "postcode": "BS4 4NN",
+        "dc_product": "WDIV",
+        "timestamp": datetime.datetime(
+            2023, 5, 4, 12, 0, tzinfo=datetime.timezone.utc
+        ),
+    },
+]
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [
+        ("WCIVF", DCProduct.wcivf),
+        ("wcivf", DCProduct.wcivf),
+        (" Wdiv ", DCProduct.wdiv),
+        ("AGGREGATOR_API", DCProduct.aggregator_api),
+        ("aggregator-api", DCProduct.aggregator_api),
+        ("Election Leaflets", DCProduct.election_leaflets),
+    ],
+)
+def test_dc_product_from_str_value(value, expected):
+    assert DCProduct.from_str_value(value) is expected
+    entry = PostcodeLogEntry(postcode="SW1A 1AA", dc_product=value)
+    assert entry.dc_product == expected.value
+
+
+@pytest.mark.parametrize("value", ["new product", "", None, ["WCIVF"]])
+def test_dc_product_from_str_value_invalid(value):
+    with pytest.raises(ValueError):
+        DCProduct.from_str_value(value)
+
+
+@pytest.mark.parametrize("kwargs", ENTRIES)
+def test_as_log_line_matches_reference(kwargs):
+    entry = PostcodeLogEntry(**kwargs)
+    expected = reference_log_line(entry)
+    assert entry.as_log_line() == expected
+    assert entry.as_log_line(newline=False) == expected[:-1]
+
+
+@pytest.mark.parametrize(
+    "postcode,expected",
+    [
+        ("SW1A 1AA", "SW1A1AA"),
+        ("sw1a1aa", "SW1A1AA"),
+        (" bs4  4nn ", "BS44NN"),
+        ("SW1A+1AA", "SW1A1AA"),
+    ],
+)
+def test_normalised_postcode(postcode, expected):
+    assert normalise_postcode(postcode) == expected
+    entry = PostcodeLogEntry(
+        postcode=postcode, dc_product="WCIVF", normalised_postcode="stale"
+    )
+    assert entry.normalised_postcode == expected
+    assert json.loads(entry.as_log_line())["normalised_postcode"] == expected
+
+
+def test_as_log_line_doesnt_mutate_entry():
+    timestamp = datetime.datetime(2023, 5, 4, 12, 0)
+    entry = PostcodeLogEntry(
+        postcode="SW1A 1AA", dc_product="WCIVF", timestamp=timestamp
+    )
+    first = entry.as_log_line()
+    assert entry.timestamp == timestamp
+    assert entry.as_log_line() == first
+
+
+@dataclasses.dataclass
+class Location:
+    lat: float
+    seen: datetime.datetime
+
+
+@dataclasses.dataclass
+class NestedLogEntry(BaseLogEntry):
+    product: DCProduct
+    locations: List[Location]
+
+
+def test_as_log_line_nested_types():
+    # Matches the Glue schema generated for the entry: enums by value, and
+    # nested dataclasses as structs
+    entry = NestedLogEntry(
+        product=DCProduct.wdiv,
+        locations=[Location(lat=51.5, seen=datetime.datetime(2023, 5, 4))],
+    )
+    assert json.loads(entry.as_log_line()) == {
+        "product": "WDIV",
+        "locations": [{"lat": 51.5, "seen": "2023-05-04 00:00:00.000"}],
+    }
+
+
+@pytest.mark.benchmark
+def test_as_log_line_benchmark():
+    entry = PostcodeLogEntry(**ENTRIES[1])
+    number = 20_000
+    reference = min(
+        timeit.repeat(
+            lambda: reference_log_line(entry), number=number, repeat=3
+        )
+    )
+    compiled = min(
+        timeit.repeat(lambda: entry.as_log_line(), number=number, repeat=3)
+    )
+    print(
+        f"\nas_log_line: {compiled / number * 1e6:.2f}µs per entry, "
+        f"reference: {reference / number * 1e6:.2f}µs per entry"
+    )
+    if sys.gettrace() is None:
+        # Tracers, e.g. coverage, slow down Python code far more than the C
+        # code the reference spends most of its time in
+        assert compiled < reference
+
+
+@dataclasses.dataclass
+class DictPostcodeLogEntry(BaseLogEntry, UTMMixin, ValidDCProductMixin):
+    """
+    PostcodeLogEntry as it was before it used __slots__, for comparison
+    """
+
+    postcode: str = dataclasses.field(default_factory=str)
+    timestamp: datetime.datetime = dataclasses.field(
+        default_factory=datetime.datetime.now
+    )
+    api_key: str = ""
+    calls_devs_dc_api: bool = False
+    had_election: bool = False
+    normalised_postcode: str = ""
+
+    def __post_init__(self):
+        super().__post_init__()
+        if not self.postcode:
+            raise ValueError("Postcode required")
+        self.normalised_postcode = normalise_postcode(self.postcode)
+        if not self.timestamp:
+            self.timestamp = datetime.datetime.now()
+        if isinstance(self.timestamp, str):
+            self.timestamp = datetime.datetime.fromisoformat(self.timestamp)
+
+
+def test_entries_have_no_dict():
+    entry = PostcodeLogEntry(postcode="SW1A 1AA", dc_product="WCIVF")
+    assert not hasattr(entry, "__dict__")
+    with pytest.raises(AttributeError):
+        entry.not_a_field = True
+    assert list(PostcodeLogEntry.__dataclass_fields__) == [
+        f.name for f in dataclasses.fields(DictPostcodeLogEntry)
+    ]
+
+
+def measure_entries(entry_class, number=10_000):
+    """
+    Returns the bytes allocated per entry, and the seconds taken to make one
+    """
+    timestamp = datetime.datetime(2023, 5, 4, 12, 0)
+    gc.collect()
+    tracemalloc.start()
+    entries = [
+        entry_class(
+            postcode="SW1A 1AA", dc_product="WCIVF", timestamp=timestamp
+        )
+        for _ in range(number)
+    ]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del entries
+
+    seconds = min(
+        timeit.repeat(
+            lambda: entry_class(
+                postcode="SW1A 1AA", dc_product="WCIVF", timestamp=timestamp
+            ),
+            number=number,
+            repeat=3,
+        )
+    )
+    return size / number, seconds / number
+
+
+@pytest.mark.benchmark
+def test_entry_memory_benchmark():
+    slots_size, slots_time = measure_entries(PostcodeLogEntry)
+    dict_size, dict_time = measure_entries(DictPostcodeLogEntry)
+    print(
+        f"\nPostcodeLogEntry: {slots_size:.0f} bytes, {slots_time * 1e6:.2f}µs "
+        f"per entry. With __dict__: {dict_size:.0f} bytes, "
+        f"{dict_time * 1e6:.2f}µs per entry"
+    )
+    assert slots_size < dict_size
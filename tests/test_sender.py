@@ -0,0 +1,86 @@
+import threading
+
+from dc_logging_client.sender import BackgroundSender, OverflowPolicy
+
+
+class BlockedSend:
+    """
+    A `send_batch` callable that waits until released, so the queue fills up
+    """
+
+    def __init__(self, accept=True):
+        self.accept = accept
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.batches = []
+
+    def __call__(self, batch):
+        self.started.set()
+        self.release.wait(5)
+        self.batches.append(batch)
+        return self.accept
+
+
+def fill_queue(overflow_policy):
+    send = BlockedSend()
+    sender = BackgroundSender(
+        send,
+        max_queue_size=2,
+        worker_count=1,
+        overflow_policy=overflow_policy,
+        max_batch_size=1,
+    )
+    # The single worker takes the first line and blocks sending it
+    sender.submit("0")
+    assert send.started.wait(5)
+    for line in ["1", "2", "3"]:
+        sender.submit(line)
+    send.release.set()
+    sender.close()
+    return send, sender
+
+
+def test_drop_oldest():
+    send, sender = fill_queue(OverflowPolicy.drop_oldest)
+    assert send.batches == [["0"], ["2"], ["3"]]
+    stats = sender.stats()
+    assert (stats.queued, stats.sent, stats.dropped, stats.failed) == (
+        4,
+        3,
+        1,
+        0,
+    )
+
+
+def test_drop_newest():
+    send, sender = fill_queue(OverflowPolicy.drop_newest)
+    assert send.batches == [["0"], ["1"], ["2"]]
+    stats = sender.stats()
+    assert (stats.queued, stats.sent, stats.dropped) == (3, 3, 1)
+
+
+def test_failures_are_counted():
+    def send(batch):
+        raise ConnectionError("AWS is having a bad day")
+
+    sender = BackgroundSender(send, worker_count=1, max_batch_size=10)
+    for line in ["1", "2", "3"]:
+        sender.submit(line)
+    sender.close()
+    stats = sender.stats()
+    assert stats.failed == 3
+    assert stats.sent == 0
+
+
+def test_batches_fill_up_to_max_batch_size():
+    batches = []
+    sender = BackgroundSender(
+        lambda batch: batches.append(batch) or True,
+        worker_count=1,
+        max_batch_size=3,
+        max_batch_wait=60,
+    )
+    for line in "abcde":
+        sender.submit(line)
+    sender.close()
+    assert batches == [["a", "b", "c"], ["d", "e"]]
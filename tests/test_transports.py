@@ -0,0 +1,104 @@
+import datetime
+import json
+import os
+
+import boto3
+
+from dc_logging_client import (
+    DCWidePostcodeLoggingClient,
+    FirehoseTransport,
+    LambdaTransport,
+)
+
+# moto keeps resources per account, and creates the test streams in its
+# default account
+ROLE_ARN = "arn:aws:iam::123456789012:role/put-record-from-111111111111"
+
+
+def read_all_logs():
+    s3_client = boto3.client("s3", region_name="eu-west-2")
+    for item in s3_client.list_objects(Bucket="test-bucket").get(
+        "Contents", []
+    ):
+        body = s3_client.get_object(Key=item["Key"], Bucket="test-bucket")[
+            "Body"
+        ]
+        for line in body.readlines():
+            yield json.loads(line)
+
+
+def test_log_with_firehose_transport(mock_log_streams):
+    logger = DCWidePostcodeLoggingClient(
+        transport=FirehoseTransport(role_arn=ROLE_ARN)
+    )
+    logger.log(
+        logger.entry_class(
+            postcode="FH1 1AA", dc_product=logger.dc_product.wdiv
+        )
+    )
+    logs = [log for log in read_all_logs() if log["postcode"] == "FH1 1AA"]
+    assert len(logs) == 1
+    assert logs[0]["dc_product"] == "WDIV"
+
+
+class RecordingSTSClient:
+    def __init__(self, expires_in):
+        self.expires_in = expires_in
+        self.calls = 0
+
+    def assume_role(self, RoleArn, RoleSessionName):
+        self.calls += 1
+        return {
+            "Credentials": {
+                "AccessKeyId": f"key-{self.calls}",
+                "SecretAccessKey": "secret",
+                "SessionToken": "token",
+                "Expiration": datetime.datetime.now(datetime.timezone.utc)
+                + self.expires_in,
+            }
+        }
+
+
+def test_firehose_transport_caches_credentials():
+    transport = FirehoseTransport(role_arn=ROLE_ARN)
+    transport.sts_client = RecordingSTSClient(datetime.timedelta(hours=1))
+    client = transport.client
+    assert transport.client is client
+    assert transport.sts_client.calls == 1
+
+
+def test_firehose_transport_refreshes_expiring_credentials():
+    transport = FirehoseTransport(role_arn=ROLE_ARN)
+    transport.sts_client = RecordingSTSClient(datetime.timedelta(minutes=2))
+    client = transport.client
+    assert transport.client is not client
+    assert transport.sts_client.calls == 2
+
+
+def test_firehose_transport_chunks_to_batch_limits():
+    transport = FirehoseTransport(role_arn=ROLE_ARN)
+    chunks = list(transport._chunks(["x" * 10] * 1001))
+    assert [len(chunk) for chunk in chunks] == [500, 500, 1]
+
+    line = "x" * (1024 * 1024)
+    chunks = list(transport._chunks([line] * 5))
+    assert [len(chunk) for chunk in chunks] == [3, 2]
+
+
+def test_lambda_transport_gets_new_client_after_fork():
+    transport = LambdaTransport(
+        "arn:aws:lambda:eu-west-2:000000000000:function:ingest"
+    )
+    client = transport.client
+    assert transport.client is client
+
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        # In the child
+        shared = transport.client is client
+        os.write(write_fd, b"shared" if shared else b"new")
+        os._exit(0)
+    os.waitpid(pid, 0)
+    assert os.read(read_fd, 10) == b"new"
+    assert transport.client is client